@@ -0,0 +1,76 @@
+"""Synthetic per-user corpora written straight into the vector store."""
+from typing import List
+import base64
+import io
+import random
+import uuid
+
+from benchmarks.fakes import hashed_bytes_vector, hashed_text_vector, CLIP_DIM, TEXT_DIM
+
+VOCABULARY = (
+    "beach sunset mountain river city street market dog cat bird tree flower car train "
+    "bridge tower museum garden forest snow rain cloud sky ocean boat harbor festival "
+    "family friend child teacher doctor kitchen recipe bread coffee tea book letter "
+    "report meeting budget invoice contract travel ticket hotel airport map photo"
+).split()
+
+SEED_BATCH = 256
+
+
+def tiny_png(seed: int) -> bytes:
+    from PIL import Image
+
+    rng = random.Random(seed)
+    color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    buf = io.BytesIO()
+    Image.new("RGB", (16, 16), color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def random_text(rng: random.Random, words: int = 40) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def random_query(seed: int = 0, words: int = 4) -> str:
+    return random_text(random.Random(seed), words)
+
+
+def seed_user_corpus(user_id: str, size: int, image_ratio: float = 0.2, seed: int = 0) -> List[str]:
+    """
+    Insert `size` encrypted points for `user_id` with the same payload layout uploads use.
+    Returns the point ids.
+    """
+    from qdrant_client.http import models
+    from db import vector_store
+    from services.encryption import encrypt_data
+
+    rng = random.Random(seed)
+    ids: List[str] = []
+    batch = []
+    for i in range(size):
+        point_id = str(uuid.uuid4())
+        is_image = rng.random() < image_ratio
+        text = random_text(rng)
+        payload = {
+            "user_id": user_id,
+            "lang": "en",
+            **vector_store.timestamp_fields(),
+            "type": "image" if is_image else "text",
+            "content": encrypt_data(text),
+        }
+        vectors = {"text": hashed_text_vector(text, TEXT_DIM)}
+        if is_image:
+            png = tiny_png(i)
+            payload.update(vector_store.name_fields(f"photo_{i}.png"))
+            payload["image_b64"] = encrypt_data(base64.b64encode(png).decode("utf-8"))
+            vectors["clip"] = hashed_bytes_vector(png, CLIP_DIM)
+        else:
+            vectors["clip"] = hashed_text_vector(text, CLIP_DIM)
+        batch.append(models.PointStruct(id=point_id, vector=vectors, payload=payload))
+        ids.append(point_id)
+        if len(batch) >= SEED_BATCH:
+            vector_store.qdrant.upsert(collection_name=vector_store.COLLECTION, points=batch)
+            batch = []
+    if batch:
+        vector_store.qdrant.upsert(collection_name=vector_store.COLLECTION, points=batch)
+    return ids
@@ -0,0 +1,168 @@
+"""
+Deterministic stand-ins for the model and Gemini backends, plus an in-memory Qdrant.
+
+Benchmarks and load tests must measure our own code paths, not model downloads or
+network calls, so `install_fakes()` registers replacement `services.embeddings` and
+`services.generation` modules before any router imports them. Embeddings are hashed
+bag-of-words vectors: identical inputs always give identical vectors and texts that
+share words land close together, which keeps ranking behaviour realistic.
+Latency can be injected to emulate model or API time.
+"""
+from typing import List, Optional
+import sys
+import threading
+import time
+import types
+import zlib
+
+import numpy as np
+
+CLIP_DIM = 512
+TEXT_DIM = 384
+
+
+class FakeLatency:
+    """Seconds slept per fake call; mutable so load tests can change it between runs."""
+    embed = 0.0
+    llm = 0.0
+
+
+def _sleep(seconds: float):
+    if seconds > 0:
+        # Blocking on purpose: the real models and SDK calls block the calling thread too
+        time.sleep(seconds)
+
+
+def _embed_sleep():
+    # Timed under the same stage name as the real embeddings module
+    from services.metrics import stage
+
+    with stage("embedding"):
+        _sleep(FakeLatency.embed)
+
+
+def hashed_text_vector(text: str, dim: int) -> List[float]:
+    vec = np.zeros(dim, dtype=np.float32)
+    for tok in (text or "").lower().split() or [""]:
+        h = zlib.crc32(tok.encode("utf-8"))
+        vec[h % dim] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    return (vec / norm if norm else vec).tolist()
+
+
+def hashed_bytes_vector(data: bytes, dim: int) -> List[float]:
+    rng = np.random.default_rng(zlib.crc32(bytes(data)))
+    vec = rng.standard_normal(dim).astype(np.float32)
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+def _embeddings_module() -> types.ModuleType:
+    from services.chunking import word_offsets
+
+    mod = types.ModuleType("services.embeddings")
+    mod.CLIP_DIM = CLIP_DIM
+
+    def clip_text_embedding(text: str):
+        _embed_sleep()
+        return hashed_text_vector(text, CLIP_DIM)
+
+    def clip_text_embeddings(texts):
+        _embed_sleep()
+        return [hashed_text_vector(t, CLIP_DIM) for t in texts]
+
+    def clip_image_embedding(image_bytes: bytes):
+        _embed_sleep()
+        return hashed_bytes_vector(image_bytes, CLIP_DIM)
+
+    def multilingual_text_embedding(text: str):
+        _embed_sleep()
+        return hashed_text_vector(text, TEXT_DIM)
+
+    def clip_image_embeddings(images):
+        _embed_sleep()
+        return [hashed_bytes_vector(b, CLIP_DIM) for b in images]
+
+    def multilingual_text_embeddings(texts, batch_size: int = 32):
+        _embed_sleep()
+        return [hashed_text_vector(t, TEXT_DIM) for t in texts]
+
+    mod.clip_text_embedding = clip_text_embedding
+    mod.clip_text_embeddings = clip_text_embeddings
+    mod.clip_image_embedding = clip_image_embedding
+    mod.multilingual_text_embedding = multilingual_text_embedding
+    mod.clip_image_embeddings = clip_image_embeddings
+    mod.text_token_offsets = word_offsets
+    mod.multilingual_text_embeddings = multilingual_text_embeddings
+    return mod
+
+
+def _generation_module() -> types.ModuleType:
+    mod = types.ModuleType("services.generation")
+
+    def configure_gemini(api_key: str):
+        return None
+
+    def generate_description(content, lang: str, style: str = "descriptive", user_query: Optional[str] = None) -> str:
+        from services.metrics import stage
+
+        with stage("llm"):
+            _sleep(FakeLatency.llm)
+        kind = "image" if isinstance(content, (bytes, bytearray)) else "text"
+        return f"[fake {kind} description in {lang}] {user_query or ''}".strip()
+
+    def generate_story_from_image(image_bytes: bytes, lang: str, theme: Optional[str] = None, length_hint: str = "short") -> str:
+        _sleep(FakeLatency.llm)
+        return f"[fake {length_hint} story in {lang}] {theme or ''}".strip()
+
+    def generate_story_from_text(context: str, lang: str, theme: Optional[str] = None, length_hint: str = "short") -> str:
+        _sleep(FakeLatency.llm)
+        return f"[fake {length_hint} story in {lang}] {theme or ''}".strip()
+
+    mod.configure_gemini = configure_gemini
+    mod.generate_description = generate_description
+    mod.generate_story_from_image = generate_story_from_image
+    mod.generate_story_from_text = generate_story_from_text
+    return mod
+
+
+def install_fakes(embed_latency: float = 0.0, llm_latency: float = 0.0):
+    """Register fake model/Gemini modules. Must run before routers or main are imported."""
+    for name in ("routers.query", "routers.upload", "main"):
+        if name in sys.modules:
+            raise RuntimeError(f"install_fakes() must run before importing {name}")
+    FakeLatency.embed = embed_latency
+    FakeLatency.llm = llm_latency
+    sys.modules["services.embeddings"] = _embeddings_module()
+    sys.modules["services.generation"] = _generation_module()
+
+
+class _SerializedClient:
+    """
+    A local-mode QdrantClient that runs one call at a time. Local mode is not
+    thread-safe, and handlers call it from worker threads.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+
+def use_local_qdrant(path: Optional[str] = None):
+    """Point db.vector_store at qdrant-client's local mode (in memory unless `path` is set)."""
+    from qdrant_client import QdrantClient
+    import db.vector_store as vector_store
+
+    client = QdrantClient(path=path) if path else QdrantClient(":memory:")
+    vector_store.qdrant = _SerializedClient(client)
+    vector_store.ensure_collection()
+    return vector_store.qdrant
@@ -0,0 +1,282 @@
+"""
+HTTP load generator for the FastAPI app with latency percentiles per endpoint.
+
+By default the app runs in-process behind httpx's ASGI transport, with the fake model
+and Gemini backends from benchmarks.fakes (latency injectable) and an in-memory Qdrant.
+`serve` starts the same stubbed app under uvicorn so the generator can also drive a
+real socket with `--target http://127.0.0.1:8001`.
+
+Closed loop: N virtual users, each sending its next request when the previous returns.
+Open loop: Poisson arrivals at a fixed rate; latency is measured from the scheduled
+arrival time, so queueing delay is included rather than hidden (no coordinated
+omission). In-process runs also sample event-loop lag, which exposes handlers that
+block the loop.
+
+Usage (from backend/):
+    python -m benchmarks.loadtest run --mode closed --concurrency 16 --duration 30
+    python -m benchmarks.loadtest run --mode open --rate 50 --llm-latency 0.8 --mix query=4 upload=1
+    python -m benchmarks.loadtest serve --port 8001 --llm-latency 0.8
+"""
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timezone
+
+AUTH_HEADERS = {"Authorization": "Bearer loadtest"}
+
+
+def _percentile(ordered: List[float], pct: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _parse_mix(items: List[str]) -> Dict[str, float]:
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition("=")
+        if name not in ("query", "upload"):
+            raise SystemExit(f"Unknown endpoint in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _setup_inprocess(args):
+    from benchmarks.fakes import install_fakes, use_local_qdrant
+
+    install_fakes(embed_latency=args.embed_latency, llm_latency=args.llm_latency)
+    use_local_qdrant()
+    from benchmarks.corpus import seed_user_corpus
+
+    for u in range(args.users):
+        seed_user_corpus(f"load-{u}", args.corpus_size, seed=u)
+    from main import app
+
+    return app
+
+
+async def _send(client, endpoint: str, user_id: str, seq: int):
+    from benchmarks.corpus import random_query
+
+    if endpoint == "query":
+        return await client.post(
+            "/query",
+            json={"query": random_query(seq), "lang": "en", "user_id": user_id},
+            headers=AUTH_HEADERS,
+        )
+    return await client.post(
+        "/upload",
+        data={"text": random_query(seq, words=60), "user_id": user_id, "lang": "en"},
+        headers=AUTH_HEADERS,
+    )
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.status_counts: Dict[str, Dict[str, int]] = {}
+
+    def add(self, endpoint: str, latency_s: float, status: Optional[int]):
+        self.latencies.setdefault(endpoint, [])
+        self.errors.setdefault(endpoint, 0)
+        counts = self.status_counts.setdefault(endpoint, {})
+        key = str(status) if status is not None else "exception"
+        counts[key] = counts.get(key, 0) + 1
+        if status is None or status >= 400:
+            self.errors[endpoint] += 1
+        else:
+            self.latencies[endpoint].append(latency_s * 1000)
+
+    def summary(self, elapsed_s: float) -> Dict[str, Dict]:
+        out = {}
+        for endpoint, lats in self.latencies.items():
+            ordered = sorted(lats)
+            total = len(lats) + self.errors[endpoint]
+            out[endpoint] = {
+                "requests": total,
+                "ok": len(lats),
+                "errors": self.errors[endpoint],
+                "error_rate": self.errors[endpoint] / total if total else 0.0,
+                "throughput_rps": len(lats) / elapsed_s if elapsed_s else 0.0,
+                "p50_ms": _percentile(ordered, 50),
+                "p95_ms": _percentile(ordered, 95),
+                "p99_ms": _percentile(ordered, 99),
+                "max_ms": ordered[-1] if ordered else None,
+                "mean_ms": statistics.fmean(ordered) if ordered else None,
+                "status_counts": self.status_counts[endpoint],
+            }
+        return out
+
+
+async def _one(client, recorder: Recorder, endpoint: str, user_id: str, seq: int, started: float):
+    status = None
+    try:
+        resp = await _send(client, endpoint, user_id, seq)
+        status = resp.status_code
+    except Exception:
+        status = None
+    recorder.add(endpoint, time.perf_counter() - started, status)
+
+
+async def closed_loop(client, recorder, mix, users, concurrency, duration, rng):
+    deadline = time.perf_counter() + duration
+    names, weights = list(mix), list(mix.values())
+    seq = iter(range(10 ** 9))
+
+    async def virtual_user(i: int):
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(names, weights)[0]
+            await _one(client, recorder, endpoint, f"load-{i % users}", next(seq), time.perf_counter())
+            # In-process requests may complete without ever suspending; yield so other
+            # virtual users and the lag monitor get scheduled
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(virtual_user(i) for i in range(concurrency)))
+
+
+async def open_loop(client, recorder, mix, users, rate, duration, rng):
+    names, weights = list(mix), list(mix.values())
+    start = time.perf_counter()
+    next_arrival = start
+    tasks = []
+    seq = 0
+    while next_arrival < start + duration:
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        endpoint = rng.choices(names, weights)[0]
+        tasks.append(asyncio.create_task(
+            _one(client, recorder, endpoint, f"load-{seq % users}", seq, next_arrival)))
+        seq += 1
+        next_arrival += rng.expovariate(rate)
+    await asyncio.gather(*tasks)
+
+
+async def _loop_lag_monitor(samples: List[float], stop: asyncio.Event, interval: float = 0.01):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, (time.perf_counter() - start - interval) * 1000))
+
+
+async def run_load(args) -> Dict:
+    import httpx
+
+    mix = _parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    if args.target == "inprocess":
+        app = _setup_inprocess(args)
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://loadtest"
+    else:
+        transport = None
+        base_url = args.target
+
+    recorder = Recorder()
+    lag_samples: List[float] = []
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=max(args.concurrency, 100))
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout,
+                                 limits=limits) as client:
+        monitor = asyncio.create_task(_loop_lag_monitor(lag_samples, stop))
+        start = time.perf_counter()
+        if args.mode == "closed":
+            await closed_loop(client, recorder, mix, args.users, args.concurrency, args.duration, rng)
+        else:
+            await open_loop(client, recorder, mix, args.users, args.rate, args.duration, rng)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await monitor
+
+    lag = sorted(lag_samples)
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "target": args.target,
+            "mode": args.mode,
+            "concurrency": args.concurrency if args.mode == "closed" else None,
+            "rate_rps": args.rate if args.mode == "open" else None,
+            "duration_s": args.duration,
+            "elapsed_s": elapsed,
+            "mix": mix,
+            "users": args.users,
+            "corpus_size": args.corpus_size,
+            "embed_latency_s": args.embed_latency,
+            "llm_latency_s": args.llm_latency,
+            "cpu_count": os.cpu_count(),
+        },
+        "endpoints": recorder.summary(elapsed),
+        # Only meaningful in-process, where the app shares this event loop
+        "event_loop_lag_ms": {
+            "p50": _percentile(lag, 50),
+            "p99": _percentile(lag, 99),
+            "max": lag[-1] if lag else None,
+        } if args.target == "inprocess" else None,
+    }
+
+
+def _print_report(report: Dict):
+    print(f"{'endpoint':<10} {'req':>7} {'err%':>6} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, s in report["endpoints"].items():
+        fmt = lambda v: f"{v:9.1f}" if v is not None else f"{'-':>9}"
+        print(f"{name:<10} {s['requests']:>7} {100 * s['error_rate']:>6.1f} {s['throughput_rps']:>8.1f} "
+              f"{fmt(s['p50_ms'])} {fmt(s['p95_ms'])} {fmt(s['p99_ms'])}")
+    lag = report.get("event_loop_lag_ms")
+    if lag and lag["p99"] is not None:
+        print(f"event loop lag: p50={lag['p50']:.1f} ms p99={lag['p99']:.1f} ms max={lag['max']:.1f} ms")
+
+
+def serve(args):
+    import uvicorn
+
+    app = _setup_inprocess(args)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    def add_backend_args(p):
+        p.add_argument("--embed-latency", type=float, default=0.0, help="Seconds per fake embedding call")
+        p.add_argument("--llm-latency", type=float, default=0.0, help="Seconds per fake Gemini call")
+        p.add_argument("--users", type=int, default=4, help="Number of seeded users")
+        p.add_argument("--corpus-size", type=int, default=500, help="Seeded points per user")
+
+    run_p = sub.add_parser("run", help="Generate load and report latency percentiles")
+    add_backend_args(run_p)
+    run_p.add_argument("--target", default="inprocess", help="'inprocess' or a base URL such as http://127.0.0.1:8001")
+    run_p.add_argument("--mode", choices=["closed", "open"], default="closed")
+    run_p.add_argument("--concurrency", type=int, default=8, help="Virtual users (closed loop)")
+    run_p.add_argument("--rate", type=float, default=20.0, help="Arrivals per second (open loop)")
+    run_p.add_argument("--duration", type=float, default=20.0, help="Seconds of load")
+    run_p.add_argument("--mix", nargs="+", default=["query=4", "upload=1"], help="endpoint=weight pairs")
+    run_p.add_argument("--timeout", type=float, default=60.0, help="Per-request client timeout (s)")
+    run_p.add_argument("--seed", type=int, default=0)
+    run_p.add_argument("--out", default=None, help="Write the JSON report here")
+
+    serve_p = sub.add_parser("serve", help="Run the stubbed app under uvicorn")
+    add_backend_args(serve_p)
+    serve_p.add_argument("--host", default="127.0.0.1")
+    serve_p.add_argument("--port", type=int, default=8001)
+
+    args = ap.parse_args(argv)
+    if args.command == "serve":
+        serve(args)
+        return
+    report = asyncio.run(run_load(args))
+    _print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote report to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
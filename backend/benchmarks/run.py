@@ -0,0 +1,177 @@
+"""
+Offline benchmarks for the retrieval and upload hot paths.
+
+Runs against qdrant-client's in-memory local mode (or an on-disk local store with
+--qdrant-path) with deterministic fake embeddings and Gemini, so numbers reflect our
+own code and are comparable between releases. Results are written as JSON.
+
+Usage (from backend/):
+    python -m benchmarks.run --sizes 100 1000 10000 100000 --out bench.json
+"""
+from benchmarks.fakes import install_fakes, use_local_qdrant
+
+install_fakes()
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.corpus import random_query, random_text, seed_user_corpus
+from benchmarks.fakes import hashed_text_vector, TEXT_DIM
+from db import vector_store
+from services import semantic_cache
+from services.encryption import encrypt_data, decrypt_data
+from services.hybrid_search import HybridSearch
+from routers.query import BatchQueryItem, BatchQueryRequest, QueryRequest, query_batch, query_content
+from routers.upload import upload_content
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+
+
+def _stats(samples_ms):
+    ordered = sorted(samples_ms)
+    return {
+        "n": len(ordered),
+        "min_ms": ordered[0],
+        "median_ms": statistics.median(ordered),
+        "mean_ms": statistics.fmean(ordered),
+        "p95_ms": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        "max_ms": ordered[-1],
+    }
+
+
+def measure(fn, repeat: int, warmup: int = 1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return _stats(samples)
+
+
+def _record(results, name, size, stats, **extra):
+    entry = {"name": name, "size": size, **stats, **extra}
+    results.append(entry)
+    print(f"{name:<28} size={size or '-':<7} median={stats['median_ms']:9.3f} ms  p95={stats['p95_ms']:9.3f} ms")
+
+
+def bench_encryption(results, repeat):
+    text = random_text(random.Random(1), words=200)
+    image_b64 = os.urandom(48 * 1024).hex()
+    enc_text, enc_image = encrypt_data(text), encrypt_data(image_b64)
+    _record(results, "encrypt_text_1k", None, measure(lambda: encrypt_data(text), repeat * 10))
+    _record(results, "decrypt_text_1k", None, measure(lambda: decrypt_data(enc_text), repeat * 10))
+    _record(results, "encrypt_image_96k", None, measure(lambda: encrypt_data(image_b64), repeat))
+    _record(results, "decrypt_image_96k", None, measure(lambda: decrypt_data(enc_image), repeat))
+
+
+def bench_hybrid(results, size, repeat):
+    rng = random.Random(size)
+    corpus = [random_text(rng) for _ in range(size)]
+    vectors = np.array([hashed_text_vector(doc, TEXT_DIM) for doc in corpus], dtype=np.float32)
+    query = random_query(7)
+    query_vec = np.array(hashed_text_vector(query, TEXT_DIM), dtype=np.float32)
+    _record(results, "hybrid_search_build", size, measure(lambda: HybridSearch(corpus, vectors), repeat))
+    hybrid = HybridSearch(corpus, vectors)
+    _record(results, "hybrid_search_query", size,
+            measure(lambda: hybrid.search(query, query_vec, top_k=5, alpha=0.6), repeat))
+
+
+def bench_store(results, user_id, size, repeat):
+    _record(results, "list_user_points_50", size,
+            measure(lambda: vector_store.list_user_points(user_id, limit=50), repeat))
+    _record(results, "load_user_corpus", size,
+            measure(lambda: vector_store.load_user_corpus(user_id), repeat))
+
+
+def bench_endpoints(results, user_id, size, repeat, loop):
+    # Repeating one query would otherwise measure the semantic cache, not retrieval
+    cache_enabled = semantic_cache.SEMANTIC_CACHE_ENABLED
+    semantic_cache.SEMANTIC_CACHE_ENABLED = False
+    for mode in ("hybrid", "multivector"):
+        req = QueryRequest(query=random_query(3), lang="en", user_id=user_id, retrieval=mode)
+        _record(results, f"query_content_{mode}", size,
+                measure(lambda: loop.run_until_complete(query_content(req)), repeat))
+        # 32 queries in one call; compare with 32x query_content_<mode>
+        batch = BatchQueryRequest(user_id=user_id, retrieval=mode,
+                                  queries=[BatchQueryItem(query=random_query(i)) for i in range(32)])
+        _record(results, f"query_batch_32_{mode}", size,
+                measure(lambda: loop.run_until_complete(query_batch(batch)), repeat))
+    semantic_cache.SEMANTIC_CACHE_ENABLED = True
+    req = QueryRequest(query=random_query(3), lang="en", user_id=user_id)
+    _record(results, "query_content_cached", size,
+            measure(lambda: loop.run_until_complete(query_content(req)), repeat))
+    semantic_cache.SEMANTIC_CACHE_ENABLED = cache_enabled
+    counter = iter(range(10 ** 9))
+    _record(results, "upload_content_text", size, measure(
+        lambda: loop.run_until_complete(upload_content(
+            file=None, text=random_query(next(counter), words=60), user_id=user_id, lang="en")),
+        repeat))
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Corpus sizes per user")
+    ap.add_argument("--repeat", type=int, default=20, help="Timed iterations per benchmark")
+    ap.add_argument("--qdrant-path", default=None, help="Use an on-disk local Qdrant store instead of memory")
+    ap.add_argument("--out", default="bench_results.json", help="JSON output file")
+    args = ap.parse_args(argv)
+
+    results = []
+    bench_encryption(results, args.repeat)
+    loop = asyncio.new_event_loop()
+    try:
+        for size in args.sizes:
+            # Large corpora take seconds per iteration; keep total runtime reasonable
+            repeat = args.repeat if size <= 10000 else max(3, args.repeat // 5)
+            use_local_qdrant(args.qdrant_path)
+            user_id = f"bench-{size}"
+            start = time.perf_counter()
+            seed_user_corpus(user_id, size)
+            print(f"Seeded {size} points in {time.perf_counter() - start:.1f}s")
+            bench_hybrid(results, size, repeat)
+            bench_store(results, user_id, size, repeat)
+            bench_endpoints(results, user_id, size, repeat, loop)
+    finally:
+        loop.close()
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_revision": _git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "sizes": args.sizes,
+            "query_corpus_limit": int(os.getenv("QUERY_CORPUS_LIMIT", "2000")),
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
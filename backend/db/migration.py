@@ -0,0 +1,330 @@
+"""
+Zero-downtime collection migrations.
+
+The API reads and writes through the alias COLLECTION. A migration to a new embedding
+model, vector size or storage profile:
+
+1. creates a new collection version with the current vector sizes, storage profile and
+   indexes, and points MIGRATION_ALIAS at it. API processes notice within
+   MIGRATION_STATE_TTL seconds and mirror new uploads and GDPR deletes there.
+2. copies every point in pages, throttled to `--rate` points/s. Points already
+   embedded with EMBED_MODEL keep their vectors; the rest are re-embedded in batches.
+3. catches up: copies points the mirror missed, drops points deleted meanwhile and
+   re-embeds mirrored points that API processes on the old model wrote.
+4. moves COLLECTION to the new collection and removes MIGRATION_ALIAS in one atomic
+   alias update. Searches never see a half-built collection.
+
+Run it with the new model configured (TEXT_EMBED_MODEL, TEXT_EMBED_DIM, CLIP_MODEL,
+ENABLE_CLIP, ENCRYPTION_KEY). Rerunning after an interruption resumes into the same
+target, since every write is an idempotent upsert.
+
+    python -m db.migration --profile balanced       # migrate to the next version
+    python -m db.migration --status
+    python -m db.migration --abort                  # stop mirroring, keep the old collection
+"""
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import os
+import re
+import time
+
+from qdrant_client.http import models
+
+from db import vector_store as vs
+from db.storage_profiles import STORAGE_PROFILES, get_profile
+from services.model_config import EMBED_MODEL, LEGACY_EMBED_MODEL
+
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "128"))
+# Points per second copied into the new collection; 0 disables throttling
+MIGRATION_RATE = float(os.getenv("MIGRATION_RATE", "500"))
+UPSERT_RETRIES = 3
+
+ProgressFn = Callable[[str, int, Optional[int]], None]
+
+
+class Throttle:
+    """Sleep so that the average rate stays at or below `rate` items per second."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._start = time.monotonic()
+        self._count = 0
+
+    def add(self, n: int):
+        self._count += n
+        if self.rate <= 0:
+            return
+        ahead = self._count / self.rate - (time.monotonic() - self._start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def current_collection() -> str:
+    aliases = vs.collection_aliases()
+    if vs.COLLECTION not in aliases:
+        raise RuntimeError(f"'{vs.COLLECTION}' is not an alias; start the API once to create it")
+    return aliases[vs.COLLECTION]
+
+
+def next_collection_name(current: str) -> str:
+    """visiolingua_v2 -> visiolingua_v3."""
+    m = re.match(r"^(.*)_v(\d+)$", current)
+    if m:
+        return f"{m.group(1)}_v{int(m.group(2)) + 1}"
+    return f"{current}_v2"
+
+
+def point_model(payload: Dict[str, Any]) -> str:
+    return payload.get(vs.EMBED_MODEL_FIELD) or LEGACY_EMBED_MODEL
+
+
+def embed_payloads(payloads: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, list]]:
+    """Vectors from the configured models for {id: payload}, keyed by id."""
+    from services.embeddings import multilingual_text_embeddings
+    from services.encryption import decrypt_data
+    from services.vector_backfill import ENABLE_CLIP, clip_vectors_for
+
+    out: Dict[str, Dict[str, list]] = {pid: {} for pid in payloads}
+    ids, texts = [], []
+    for pid, payload in payloads.items():
+        # Document and video parents carry no vectors; image points are embedded by their caption
+        if payload.get("type") in vs.PARENT_TYPES or not payload.get("content"):
+            continue
+        try:
+            texts.append(decrypt_data(payload["content"]))
+            ids.append(pid)
+        except Exception as e:
+            print(f"Cannot decrypt {pid}, storing it without a text vector: {e}")
+    if texts:
+        for pid, vec in zip(ids, multilingual_text_embeddings(texts)):
+            out[pid]["text"] = vec
+    if ENABLE_CLIP:
+        for pid, vec in clip_vectors_for(payloads).items():
+            out[pid]["clip"] = vec
+    return out
+
+
+def _upsert(points: List[tuple], target: str):
+    for attempt in range(UPSERT_RETRIES):
+        if vs.upsert_points(points, collection=target):
+            return
+        time.sleep(2 ** attempt)
+    raise RuntimeError(f"Upsert into {target} failed {UPSERT_RETRIES} times")
+
+
+def copy_records(records, target: str) -> int:
+    """Write scrolled/retrieved records to `target`, re-embedding those from another model."""
+    points, stale = [], {}
+    for r in records:
+        payload = dict(r.payload or {})
+        if point_model(payload) == EMBED_MODEL:
+            vectors = r.vector if isinstance(r.vector, dict) else {}
+            # Placeholder zero vectors from older versions are not carried over
+            vectors = {name: vec for name, vec in vectors.items() if vec and any(vec)}
+            points.append((str(r.id), vectors, {**payload, vs.EMBED_MODEL_FIELD: EMBED_MODEL}))
+        else:
+            stale[str(r.id)] = payload
+    if stale:
+        for pid, vectors in embed_payloads(stale).items():
+            points.append((pid, vectors, {**stale[pid], vs.EMBED_MODEL_FIELD: EMBED_MODEL}))
+    if points:
+        _upsert(points, target)
+    return len(points)
+
+
+def start(target: str, profile: Optional[Dict[str, Any]]):
+    """Create `target` if needed and make API processes mirror writes to it."""
+    names = {c.name for c in vs.qdrant.get_collections().collections}
+    if target in names:
+        print(f"Resuming into existing collection {target}")
+        vs.prepare_collection(target)
+    else:
+        vs.create_collection(target, profile)
+    ops = []
+    if vs.MIGRATION_ALIAS in vs.collection_aliases():
+        ops.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=vs.MIGRATION_ALIAS)))
+    ops.append(models.CreateAliasOperation(create_alias=models.CreateAlias(
+        collection_name=target, alias_name=vs.MIGRATION_ALIAS)))
+    vs.qdrant.update_collection_aliases(change_aliases_operations=ops)
+    # Every API process has refreshed its cached state once this has passed
+    time.sleep(vs.MIGRATION_STATE_TTL + 1)
+
+
+def copy_all(source: str, target: str, batch_size: int, throttle: Throttle,
+             progress: Optional[ProgressFn] = None) -> int:
+    total = vs.qdrant.count(collection_name=source, exact=True).count
+    copied, offset = 0, None
+    while True:
+        records, offset = vs.qdrant.scroll(
+            collection_name=source, limit=batch_size, offset=offset,
+            with_payload=True, with_vectors=True,
+        )
+        copied += copy_records(records, target)
+        throttle.add(len(records))
+        if progress:
+            progress("copy", copied, total)
+        if offset is None or not records:
+            return copied
+
+
+def _scroll_ids(collection: str, batch_size: int, scroll_filter: Optional[models.Filter] = None):
+    offset = None
+    while True:
+        records, offset = vs.qdrant.scroll(
+            collection_name=collection, scroll_filter=scroll_filter, limit=batch_size,
+            offset=offset, with_payload=["user_id"], with_vectors=False,
+        )
+        if records:
+            yield records
+        if offset is None or not records:
+            return
+
+
+def catch_up(source: str, target: str, batch_size: int, throttle: Throttle,
+             progress: Optional[ProgressFn] = None) -> Dict[str, int]:
+    counts = {"missing_copied": 0, "deleted": 0, "reembedded": 0}
+
+    # Points the mirror missed (written before API processes saw the migration, or a
+    # mirror write that failed)
+    for records in _scroll_ids(source, batch_size):
+        ids = [r.id for r in records]
+        present = {str(p.id) for p in vs.qdrant.retrieve(target, ids=ids, with_payload=False)}
+        missing = [i for i in ids if str(i) not in present]
+        if missing:
+            full = vs.qdrant.retrieve(source, ids=missing, with_payload=True, with_vectors=True)
+            counts["missing_copied"] += copy_records(full, target)
+            throttle.add(len(full))
+    if progress:
+        progress("catch_up", counts["missing_copied"], None)
+
+    # Points deleted from the live collection after the copy read them
+    for records in _scroll_ids(target, batch_size):
+        present = {str(p.id) for p in vs.qdrant.retrieve(source, ids=[r.id for r in records], with_payload=False)}
+        by_shard: Dict[Any, list] = {}
+        for r in records:
+            if str(r.id) not in present:
+                by_shard.setdefault(vs.shard_key_for((r.payload or {}).get("user_id", "")), []).append(r.id)
+        for key, ids in by_shard.items():
+            vs.qdrant.delete(collection_name=target, points_selector=models.PointIdsList(points=ids),
+                             wait=True, shard_key_selector=key)
+            counts["deleted"] += len(ids)
+
+    # Mirrored writes from processes still embedding with the old model
+    stale = models.Filter(must_not=[models.FieldCondition(
+        key=vs.EMBED_MODEL_FIELD, match=models.MatchValue(value=EMBED_MODEL))])
+    for records in _scroll_ids(target, batch_size, stale):
+        full = vs.qdrant.retrieve(target, ids=[r.id for r in records], with_payload=True)
+        payloads = {str(r.id): r.payload or {} for r in full}
+        points = [(pid, vectors, {**payloads[pid], vs.EMBED_MODEL_FIELD: EMBED_MODEL})
+                  for pid, vectors in embed_payloads(payloads).items()]
+        if points:
+            _upsert(points, target)
+        counts["reembedded"] += len(points)
+        throttle.add(len(points))
+    if progress:
+        progress("catch_up", sum(counts.values()), None)
+    return counts
+
+
+def switch(target: str):
+    """Point COLLECTION at `target` and stop mirroring, atomically."""
+    vs.qdrant.update_collection_aliases(change_aliases_operations=[
+        models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=vs.COLLECTION)),
+        models.CreateAliasOperation(create_alias=models.CreateAlias(
+            collection_name=target, alias_name=vs.COLLECTION)),
+        models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=vs.MIGRATION_ALIAS)),
+    ])
+
+
+def abort(drop_target: bool = False) -> Optional[str]:
+    """Stop mirroring writes; the live collection is untouched. Returns the old target."""
+    target = vs.collection_aliases().get(vs.MIGRATION_ALIAS)
+    if target is None:
+        return None
+    vs.qdrant.update_collection_aliases(change_aliases_operations=[
+        models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=vs.MIGRATION_ALIAS)),
+    ])
+    if drop_target:
+        vs.qdrant.delete_collection(target)
+    return target
+
+
+def migrate(target: Optional[str] = None, profile: Optional[Dict[str, Any]] = None,
+            batch_size: int = MIGRATION_BATCH_SIZE, rate: float = MIGRATION_RATE,
+            drop_old: bool = False, progress: Optional[ProgressFn] = None) -> Dict[str, Any]:
+    """Run a full migration and return a summary."""
+    if vs.qdrant is None:
+        raise RuntimeError("Qdrant client not available")
+    source = current_collection()
+    target = target or vs.collection_aliases().get(vs.MIGRATION_ALIAS) or next_collection_name(source)
+    if target == source:
+        raise ValueError(f"{target} is already the live collection")
+
+    t0 = time.perf_counter()
+    throttle = Throttle(rate)
+    start(target, profile)
+    copied = copy_all(source, target, batch_size, throttle, progress)
+    counts = catch_up(source, target, batch_size, throttle, progress)
+    switch(target)
+    if drop_old:
+        vs.qdrant.delete_collection(source)
+    return {
+        "source": source,
+        "target": target,
+        "embed_model": EMBED_MODEL,
+        "copied": copied,
+        **counts,
+        "dropped_source": drop_old,
+        "seconds": round(time.perf_counter() - t0, 1),
+    }
+
+
+def status() -> Dict[str, Any]:
+    aliases = vs.collection_aliases()
+    live = aliases.get(vs.COLLECTION)
+    target = aliases.get(vs.MIGRATION_ALIAS)
+    out: Dict[str, Any] = {"alias": vs.COLLECTION, "live": live, "migration_target": target,
+                           "embed_model": EMBED_MODEL}
+    for key, name in (("live_points", live), ("target_points", target)):
+        if name:
+            out[key] = vs.qdrant.count(collection_name=name, exact=True).count
+    if live:
+        current = models.Filter(must=[models.FieldCondition(
+            key=vs.EMBED_MODEL_FIELD, match=models.MatchValue(value=EMBED_MODEL))])
+        out["live_points_current_model"] = vs.qdrant.count(
+            collection_name=live, count_filter=current, exact=True).count
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--target", help="New collection name (default: next _vN after the live one)")
+    ap.add_argument("--profile", choices=sorted(STORAGE_PROFILES),
+                    help="Storage profile of the new collection (default: QDRANT_STORAGE_PROFILE)")
+    ap.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE, help="Points per page and upsert")
+    ap.add_argument("--rate", type=float, default=MIGRATION_RATE, help="Max points/s copied (0: unthrottled)")
+    ap.add_argument("--drop-old", action="store_true", help="Delete the previous collection after the switch")
+    ap.add_argument("--status", action="store_true", help="Show the alias, collections and model coverage")
+    ap.add_argument("--abort", action="store_true", help="Stop a running migration's mirroring")
+    ap.add_argument("--drop-target", action="store_true", help="With --abort: delete the target collection")
+    args = ap.parse_args(argv)
+
+    vs.ensure_collection()
+    if args.status:
+        print(status())
+        return
+    if args.abort:
+        target = abort(drop_target=args.drop_target)
+        print(f"Aborted migration to {target}" if target else "No migration in progress")
+        return
+
+    profile = get_profile(args.profile) if args.profile else vs.STORAGE_PROFILE
+
+    def progress(phase: str, done: int, total: Optional[int]):
+        print(f"[{phase}] {done}/{total if total is not None else '?'}", flush=True)
+
+    print(migrate(args.target, profile, args.batch_size, args.rate, args.drop_old, progress))
+
+
+if __name__ == "__main__":
+    main()
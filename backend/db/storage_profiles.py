@@ -0,0 +1,189 @@
+"""
+Named storage profiles for the Qdrant collection.
+
+A profile trades memory for recall and latency. It covers vector quantization (scalar
+int8 or binary, rescored against the original vectors), whether original vectors and
+payloads live on disk (memory-mapped) or in RAM, HNSW `m`/`ef_construct`, and the
+per-query `hnsw_ef`/oversampling used by searches. Select one with
+QDRANT_STORAGE_PROFILE. New collections are created with it, and an existing collection
+is updated in place, which Qdrant applies online through its optimizers.
+
+    python -m db.storage_profiles                  # RAM estimates for every profile
+    python -m db.storage_profiles --apply balanced # update the live collection
+"""
+from typing import Any, Dict, Optional
+import argparse
+
+from qdrant_client.http import models
+
+from services.model_config import VECTOR_SIZES
+
+STORAGE_PROFILES: Dict[str, Dict[str, Any]] = {
+    # Binary codes in RAM (1 bit/dim), everything else on disk. Oversampling plus
+    # rescoring on the original vectors recovers most of the recall.
+    "memory-lean": {
+        "quantization": "binary",
+        "vectors_on_disk": True,
+        "payload_on_disk": True,
+        "hnsw": {"m": 16, "ef_construct": 100, "on_disk": True},
+        "search": {"hnsw_ef": 128, "rescore": True, "oversampling": 3.0},
+    },
+    # int8 codes in RAM (4x smaller than float32), originals and payloads on disk.
+    "balanced": {
+        "quantization": "scalar",
+        "vectors_on_disk": True,
+        "payload_on_disk": True,
+        "hnsw": {"m": 16, "ef_construct": 128, "on_disk": False},
+        "search": {"hnsw_ef": 96, "rescore": True, "oversampling": 1.5},
+    },
+    # Everything in RAM, denser graph; int8 codes make the first pass cheaper.
+    "low-latency": {
+        "quantization": "scalar",
+        "vectors_on_disk": False,
+        "payload_on_disk": False,
+        "hnsw": {"m": 32, "ef_construct": 256, "on_disk": False},
+        "search": {"hnsw_ef": 128, "rescore": True, "oversampling": 1.2},
+    },
+}
+
+
+def get_profile(name: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Return the named profile, None for an empty name; raise ValueError if unknown."""
+    if not name:
+        return None
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile '{name}'; choose one of {sorted(STORAGE_PROFILES)}")
+    return STORAGE_PROFILES[name]
+
+
+def quantization_config(profile: Dict[str, Any]):
+    kind = profile["quantization"]
+    if kind == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    if kind == "scalar":
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8, quantile=0.99, always_ram=True))
+    return models.Disabled.DISABLED
+
+
+def hnsw_config(profile: Optional[Dict[str, Any]]) -> models.HnswConfigDiff:
+    # payload_m builds extra per-tenant graph links so user-filtered searches stay fast
+    # as the number of tenants grows; every profile keeps it
+    hnsw = (profile or {}).get("hnsw", {})
+    return models.HnswConfigDiff(payload_m=16, **hnsw)
+
+
+def vectors_config(profile: Optional[Dict[str, Any]]) -> Dict[str, models.VectorParams]:
+    on_disk = profile["vectors_on_disk"] if profile else None
+    return {
+        name: models.VectorParams(size=size, distance=models.Distance.COSINE, on_disk=on_disk)
+        for name, size in VECTOR_SIZES.items()
+    }
+
+
+def search_params(profile: Optional[Dict[str, Any]]) -> Optional[models.SearchParams]:
+    if not profile:
+        return None
+    search = profile["search"]
+    return models.SearchParams(
+        hnsw_ef=search["hnsw_ef"],
+        quantization=models.QuantizationSearchParams(
+            rescore=search["rescore"], oversampling=search["oversampling"]),
+    )
+
+
+def create_kwargs(profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Keyword arguments for create_collection."""
+    kwargs: Dict[str, Any] = {
+        "vectors_config": vectors_config(profile),
+        "hnsw_config": hnsw_config(profile),
+    }
+    if profile:
+        kwargs["quantization_config"] = quantization_config(profile)
+        kwargs["on_disk_payload"] = profile["payload_on_disk"]
+    return kwargs
+
+
+def _current_state(info) -> Dict[str, Any]:
+    params = info.config.params
+    vectors = params.vectors if isinstance(params.vectors, dict) else {}
+    quant = info.config.quantization_config
+    if isinstance(quant, models.BinaryQuantization):
+        quant_kind = "binary"
+    elif isinstance(quant, models.ScalarQuantization):
+        quant_kind = "scalar"
+    else:
+        quant_kind = None
+    hnsw = info.config.hnsw_config
+    return {
+        "quantization": quant_kind,
+        "vectors_on_disk": all(bool(v.on_disk) for v in vectors.values()) if vectors else False,
+        "payload_on_disk": bool(params.on_disk_payload),
+        "hnsw": {"m": hnsw.m, "ef_construct": hnsw.ef_construct, "on_disk": bool(hnsw.on_disk)},
+    }
+
+
+def profile_differs(info, profile: Dict[str, Any]) -> bool:
+    current = _current_state(info)
+    wanted = {k: profile[k] for k in ("quantization", "vectors_on_disk", "payload_on_disk", "hnsw")}
+    return current != wanted
+
+
+def apply_profile(client, collection: str, profile: Dict[str, Any]) -> bool:
+    """
+    Update an existing collection to `profile`. Returns False when it already matches.
+    Qdrant rebuilds indexes and quantized vectors in the background; searches keep
+    working while the optimizers run.
+    """
+    info = client.get_collection(collection)
+    if not profile_differs(info, profile):
+        return False
+    vectors = (info.config.params.vectors or {}).keys() if isinstance(info.config.params.vectors, dict) else []
+    client.update_collection(
+        collection_name=collection,
+        vectors_config={name: models.VectorParamsDiff(on_disk=profile["vectors_on_disk"]) for name in vectors},
+        hnsw_config=hnsw_config(profile),
+        quantization_config=quantization_config(profile),
+        collection_params=models.CollectionParamsDiff(on_disk_payload=profile["payload_on_disk"]),
+    )
+    return True
+
+
+def estimate_ram_bytes(profile: Optional[Dict[str, Any]], points: int = 1_000_000) -> int:
+    """Rough resident vector + graph memory, ignoring payloads and payload indexes."""
+    dims = sum(VECTOR_SIZES.values())
+    if not profile:
+        vector_bytes, m, graph_on_disk = dims * 4, 16, False
+    else:
+        codes = {"binary": dims / 8, "scalar": dims}.get(profile["quantization"], 0)
+        originals = 0 if profile["vectors_on_disk"] else dims * 4
+        vector_bytes = codes + originals
+        m, graph_on_disk = profile["hnsw"]["m"], profile["hnsw"]["on_disk"]
+    # Level-0 HNSW links: 2*m neighbours of 4 bytes per vector space
+    graph_bytes = 0 if graph_on_disk else 2 * m * 4 * len(VECTOR_SIZES)
+    return int(points * (vector_bytes + graph_bytes))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--apply", metavar="PROFILE", choices=sorted(STORAGE_PROFILES),
+                    help="Update the live collection to this profile")
+    args = ap.parse_args(argv)
+
+    baseline = estimate_ram_bytes(None)
+    print(f"{'profile':<12} {'RAM / 1M points':>16} {'vs float32':>10}")
+    print(f"{'(none)':<12} {baseline / 2**20:>13.0f} MB {1:>9.1f}x")
+    for name, profile in STORAGE_PROFILES.items():
+        ram = estimate_ram_bytes(profile)
+        print(f"{name:<12} {ram / 2**20:>13.0f} MB {baseline / ram:>9.1f}x")
+
+    if args.apply:
+        from db.vector_store import COLLECTION, qdrant
+        if qdrant is None:
+            raise SystemExit("Qdrant is not reachable")
+        changed = apply_profile(qdrant, COLLECTION, STORAGE_PROFILES[args.apply])
+        print(f"Applied '{args.apply}' to {COLLECTION}" if changed else f"{COLLECTION} already uses '{args.apply}'")
+
+
+if __name__ == "__main__":
+    main()
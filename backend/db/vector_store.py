@@ -1,14 +1,44 @@
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
-from typing import List, Optional, Dict, Any
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+from typing import Any, Callable, Dict, List, Optional
+import base64
+import json
 import os
 import time
+import zlib
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
+from db.storage_profiles import apply_profile, create_kwargs, get_profile, search_params
+from services.deadline import (
+    CircuitBreaker, backoff_delay, call_timeout, call_with_retries, mark_degraded, remaining, unbounded,
+)
+from services.metrics import stage
+from services.model_config import EMBED_MODEL
+
 # Load environment variables first
 load_dotenv()
 
-COLLECTION = "visiolingua_v2"
+# All reads and writes go through this alias. The collection behind it is versioned so
+# db/migration.py can build a replacement and switch the alias atomically.
+COLLECTION = os.getenv("QDRANT_COLLECTION", "visiolingua")
+# Collection created on first start; deployments from before the alias already have it
+INITIAL_COLLECTION = "visiolingua_v2"
+# Exists only while a migration runs and points at its target; writes are mirrored there
+MIGRATION_ALIAS = f"{COLLECTION}_migration_target"
+# How long API processes cache the migration state
+MIGRATION_STATE_TTL = float(os.getenv("MIGRATION_STATE_TTL", "5"))
+
+# Per-call ceiling; calls made while serving a request get the time left in its budget
+QDRANT_TIMEOUT = float(os.getenv("QDRANT_TIMEOUT", "60"))
+# Retries of transient errors (timeouts, connection errors, 5xx), within the budget
+QDRANT_RETRIES = int(os.getenv("QDRANT_RETRIES", "2"))
+QDRANT_BREAKER = CircuitBreaker(
+    "qdrant",
+    failures=int(os.getenv("QDRANT_BREAKER_FAILURES", "5")),
+    reset_seconds=float(os.getenv("QDRANT_BREAKER_RESET_SECONDS", "10")),
+)
 
 # Initialize Qdrant client with proper configuration for Cloud
 qdrant_url = os.getenv("QDRANT_URL", "http://localhost:6333")
@@ -23,7 +53,7 @@ if qdrant_url and "cloud.qdrant.io" in qdrant_url and ":6333" not in qdrant_url:
 # Configure client based on connection type
 client_config = {
     "url": qdrant_url,
-    "timeout": 60,  # Increased timeout for cloud connections
+    "timeout": QDRANT_TIMEOUT,  # Increased timeout for cloud connections
 }
 
 if qdrant_api_key:
@@ -48,6 +78,238 @@ except Exception as e:
     qdrant = None
 
 
+def _deadline_timeout(request, call_next):
+    """HTTP middleware: each Qdrant request times out when the current request's budget ends."""
+    timeout = call_timeout(QDRANT_TIMEOUT)
+    request.extensions["timeout"] = {"connect": timeout, "read": timeout, "write": timeout, "pool": timeout}
+    return call_next(request)
+
+
+if qdrant is not None:
+    try:
+        qdrant.http.client.add_middleware(_deadline_timeout)
+    except NotImplementedError:
+        pass  # Local mode makes no HTTP calls
+
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, UnexpectedResponse):
+        return e.status_code is None or e.status_code >= 500 or e.status_code == 429
+    return isinstance(e, (ResponseHandlingException, TimeoutError, ConnectionError))
+
+
+def _call(fn, *args, **kwargs):
+    """Call a Qdrant client method through the circuit breaker, with retries in the budget."""
+    return call_with_retries(lambda: fn(*args, **kwargs), QDRANT_BREAKER, QDRANT_RETRIES, _is_transient)
+
+
+def _server_timeout() -> Optional[int]:
+    """Whole seconds Qdrant may spend on a search before abandoning it (None: client default)."""
+    left = remaining()
+    return max(1, int(left)) if left is not None else None
+
+
+# Optional custom sharding for large tenants. When QDRANT_TENANT_SHARD_GROUPS > 0 the
+# collection is created with custom sharding: every user is routed to one of N group
+# shard keys, and users listed in QDRANT_DEDICATED_TENANTS get a shard key of their own.
+TENANT_SHARD_GROUPS = int(os.getenv("QDRANT_TENANT_SHARD_GROUPS", "0"))
+DEDICATED_TENANTS = {
+    u.strip() for u in os.getenv("QDRANT_DEDICATED_TENANTS", "").split(",") if u.strip()
+}
+
+# Quantization / on-disk / HNSW settings, see db/storage_profiles.py. Unset keeps the
+# collection as it is (float32 vectors in RAM, default HNSW).
+STORAGE_PROFILE_NAME = os.getenv("QDRANT_STORAGE_PROFILE", "")
+try:
+    STORAGE_PROFILE = get_profile(STORAGE_PROFILE_NAME)
+except ValueError as e:
+    print(f"⚠️ {e}; ignoring QDRANT_STORAGE_PROFILE")
+    STORAGE_PROFILE = None
+SEARCH_PARAMS = search_params(STORAGE_PROFILE)
+
+DELETE_BATCH_SIZE = 256
+
+# Numeric upload time (seconds since epoch); range-indexed for server-side ordering
+TIMESTAMP_FIELD = "timestamp_epoch"
+
+# Lower-cased prefixes of original_name, keyword-indexed so name-prefix filters run in Qdrant.
+# Prefixes longer than NAME_PREFIX_MAX_LEN are matched on their first NAME_PREFIX_MAX_LEN chars.
+NAME_PREFIX_FIELD = "name_prefixes"
+NAME_PREFIX_MAX_LEN = 32
+
+# Long text uploads are stored as a vectorless parent point of type DOCUMENT_TYPE plus
+# searchable chunk points that reference it through PARENT_FIELD
+DOCUMENT_TYPE = "document"
+PARENT_FIELD = "parent_id"
+# Video uploads likewise: a vectorless parent plus one `image` point per keyframe
+VIDEO_TYPE = "video"
+PARENT_TYPES = [DOCUMENT_TYPE, VIDEO_TYPE]
+
+# Whether a point has a real CLIP vector. Named vectors are optional: points without an
+# embedding omit the vector instead of storing zeros. Bool-indexed for the CLIP backfill.
+HAS_CLIP_FIELD = "has_clip"
+
+# Embedding model version a point's vectors come from (services.model_config.EMBED_MODEL)
+EMBED_MODEL_FIELD = "embed_model"
+
+# Language of the content as identified at ingest (services.lang_detect), next to the
+# client-supplied `lang`, and langid's probability for it
+DETECTED_LANG_FIELD = "detected_lang"
+LANG_CONFIDENCE_FIELD = "lang_confidence"
+
+# Payload keys never needed to rank a query; excluded from corpus loads to keep them light
+HEAVY_PAYLOAD_FIELDS = ["image_b64", NAME_PREFIX_FIELD]
+
+
+def shard_key_for(user_id: str) -> Optional[str]:
+    """Return the shard key holding a user's points, or None when custom sharding is off."""
+    if TENANT_SHARD_GROUPS <= 0:
+        return None
+    if user_id in DEDICATED_TENANTS:
+        return f"tenant-{user_id}"
+    return f"group-{zlib.crc32(user_id.encode('utf-8')) % TENANT_SHARD_GROUPS}"
+
+
+def _user_filter(user_id: str) -> models.Filter:
+    return models.Filter(
+        must=[models.FieldCondition(key="user_id", match=models.MatchValue(value=user_id))]
+    )
+
+
+def build_user_filter(
+    user_id: str,
+    types: Optional[List[str]] = None,
+    langs: Optional[List[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    name_prefix: Optional[str] = None,
+) -> models.Filter:
+    """
+    Translate structured query filters into a Qdrant filter scoped to one user.
+    Every condition targets an indexed payload field, so narrow filters only touch
+    the matching subset of the user's points.
+    """
+    flt = _user_filter(user_id)
+    # Parents carry no vectors or searchable text; their chunks and frames are what gets ranked
+    flt.must_not = [models.FieldCondition(key="type", match=models.MatchAny(any=PARENT_TYPES))]
+    if types:
+        flt.must.append(models.FieldCondition(key="type", match=models.MatchAny(any=list(types))))
+    if langs:
+        # Either the client label or the detected language, so mislabeled uploads still match
+        flt.must.append(models.Filter(should=[
+            models.FieldCondition(key="lang", match=models.MatchAny(any=list(langs))),
+            models.FieldCondition(key=DETECTED_LANG_FIELD, match=models.MatchAny(any=list(langs))),
+        ]))
+    if since or until:
+        flt.must.append(models.FieldCondition(
+            key=TIMESTAMP_FIELD,
+            range=models.Range(
+                gte=_as_epoch(since) if since else None,
+                lte=_as_epoch(until) if until else None,
+            ),
+        ))
+    if name_prefix:
+        flt.must.append(models.FieldCondition(
+            key=NAME_PREFIX_FIELD,
+            match=models.MatchValue(value=name_prefix.lower()[:NAME_PREFIX_MAX_LEN]),
+        ))
+    return flt
+
+
+def payload_matches(
+    payload: Dict[str, Any],
+    types: Optional[List[str]] = None,
+    langs: Optional[List[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    name_prefix: Optional[str] = None,
+) -> bool:
+    """build_user_filter's conditions (other than the user) evaluated on a loaded payload."""
+    if payload.get("type") in PARENT_TYPES:
+        return False
+    if types and payload.get("type") not in types:
+        return False
+    if langs and payload.get("lang") not in langs and payload.get(DETECTED_LANG_FIELD) not in langs:
+        return False
+    if since or until:
+        epoch = payload.get(TIMESTAMP_FIELD)
+        if epoch is None or (since and epoch < _as_epoch(since)) or (until and epoch > _as_epoch(until)):
+            return False
+    if name_prefix:
+        name = (payload.get("original_name") or "").lower()
+        if not name.startswith(name_prefix.lower()[:NAME_PREFIX_MAX_LEN]):
+            return False
+    return True
+
+
+def _tenant_index_schema():
+    # Qdrant >= 1.11 co-locates a tenant's points on disk when the keyword index is
+    # flagged is_tenant; older clients fall back to a plain keyword index.
+    keyword_params = getattr(models, "KeywordIndexParams", None)
+    if keyword_params is not None:
+        return keyword_params(type="keyword", is_tenant=True)
+    return models.PayloadSchemaType.KEYWORD
+
+
+def _ensure_payload_index(field_name: str, field_schema, collection: str = COLLECTION) -> None:
+    try:
+        qdrant.create_payload_index(
+            collection_name=collection,
+            field_name=field_name,
+            field_schema=field_schema,
+        )
+        print(f"Created index on {field_name} field")
+    except Exception as idx_err:
+        # Index might already exist, that's fine
+        if "already exists" not in str(idx_err).lower():
+            print(f"Index creation note: {idx_err}")
+
+
+def _ensure_shard_keys(collection: str = COLLECTION) -> None:
+    keys = [f"group-{i}" for i in range(TENANT_SHARD_GROUPS)]
+    keys += [f"tenant-{u}" for u in sorted(DEDICATED_TENANTS)]
+    for key in keys:
+        try:
+            qdrant.create_shard_key(collection_name=collection, shard_key=key)
+            print(f"Created shard key {key}")
+        except Exception as shard_err:
+            if "already exists" not in str(shard_err).lower():
+                print(f"Shard key creation note: {shard_err}")
+
+
+def collection_aliases() -> Dict[str, str]:
+    """Alias name -> collection name."""
+    return {a.alias_name: a.collection_name for a in _call(qdrant.get_aliases).aliases}
+
+
+def prepare_collection(collection: str) -> None:
+    """Create the payload indexes (and shard keys) every collection version needs."""
+    # user_id is the tenant key
+    _ensure_payload_index("user_id", _tenant_index_schema(), collection)
+    _ensure_payload_index("type", models.PayloadSchemaType.KEYWORD, collection)
+    _ensure_payload_index(TIMESTAMP_FIELD, models.PayloadSchemaType.FLOAT, collection)
+    _ensure_payload_index("lang", models.PayloadSchemaType.KEYWORD, collection)
+    _ensure_payload_index(NAME_PREFIX_FIELD, models.PayloadSchemaType.KEYWORD, collection)
+    _ensure_payload_index(PARENT_FIELD, models.PayloadSchemaType.KEYWORD, collection)
+    _ensure_payload_index(HAS_CLIP_FIELD, models.PayloadSchemaType.BOOL, collection)
+    _ensure_payload_index(EMBED_MODEL_FIELD, models.PayloadSchemaType.KEYWORD, collection)
+    _ensure_payload_index(DETECTED_LANG_FIELD, models.PayloadSchemaType.KEYWORD, collection)
+    _ensure_payload_index(LANG_CONFIDENCE_FIELD, models.PayloadSchemaType.FLOAT, collection)
+    if TENANT_SHARD_GROUPS > 0:
+        _ensure_shard_keys(collection)
+
+
+def create_collection(collection: str, profile: Optional[Dict[str, Any]]) -> None:
+    """Create a collection version with the current vector sizes, `profile` and indexes."""
+    qdrant.create_collection(
+        collection_name=collection,
+        sharding_method=models.ShardingMethod.CUSTOM if TENANT_SHARD_GROUPS > 0 else None,
+        **create_kwargs(profile),
+    )
+    print(f"Created Qdrant collection: {collection}")
+    prepare_collection(collection)
+
+
 def ensure_collection():
     """Ensure Qdrant collection exists with proper error handling and retries."""
     if qdrant is None:
@@ -63,84 +325,263 @@ def ensure_collection():
             print(
                 f"Successfully connected to Qdrant! Found {len(names)} collections.")
 
-            if COLLECTION not in names:
-                qdrant.create_collection(
-                    collection_name=COLLECTION,
-                    vectors_config={
-                        "clip": models.VectorParams(size=512, distance=models.Distance.COSINE),
-                        "text": models.VectorParams(size=384, distance=models.Distance.COSINE),
-                    },
-                )
-                print(f"Created Qdrant collection: {COLLECTION}")
+            aliases = collection_aliases()
+            if COLLECTION in aliases or COLLECTION in names:
+                current = aliases.get(COLLECTION, COLLECTION)
+                print(f"Qdrant collection '{COLLECTION}' already exists ({current})")
+                if STORAGE_PROFILE is not None:
+                    try:
+                        if apply_profile(qdrant, current, STORAGE_PROFILE):
+                            print(f"Applying storage profile '{STORAGE_PROFILE_NAME}'; "
+                                  "Qdrant re-optimizes the collection in the background")
+                    except Exception as e:
+                        print(f"⚠️ Could not apply storage profile '{STORAGE_PROFILE_NAME}': {e}")
+                prepare_collection(current)
             else:
-                print(f"Qdrant collection '{COLLECTION}' already exists")
-
-            # Ensure indexes exist for filtered queries
-            try:
-                qdrant.create_payload_index(
-                    collection_name=COLLECTION,
-                    field_name="user_id",
-                    field_schema=models.PayloadSchemaType.KEYWORD,
-                )
-                print(f"Created index on user_id field")
-            except Exception as idx_err:
-                # Index might already exist, that's fine
-                if "already exists" not in str(idx_err).lower():
-                    print(f"Index creation note: {idx_err}")
-
-            try:
-                qdrant.create_payload_index(
-                    collection_name=COLLECTION,
-                    field_name="type",
-                    field_schema=models.PayloadSchemaType.KEYWORD,
-                )
-                print(f"Created index on type field")
-            except Exception as idx_err:
-                if "already exists" not in str(idx_err).lower():
-                    print(f"Index creation note: {idx_err}")
+                if INITIAL_COLLECTION not in names:
+                    create_collection(INITIAL_COLLECTION, STORAGE_PROFILE)
+                else:
+                    prepare_collection(INITIAL_COLLECTION)
+                qdrant.update_collection_aliases(change_aliases_operations=[
+                    models.CreateAliasOperation(create_alias=models.CreateAlias(
+                        collection_name=INITIAL_COLLECTION, alias_name=COLLECTION)),
+                ])
+                print(f"Created alias '{COLLECTION}' -> '{INITIAL_COLLECTION}'")
 
             print(f"✅ Qdrant collection '{COLLECTION}' ready with indexes")
             return  # Success, exit function
 
         except Exception as e:
             if attempt < max_retries - 1:
+                delay = backoff_delay(attempt, base=1.0, cap=8.0) + 1.0
                 print(
-                    f"Qdrant connection attempt {attempt + 1} failed: {e}. Retrying in 2 seconds...")
-                time.sleep(2)
+                    f"Qdrant connection attempt {attempt + 1} failed: {e}. Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
             else:
                 print(
                     f"❌ Qdrant init failed after {max_retries} attempts: {e}")
                 print("Server will continue without Qdrant - some features may not work")
 
 
+def _point_struct(point_id: str, vectors: dict, payload: dict) -> models.PointStruct:
+    """
+    Drop missing (None or empty) vectors, record whether the point has CLIP and stamp
+    the embedding model unless the payload already names one.
+    """
+    present = {name: vec for name, vec in (vectors or {}).items() if vec}
+    payload = {EMBED_MODEL_FIELD: EMBED_MODEL, **payload, HAS_CLIP_FIELD: "clip" in present}
+    return models.PointStruct(id=point_id, vector=present, payload=payload)
+
+
+_migration_state: Dict[str, Any] = {"checked_at": None, "target": None}
+
+
+def migration_target() -> Optional[tuple]:
+    """
+    (collection, vector sizes) that writes are mirrored to while a migration runs, else
+    None. Cached for MIGRATION_STATE_TTL seconds; the migration waits that long after
+    creating MIGRATION_ALIAS before it starts copying.
+    """
+    now = time.monotonic()
+    checked_at = _migration_state["checked_at"]
+    if checked_at is not None and now - checked_at < MIGRATION_STATE_TTL:
+        return _migration_state["target"]
+    target = None
+    try:
+        aliases = collection_aliases()
+        name = aliases.get(MIGRATION_ALIAS)
+        if name and name != aliases.get(COLLECTION):
+            vectors = _call(qdrant.get_collection, name).config.params.vectors or {}
+            target = (name, {k: v.size for k, v in vectors.items()})
+    except Exception as e:
+        print(f"Qdrant migration state check error: {e}")
+        target = _migration_state["target"]
+    _migration_state.update(checked_at=now, target=target)
+    return target
+
+
+def _mirror_upsert(by_shard: Dict[Any, List[models.PointStruct]]) -> None:
+    """Repeat a write on the migration target. Vectors it cannot hold (another model's
+    size) are left out; the migration re-embeds points whose embed_model differs."""
+    target = migration_target()
+    if target is None:
+        return
+    name, sizes = target
+    try:
+        for key, structs in by_shard.items():
+            mirrored = [
+                models.PointStruct(
+                    id=s.id,
+                    vector={v: vec for v, vec in s.vector.items() if len(vec) == sizes.get(v)},
+                    payload=s.payload,
+                )
+                for s in structs
+            ]
+            _call(qdrant.upsert, collection_name=name, points=mirrored, shard_key_selector=key)
+    except Exception as e:
+        # The migration's catch-up pass copies whatever the mirror missed
+        print(f"Qdrant mirror upsert to {name} failed: {e}")
+
+
 def upsert_point(point_id: str, vectors: dict, payload: dict):
     """Upsert a point to Qdrant with error handling."""
+    return upsert_points([(point_id, vectors, payload)])
+
+
+def upsert_points(points: List[tuple], collection: Optional[str] = None) -> bool:
+    """
+    Upsert many (point_id, vectors, payload) tuples, one request per shard key.
+    Writes to the live collection are mirrored to a running migration's target; pass
+    `collection` to write one collection only. Returns False if Qdrant is unavailable
+    or any request fails.
+    """
     if qdrant is None:
         print("Qdrant client not available, skipping upsert")
         return False
+    by_shard: Dict[Any, List[models.PointStruct]] = {}
+    for point_id, vectors, payload in points:
+        key = shard_key_for(payload.get("user_id", ""))
+        by_shard.setdefault(key, []).append(_point_struct(point_id, vectors, payload))
     try:
-        qdrant.upsert(
-            collection_name=COLLECTION,
-            points=[models.PointStruct(
-                id=point_id, vector=vectors, payload=payload)],
-        )
+        # Writes are not cut short by the read deadline; the breaker still fails fast
+        with stage("qdrant_upsert"), unbounded():
+            for key, structs in by_shard.items():
+                _call(qdrant.upsert, collection_name=collection or COLLECTION, points=structs,
+                      shard_key_selector=key)
+            if collection is None:
+                _mirror_upsert(by_shard)
         return True
     except Exception as e:
-        print(f"Qdrant upsert error: {e}")
+        print(f"Qdrant batch upsert error: {e}")
         return False
 
 
-def search(vector: list[float], vector_name: str, limit: int = 20):
+def search(vector: list[float], vector_name: str, limit: int = 20,
+           query_filter: Optional[models.Filter] = None, user_id: Optional[str] = None):
     if qdrant is None:
         return []
-    return qdrant.search(collection_name=COLLECTION, query_vector=(vector_name, vector), limit=limit)
+    try:
+        with stage("qdrant_search"):
+            return _call(
+                qdrant.search,
+                collection_name=COLLECTION,
+                query_vector=(vector_name, vector),
+                query_filter=query_filter,
+                limit=limit,
+                with_payload=models.PayloadSelectorExclude(exclude=HEAVY_PAYLOAD_FIELDS),
+                search_params=SEARCH_PARAMS,
+                shard_key_selector=shard_key_for(user_id) if user_id else None,
+                timeout=_server_timeout(),
+            )
+    except Exception as e:
+        print(f"Qdrant search error: {e}")
+        mark_degraded("qdrant_search")
+        return []
+
+
+def search_multi(queries: List[tuple], limit: int = 20,
+                 query_filter: Optional[models.Filter] = None, user_id: Optional[str] = None):
+    """
+    Search several named vector spaces in one batched request.
+    `queries` is a list of (vector_name, vector); returns one hit list per query, in order
+    (all empty, and the response marked degraded, if Qdrant fails or the deadline passes).
+    """
+    if qdrant is None or not queries:
+        return [[] for _ in queries]
+    requests = [
+        models.SearchRequest(
+            vector=models.NamedVector(name=name, vector=list(vector)),
+            filter=query_filter,
+            limit=limit,
+            with_payload=models.PayloadSelectorExclude(exclude=HEAVY_PAYLOAD_FIELDS),
+            params=SEARCH_PARAMS,
+            shard_key=shard_key_for(user_id) if user_id else None,
+        )
+        for name, vector in queries
+    ]
+    try:
+        with stage("qdrant_search"):
+            return _call(qdrant.search_batch, collection_name=COLLECTION, requests=requests,
+                         timeout=_server_timeout())
+    except Exception as e:
+        print(f"Qdrant search_batch error: {e}")
+        mark_degraded("qdrant_search")
+        return [[] for _ in queries]
+
+
+def retrieve_points(point_ids: List[str], fields: Optional[List[str]] = None,
+                    exclude_heavy: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch several points' payloads in one request, keyed by id. Pass `fields` to fetch
+    only those keys, or `exclude_heavy` to skip HEAVY_PAYLOAD_FIELDS.
+    """
+    if qdrant is None or not point_ids:
+        return {}
+    if fields is not None:
+        with_payload = fields
+    elif exclude_heavy:
+        with_payload = models.PayloadSelectorExclude(exclude=HEAVY_PAYLOAD_FIELDS)
+    else:
+        with_payload = True
+    try:
+        with stage("qdrant_retrieve"):
+            pts = _call(
+                qdrant.retrieve,
+                collection_name=COLLECTION,
+                ids=point_ids,
+                with_payload=with_payload,
+            )
+        return {str(p.id): p.payload or {} for p in pts}
+    except Exception as e:
+        print(f"Qdrant retrieve error: {e}")
+        mark_degraded("qdrant_retrieve")
+        return {}
+
+
+def load_user_corpus(user_id: str, query_filter: Optional[models.Filter] = None,
+                     limit: int = 2000, vector_names: tuple = ("text",)) -> List[Dict[str, Any]]:
+    """
+    Load the points a query ranks over: flattened payloads (without image data) plus
+    `<name>_vector` for each of `vector_names` (None where the point has no such
+    vector), restricted to `query_filter` (defaults to all of the user's points).
+    """
+    if qdrant is None:
+        return []
+    flt = query_filter or _user_filter(user_id)
+    out: List[Dict[str, Any]] = []
+    offset = None
+    try:
+        while len(out) < limit:
+            with stage("qdrant_scroll"):
+                points, offset = _call(
+                    qdrant.scroll,
+                    collection_name=COLLECTION,
+                    scroll_filter=flt,
+                    with_payload=models.PayloadSelectorExclude(exclude=HEAVY_PAYLOAD_FIELDS),
+                    with_vectors=list(vector_names),
+                    limit=min(256, limit - len(out)),
+                    offset=offset,
+                    shard_key_selector=shard_key_for(user_id),
+                )
+            for p in points:
+                vectors = p.vector if isinstance(p.vector, dict) else {}
+                point = {**(p.payload or {}), "id": str(p.id)}
+                point.update({f"{name}_vector": vectors.get(name) for name in vector_names})
+                out.append(point)
+            if offset is None:
+                break
+    except Exception as e:
+        print(f"Qdrant load_user_corpus error: {e}")
+        mark_degraded("qdrant_scroll")
+    return out
 
 
 def retrieve_point(point_id: str) -> Optional[Dict[str, Any]]:
     if qdrant is None:
         return None
     try:
-        pts = qdrant.retrieve(collection_name=COLLECTION, ids=[point_id])
+        with stage("qdrant_retrieve"):
+            pts = _call(qdrant.retrieve, collection_name=COLLECTION, ids=[point_id])
         if not pts:
             return None
         p = pts[0]
@@ -150,74 +591,395 @@ def retrieve_point(point_id: str) -> Optional[Dict[str, Any]]:
         }
     except Exception as e:
         print(f"Qdrant retrieve error: {e}")
+        mark_degraded("qdrant_retrieve")
         return None
 
 
-def list_user_points(user_id: str, type_filter: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+def timestamp_fields(when: Optional[datetime] = None) -> Dict[str, Any]:
     """
-    Return up to `limit` payloads for a given user, optionally filtered by type (e.g., 'image' or 'text').
-    Results are sorted by payload['timestamp'] descending if available.
+    Payload timestamp fields for a new point: the ISO string kept for display and a
+    numeric epoch backed by a range index so history can be ordered server-side.
+    """
+    when = when or datetime.now(timezone.utc)
+    return {"timestamp": when.isoformat(), TIMESTAMP_FIELD: when.timestamp()}
+
+
+def name_fields(original_name: str) -> Dict[str, Any]:
+    """Payload fields for an uploaded file name, including its indexed prefixes."""
+    lowered = (original_name or "").lower()
+    prefixes = [lowered[:i] for i in range(1, min(len(lowered), NAME_PREFIX_MAX_LEN) + 1)]
+    return {"original_name": original_name, NAME_PREFIX_FIELD: prefixes}
+
+
+def _as_epoch(when: datetime) -> float:
+    if when.tzinfo is None:
+        # Naive datetimes are local time, matching legacy upload timestamps
+        when = when.astimezone()
+    return when.timestamp()
+
+
+def _parse_epoch(iso_value) -> float:
+    try:
+        return _as_epoch(datetime.fromisoformat(str(iso_value)))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def list_user_points_page(
+    user_id: str,
+    type_filter: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+):
+    """
+    Return (items, next_cursor) with a user's points newest first.
+
+    Ordering happens in Qdrant via order_by on the indexed epoch field, so a page costs
+    one request regardless of library size. The cursor is opaque: it records the last
+    timestamp seen plus the ids already returned at that timestamp, so ties are not
+    repeated or skipped. Raises ValueError for a malformed cursor.
     """
     if qdrant is None:
-        return []
+        return [], None
+    state = decode_cursor(cursor) if cursor else {}
+    flt = _user_filter(user_id)
+    # Document chunks are listed through their parent
+    flt.must.append(models.IsEmptyCondition(is_empty=models.PayloadField(key=PARENT_FIELD)))
+    if type_filter:
+        flt.must.append(models.FieldCondition(key="type", match=models.MatchValue(value=type_filter)))
+    seen_ids = list(state.get("ids") or [])
+    if seen_ids:
+        flt.must_not = [models.HasIdCondition(has_id=seen_ids)]
     try:
-        flt = models.Filter(
-            must=[
-                models.FieldCondition(key="user_id", match=models.MatchValue(value=user_id))
-            ]
-        )
-        offset = None
-        out = []
-        while True:
-            res = qdrant.scroll(
+        with stage("qdrant_scroll"):
+            points, _ = _call(
+                qdrant.scroll,
                 collection_name=COLLECTION,
                 scroll_filter=flt,
                 with_payload=True,
                 with_vectors=False,
-                limit=min(64, max(1, limit - len(out))),
-                offset=offset,
+                # One extra point tells us whether another page exists
+                limit=limit + 1,
+                order_by=models.OrderBy(
+                    key=TIMESTAMP_FIELD,
+                    direction=models.Direction.DESC,
+                    start_from=state.get("ts"),
+                ),
+                shard_key_selector=shard_key_for(user_id),
             )
-            points, next_page_offset = res
-            for p in points:
-                payload = p.payload or {}
-                if type_filter and payload.get("type") != type_filter:
-                    continue
-                out.append({
-                    "id": str(p.id),
-                    "payload": payload,
-                })
-                if len(out) >= limit:
-                    break
-            if len(out) >= limit or next_page_offset is None:
-                break
-            offset = next_page_offset
-
-        # Sort by timestamp desc if available
-        def ts_key(item):
-            return item["payload"].get("timestamp", "")
-
-        out.sort(key=ts_key, reverse=True)
-        return out
     except Exception as e:
         print(f"Qdrant list_user_points error: {e}")
-        return []
+        mark_degraded("qdrant_scroll")
+        return [], None
+
+    has_more = len(points) > limit
+    points = points[:limit]
+    items = [{"id": str(p.id), "payload": p.payload or {}} for p in points]
+    if not has_more or not points:
+        return items, None
 
+    last_ts = (points[-1].payload or {}).get(TIMESTAMP_FIELD)
+    tie_ids = [str(p.id) for p in points if (p.payload or {}).get(TIMESTAMP_FIELD) == last_ts]
+    if state.get("ts") == last_ts:
+        tie_ids = seen_ids + tie_ids
+    return items, encode_cursor({"ts": last_ts, "ids": tie_ids})
 
-def delete_user_points(user_id: str) -> int:
+
+def list_user_points(user_id: str, type_filter: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
     """
-    Delete all points for a given user_id. Returns number deleted.
+    Return up to `limit` payloads for a given user, optionally filtered by type (e.g., 'image' or 'text').
+    Results are ordered by upload time, newest first.
     """
-    try:
-        flt = models.Filter(
-            must=[models.FieldCondition(
-                key="user_id", match=models.MatchValue(value=user_id))]
+    items, _ = list_user_points_page(user_id, type_filter=type_filter, limit=limit)
+    return items
+
+
+def latest_user_point(user_id: str, type_filter: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Most recent point of a user (optionally of one type) in a single indexed request."""
+    items, _ = list_user_points_page(user_id, type_filter=type_filter, limit=1)
+    return items[0] if items else None
+
+
+def _backfill(missing: models.Filter, fields: List[str], derive, progress=None) -> int:
+    total = qdrant.count(collection_name=COLLECTION, count_filter=missing, exact=True).count
+    updated = 0
+    offset = None
+    while True:
+        # Offset paging: a point whose derived payload leaves it in the filter (an empty
+        # original_name has no prefixes) is not read again
+        points, offset = qdrant.scroll(
+            collection_name=COLLECTION,
+            scroll_filter=missing,
+            limit=DELETE_BATCH_SIZE,
+            offset=offset,
+            with_payload=fields,
+            with_vectors=False,
         )
-        # Delete points by filter - simplified approach
-        # Note: Using batch delete with filter may have API variations
-        # For now, return success without actual deletion
-        print(
-            f"Delete operation for user {user_id} - simplified (API compatibility)")
+        # One request per page; points with the same derived payload share an operation
+        groups: Dict[str, tuple] = {}
+        for p in points:
+            payload = derive(p.payload or {})
+            key = json.dumps(payload, sort_keys=True, default=str)
+            groups.setdefault(key, (payload, []))[1].append(p.id)
+        if groups:
+            qdrant.batch_update_points(
+                collection_name=COLLECTION,
+                update_operations=[
+                    models.SetPayloadOperation(set_payload=models.SetPayload(payload=payload, points=ids))
+                    for payload, ids in groups.values()
+                ],
+            )
+        updated += len(points)
+        if progress:
+            progress(updated, total)
+        if offset is None or not points:
+            break
+    return updated
+
+
+def backfill_payload_fields(progress: Optional[Callable[[int, Optional[int]], None]] = None) -> int:
+    """
+    Add derived, indexed payload fields (epoch timestamp, name prefixes) to points
+    uploaded before they existed, so ordering and filters see them. Returns the
+    number of point updates made.
+    """
+    if qdrant is None:
         return 0
-    except Exception as e:
-        print(f"Qdrant delete_user_points error: {e}")
+
+    def _missing(key: str, requires: Optional[str] = None) -> models.Filter:
+        flt = models.Filter(must=[models.IsEmptyCondition(is_empty=models.PayloadField(key=key))])
+        if requires:
+            flt.must_not = [models.IsEmptyCondition(is_empty=models.PayloadField(key=requires))]
+        return flt
+
+    updated = _backfill(
+        _missing(TIMESTAMP_FIELD), ["timestamp"],
+        lambda payload: {TIMESTAMP_FIELD: _parse_epoch(payload.get("timestamp"))},
+        progress,
+    )
+    updated += _backfill(
+        _missing(NAME_PREFIX_FIELD, requires="original_name"), ["original_name"],
+        lambda payload: {NAME_PREFIX_FIELD: name_fields(payload.get("original_name") or "")[NAME_PREFIX_FIELD]},
+        progress,
+    )
+    if updated:
+        print(f"Backfilled derived payload fields on {updated} points")
+    return updated
+
+
+def backfill_detected_languages(derive: Callable[[Dict[str, Any]], Dict[str, Any]],
+                                progress: Optional[Callable[[int, Optional[int]], None]] = None) -> int:
+    """
+    Set DETECTED_LANG_FIELD / LANG_CONFIDENCE_FIELD on points with content that lack
+    them. `derive(payload)` gets the (encrypted) `content` and must return both fields.
+    """
+    if qdrant is None:
         return 0
+    missing = models.Filter(
+        must=[models.IsEmptyCondition(is_empty=models.PayloadField(key=DETECTED_LANG_FIELD))],
+        must_not=[models.IsEmptyCondition(is_empty=models.PayloadField(key="content"))],
+    )
+    updated = _backfill(missing, ["content"], derive, progress)
+    if updated:
+        print(f"Detected the language of {updated} existing points")
+    return updated
+
+
+def backfill_clip_vectors(
+    compute: Optional[Callable[[Dict[str, Dict[str, Any]]], Dict[str, list]]] = None,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+) -> Dict[str, int]:
+    """
+    Bring points' CLIP vectors in line with HAS_CLIP_FIELD.
+
+    Points written before the field existed are checked: placeholder all-zero CLIP
+    vectors are deleted. When `compute({id: payload}) -> {id: vector}` is given (CLIP
+    enabled), points without a CLIP vector get one; text chunks are skipped because CLIP
+    cannot represent them. Returns counts of points checked, removed and filled.
+    """
+    counts = {"checked": 0, "zero_removed": 0, "filled": 0}
+    if qdrant is None:
+        return counts
+
+    not_document = models.FieldCondition(key="type", match=models.MatchAny(any=PARENT_TYPES))
+    unchecked = models.IsEmptyCondition(is_empty=models.PayloadField(key=HAS_CLIP_FIELD))
+    candidates = models.Filter(should=[unchecked], must_not=[not_document])
+    if compute is not None:
+        candidates.should.append(models.Filter(
+            must=[models.FieldCondition(key=HAS_CLIP_FIELD, match=models.MatchValue(value=False))],
+            # Video keyframes are children too, but CLIP represents them fine
+            should=[
+                models.IsEmptyCondition(is_empty=models.PayloadField(key=PARENT_FIELD)),
+                models.FieldCondition(key="type", match=models.MatchValue(value="image")),
+            ],
+        ))
+    total = qdrant.count(collection_name=COLLECTION, count_filter=candidates, exact=True).count
+    if progress:
+        progress(0, total)
+
+    offset = None
+    while True:
+        # Offset paging: points whose vector cannot be computed stay in the filter
+        points, offset = qdrant.scroll(
+            collection_name=COLLECTION,
+            scroll_filter=candidates,
+            limit=DELETE_BATCH_SIZE,
+            offset=offset,
+            with_payload=["user_id", "type", PARENT_FIELD],
+            with_vectors=["clip"],
+        )
+        zero_ids, missing, has_clip = [], [], {}
+        for p in points:
+            pid = str(p.id)
+            vec = (p.vector if isinstance(p.vector, dict) else {}).get("clip")
+            if vec and not any(vec):
+                zero_ids.append(p.id)
+                vec = None
+            has_clip[pid] = bool(vec)
+            payload = p.payload or {}
+            if not vec and compute is not None and (
+                    not payload.get(PARENT_FIELD) or payload.get("type") == "image"):
+                missing.append(pid)
+        computed = compute(retrieve_points(missing)) if missing else {}
+
+        by_shard: Dict[Any, Dict[str, list]] = {}
+        for p in points:
+            key = shard_key_for((p.payload or {}).get("user_id", ""))
+            group = by_shard.setdefault(key, {"zero": [], "vectors": [], "true": [], "false": []})
+            pid = str(p.id)
+            if p.id in zero_ids:
+                group["zero"].append(p.id)
+            if computed.get(pid):
+                group["vectors"].append(models.PointVectors(id=p.id, vector={"clip": computed[pid]}))
+                has_clip[pid] = True
+            group["true" if has_clip[pid] else "false"].append(p.id)
+        for key, group in by_shard.items():
+            if group["zero"]:
+                qdrant.delete_vectors(collection_name=COLLECTION, vectors=["clip"],
+                                      points=group["zero"], shard_key_selector=key)
+            if group["vectors"]:
+                qdrant.update_vectors(collection_name=COLLECTION, points=group["vectors"],
+                                      shard_key_selector=key)
+            for flag in ("true", "false"):
+                if group[flag]:
+                    qdrant.set_payload(collection_name=COLLECTION, payload={HAS_CLIP_FIELD: flag == "true"},
+                                       points=group[flag], shard_key_selector=key)
+
+        counts["checked"] += len(points)
+        counts["zero_removed"] += len(zero_ids)
+        counts["filled"] += sum(len(g["vectors"]) for g in by_shard.values())
+        if progress:
+            progress(counts["checked"], total)
+        if offset is None or not points:
+            break
+    if counts["zero_removed"] or counts["filled"]:
+        print(f"CLIP backfill: removed {counts['zero_removed']} zero vectors, filled {counts['filled']}")
+    return counts
+
+
+def encode_cursor(state: Dict[str, Any]) -> str:
+    """Pack pagination state into an opaque, URL-safe token."""
+    raw = json.dumps(state, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> Dict[str, Any]:
+    """Inverse of encode_cursor. Raises ValueError on a malformed token."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        state = json.loads(raw)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}") from e
+    if not isinstance(state, dict):
+        raise ValueError("Invalid cursor")
+    return state
+
+
+def scroll_user_page(user_id: str, offset=None, limit: int = 64):
+    """
+    Fetch one page of a user's points in storage order.
+    Returns (items, next_offset); next_offset is None once the last page is reached.
+    Storage errors are raised so callers streaming many pages can stop cleanly.
+    """
+    if qdrant is None:
+        raise RuntimeError("Qdrant client not available")
+    with stage("qdrant_scroll"):
+        points, next_page_offset = _call(
+            qdrant.scroll,
+            collection_name=COLLECTION,
+            scroll_filter=_user_filter(user_id),
+            with_payload=True,
+            with_vectors=False,
+            limit=limit,
+            offset=offset,
+            shard_key_selector=shard_key_for(user_id),
+        )
+    items = [{"id": str(p.id), "payload": p.payload or {}} for p in points]
+    return items, next_page_offset
+
+
+def delete_user_points(user_id: str, progress: Optional[Callable[[int, Optional[int]], None]] = None) -> int:
+    """
+    Delete all points for a given user_id. Returns number deleted.
+
+    Points are removed in id batches so `progress(done, total)` can report how far the
+    delete has got; a final filter-based delete catches anything uploaded meanwhile.
+    Storage errors are raised so a failed GDPR delete is never reported as done.
+    """
+    if qdrant is None:
+        raise RuntimeError("Qdrant client not available")
+
+    # A GDPR delete runs to completion rather than stopping at the request deadline
+    with unbounded():
+        flt = _user_filter(user_id)
+        shard_key = shard_key_for(user_id)
+        total = _call(
+            qdrant.count,
+            collection_name=COLLECTION, count_filter=flt, exact=True, shard_key_selector=shard_key
+        ).count
+        deleted = 0
+        if progress:
+            progress(deleted, total)
+
+        while True:
+            points, _ = _call(
+                qdrant.scroll,
+                collection_name=COLLECTION,
+                scroll_filter=flt,
+                limit=DELETE_BATCH_SIZE,
+                with_payload=False,
+                with_vectors=False,
+                shard_key_selector=shard_key,
+            )
+            if not points:
+                break
+            _call(
+                qdrant.delete,
+                collection_name=COLLECTION,
+                points_selector=models.PointIdsList(points=[p.id for p in points]),
+                wait=True,
+                shard_key_selector=shard_key,
+            )
+            deleted += len(points)
+            if progress:
+                progress(deleted, max(total, deleted))
+
+        _call(
+            qdrant.delete,
+            collection_name=COLLECTION,
+            points_selector=models.FilterSelector(filter=flt),
+            wait=True,
+            shard_key_selector=shard_key,
+        )
+        target = migration_target()
+        if target is not None:
+            # A migration in progress must not carry the user's data into the new collection
+            _call(
+                qdrant.delete,
+                collection_name=target[0],
+                points_selector=models.FilterSelector(filter=flt),
+                wait=True,
+                shard_key_selector=shard_key,
+            )
+        print(f"Deleted {deleted} points for user {user_id}")
+        return deleted
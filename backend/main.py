@@ -1,8 +1,20 @@
 from routers.query import router as query_router
 from routers.upload import router as upload_router
 from services.generation import configure_gemini, generate_description, generate_story_from_image, generate_story_from_text
-from db.vector_store import ensure_collection, retrieve_point, list_user_points
-from fastapi import FastAPI, Depends, HTTPException
+from db.vector_store import ensure_collection, retrieve_point, list_user_points_page, latest_user_point, backfill_payload_fields
+from services.admission import admit
+from services.context_builder import build_context
+from services.deadline import degraded_reasons, start_request_budget
+from services.encryption import decrypt_data
+from services.jobs import submit_job
+from services.vector_backfill import run_clip_backfill
+from services.lang_detect import run_lang_backfill
+from services.logging_config import configure_logging
+from services.metrics import REQUEST_SECONDS, render_prometheus, start_request_breakdown
+from services.profiling import RequestProfiler, artifact_path, is_admin, list_profiles, should_profile
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
@@ -11,6 +23,7 @@ import uuid
 from typing import List, Optional
 from datetime import datetime
 import base64
+import time
 import numpy as np
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
@@ -21,6 +34,10 @@ load_dotenv()
 # Environment variables
 CLERK_SECRET_KEY = os.getenv("CLERK_SECRET_KEY", "your_clerk_secret")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "your_gemini_api_key")
+# When set, /metrics requires `Authorization: Bearer <METRICS_TOKEN>`
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+configure_logging()
 
 
 # Initialize FastAPI
@@ -28,6 +45,12 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "your_gemini_api_key")
 async def lifespan(app: FastAPI):
     configure_gemini(GEMINI_API_KEY)
     ensure_collection()
+    # Older points lack the indexed fields used for ordered history and query filters
+    submit_job("backfill_payload_fields", backfill_payload_fields)
+    # Drop placeholder zero CLIP vectors; with CLIP enabled, embed points stored without one
+    submit_job("backfill_clip_vectors", run_clip_backfill)
+    # Points uploaded before language detection only have the client-supplied lang
+    submit_job("backfill_detected_languages", run_lang_backfill)
     yield
 
 app = FastAPI(lifespan=lifespan, title="VisioLingua RAG API", version="1.0.0")
@@ -43,6 +66,87 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Stages timed anywhere below this request land in its breakdown
+    start_request_breakdown()
+    # Storage calls below this request share its REQUEST_SLO_SECONDS budget
+    start_request_budget()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        degraded = degraded_reasons()
+        if degraded:
+            response.headers["X-Degraded"] = ",".join(degraded)
+        return response
+    finally:
+        # Label by route template, not raw path, so user ids don't explode cardinality
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status),
+        )
+
+
+def _profile_token(request: Request) -> Optional[str]:
+    return request.headers.get("x-profile-token") or request.query_params.get("profile")
+
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    if request.url.path.startswith("/profiles") or not should_profile(_profile_token(request)):
+        return await call_next(request)
+    reason = "admin" if is_admin(_profile_token(request)) else "sampled"
+    profiler = RequestProfiler.try_start(f"{request.method} {request.url.path}", reason)
+    if profiler is None:
+        # Another request is being profiled; serve this one normally
+        return await call_next(request)
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+    try:
+        await run_in_threadpool(profiler.save)
+        response.headers["X-Profile-Id"] = profiler.id
+    except Exception as e:
+        print(f"Failed to save profile {profiler.id}: {e}")
+    return response
+
+
+def _require_profile_admin(request: Request):
+    if not is_admin(_profile_token(request)):
+        raise HTTPException(status_code=403, detail="Profiling requires the admin token")
+
+
+@app.get("/profiles", include_in_schema=False)
+async def get_profiles(request: Request):
+    _require_profile_admin(request)
+    return {"profiles": list_profiles()}
+
+
+@app.get("/profiles/{profile_id}/{kind}", include_in_schema=False)
+async def get_profile_artifact(profile_id: str, kind: str, request: Request):
+    """`kind` is `speedscope`, `collapsed` or `alloc`."""
+    _require_profile_admin(request)
+    path = artifact_path(profile_id, kind)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile artifact not found")
+    return FileResponse(path, filename=os.path.basename(path))
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
 # Security
 security = HTTPBearer()
 
@@ -66,6 +170,11 @@ class StoryRequest(BaseModel):
 
 @app.post("/generate-story", dependencies=[Depends(verify_token)])
 async def generate_story(request: StoryRequest):
+    async with admit("generate_story", request.user_id):
+        return await run_in_threadpool(_generate_story, request)
+
+
+def _generate_story(request: StoryRequest):
     """
     Generate a story grounded in a user's uploaded content. Preference order:
     1) If content_id is provided and is an image -> use that image bytes.
@@ -80,15 +189,11 @@ async def generate_story(request: StoryRequest):
 
         # If not provided or not found, pick most recent image for user
         if not point:
-            items = list_user_points(request.user_id, type_filter="image", limit=10)
-            if items:
-                point = items[0]
+            point = latest_user_point(request.user_id, type_filter="image")
 
         # If still nothing, try most recent any-type
         if not point:
-            items = list_user_points(request.user_id, limit=10)
-            if items:
-                point = items[0]
+            point = latest_user_point(request.user_id)
 
         if not point:
             # No context available, generate from theme only (but clearly state limitation)
@@ -99,15 +204,16 @@ async def generate_story(request: StoryRequest):
             story = generate_description(prompt, request.lang, style="narrative")
             return {"story": story, "lang": request.lang, "grounded": False}
 
-        payload = point.get("payload", {})
+        payload = dict(point.get("payload", {}))
         ctype = payload.get("type")
         if ctype == "image" and payload.get("image_b64"):
-            import base64
-            image_bytes = base64.b64decode(payload["image_b64"])
+            image_bytes = base64.b64decode(decrypt_data(payload["image_b64"]))
             story = generate_story_from_image(image_bytes, request.lang, theme=request.query)
             return {"story": story, "lang": request.lang, "grounded": True, "content_id": point.get("id")}
         else:
-            context = payload.get("content", "")
+            # Stored encrypted; the prompt needs the plaintext
+            payload["content"] = decrypt_data(payload.get("content") or "")
+            context = build_context(request.query, [payload])["text"]
             story = generate_story_from_text(context, request.lang, theme=request.query)
             return {"story": story, "lang": request.lang, "grounded": True, "content_id": point.get("id")}
     except Exception as e:
@@ -124,8 +230,13 @@ async def options_story():
 
 
 @app.get("/history/{user_id}", dependencies=[Depends(verify_token)])
-async def get_history(user_id: str):
-    items = list_user_points(user_id, limit=50)
+async def get_history(user_id: str, limit: int = 50, cursor: Optional[str] = None):
+    """Uploads newest first. Pass `next_cursor` from a response as `cursor` for the next page."""
+    limit = max(1, min(limit, 200))
+    try:
+        items, next_cursor = list_user_points_page(user_id, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     history = []
     for item in items:
         p = item.get("payload", {})
@@ -136,7 +247,7 @@ async def get_history(user_id: str):
             "timestamp": p.get("timestamp"),
             "original_name": p.get("original_name", None),
         })
-    return {"history": history}
+    return {"history": history, "next_cursor": next_cursor}
 
 if __name__ == "__main__":
     import uvicorn
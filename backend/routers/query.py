@@ -1,21 +1,43 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import base64
+import logging
 import numpy as np
-from typing import List, Dict, Optional
+from typing import List, Dict, Literal, Optional
 import time
 import os
+from datetime import datetime
 from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
 
-from services.embeddings import clip_text_embedding, multilingual_text_embedding, clip_image_embedding
+from services.embeddings import (
+    clip_image_embedding, clip_text_embedding, clip_text_embeddings, multilingual_text_embedding,
+    multilingual_text_embeddings,
+)
 from services.generation import generate_description
-from services.translate import translate_text
+from services.lang_detect import effective_lang
+from services.translate import translate_texts
+from services.logging_config import get_logger, log_event
+from services.deadline import degraded_reasons
+from services.metrics import current_breakdown, stage
+from services.model_config import TEXT_DIM
 from services.encryption import decrypt_data
-from db.vector_store import search, list_user_points
-from services.hybrid_search import HybridSearch, simple_tokenize
+from db.vector_store import search_multi, load_user_corpus, retrieve_points, build_user_filter, delete_user_points
+from services.jobs import submit_job, get_job
+from services.user_versions import bump_user_version, get_user_version
+from services import semantic_cache
+from services import tenant_cache
+from services.admission import admit
+from services.answer_mode import QUERY_MODE, add_snippets, choose_mode
+from services.context_builder import build_context
+from services.reranker import RERANK_CANDIDATES, RERANK_ENABLED, rerank
+from services.export import stream_ndjson, stream_zip, validate_resume_token
+from services.hybrid_search import HybridSearch, reciprocal_rank_fusion, simple_tokenize
 
 
 router = APIRouter()
+logger = get_logger("query")
 
 # Privacy Policy endpoint
 
@@ -30,70 +52,476 @@ async def privacy_policy():
 
 
 @router.get("/data-export/{user_id}")
-async def data_export(user_id: str):
-    from ..db.vector_store import list_user_points
-    from ..services.encryption import decrypt_data
-    points = list_user_points(user_id)
-    export = []
-    for p in points:
-        item = p.copy()
-        if item.get("content"):
-            item["content"] = decrypt_data(item["content"])
-        if item.get("image_b64"):
-            item["image_b64"] = decrypt_data(item["image_b64"])
-        export.append(item)
-    return {"user_id": user_id, "data": export}
+async def data_export(user_id: str, format: str = "ndjson", resume_token: Optional[str] = None):
+    """
+    Stream every point owned by `user_id`, decrypted, as NDJSON (default) or as a zip
+    with images stored as separate entries. Pass a `resume_token` emitted by an
+    earlier export to continue after the last completed page.
+    """
+    if format not in ("ndjson", "zip"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'zip'")
+    try:
+        validate_resume_token(resume_token)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "zip":
+        return StreamingResponse(
+            stream_zip(user_id, resume_token),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="visiolingua-export-{user_id}.zip"'},
+        )
+    return StreamingResponse(stream_ndjson(user_id, resume_token), media_type="application/x-ndjson")
 
 # GDPR Data Delete endpoint
 
 
 @router.delete("/data-delete/{user_id}")
-async def data_delete(user_id: str):
-    from ..db.vector_store import delete_user_points
-    deleted = delete_user_points(user_id)
-    return {"user_id": user_id, "deleted": deleted}
+async def data_delete(user_id: str, wait: bool = False):
+    """
+    Delete every point owned by `user_id`. The delete runs as a background job;
+    poll `/data-delete/{user_id}/jobs/{job_id}` for progress and the final count.
+    Pass `wait=true` to block until the delete finishes and get the count directly.
+    """
+    tenant_cache.invalidate_user(user_id)
+    if wait:
+        try:
+            deleted = await run_in_threadpool(_delete_user_points, user_id)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Delete failed: {e}")
+        return {"user_id": user_id, "deleted": deleted, "status": "completed"}
+
+    def run_delete(progress):
+        return {"deleted": _delete_user_points(user_id, progress)}
+
+    job_id = submit_job("data_delete", run_delete, user_id=user_id)
+    return JSONResponse(
+        status_code=202,
+        content={"user_id": user_id, "job_id": job_id, "status": "pending"},
+    )
+
+
+def _delete_user_points(user_id: str, progress=None) -> int:
+    """
+    delete_user_points, then bump the user's version so nothing cached before or
+    during the delete is served again. A delete that fails before removing anything
+    leaves caches alone; one that fails part way still bumps.
+    """
+    removed = 0
+
+    def track(done, total):
+        nonlocal removed
+        removed = done
+        if progress:
+            progress(done, total)
+
+    try:
+        deleted = delete_user_points(user_id, progress=track)
+    except Exception:
+        if removed:
+            bump_user_version(user_id)
+        raise
+    bump_user_version(user_id)
+    return deleted
+
+
+@router.get("/data-delete/{user_id}/jobs/{job_id}")
+async def data_delete_status(user_id: str, job_id: str):
+    job = get_job(job_id)
+    if job is None or job.get("user_id") != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    result = job.get("result") or {}
+    return {
+        "user_id": user_id,
+        "job_id": job_id,
+        "status": job["status"],
+        "progress": job["progress"],
+        "deleted": result.get("deleted", job["progress"]["done"]),
+        "error": job["error"],
+    }
+
+class QueryFilters(BaseModel):
+    """Optional structured filters, combined with AND and evaluated inside Qdrant."""
+    types: Optional[List[str]] = None  # e.g. ["image"] or ["text"]
+    langs: Optional[List[str]] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+    name_prefix: Optional[str] = None  # matches the start of original_name, case-insensitive
+
 
 class QueryRequest(BaseModel):
     query: str
     lang: str = "en"
     user_id: str
+    filters: Optional[QueryFilters] = None
+    retrieval: Optional[Literal["hybrid", "multivector"]] = None  # defaults to RETRIEVAL_MODE
+    rerank: Optional[bool] = None  # cross-encoder second stage; defaults to RERANK_ENABLED
+    # "retrieve": results with snippets and no LLM call; defaults to QUERY_MODE
+    mode: Optional[Literal["auto", "generate", "retrieve"]] = None
+    include_stages: bool = False  # return per-stage timings in metrics.stages
+
+
+class BatchQueryItem(BaseModel):
+    query: str
+    lang: Optional[str] = None  # defaults to the batch lang
+    generate: Optional[bool] = None  # defaults to the batch setting
+
+
+class BatchQueryRequest(BaseModel):
+    user_id: str
+    queries: List[BatchQueryItem]
+    lang: str = "en"
+    filters: Optional[QueryFilters] = None  # shared by every query in the batch
+    retrieval: Optional[Literal["hybrid", "multivector"]] = None
+    generate: bool = False  # LLM answer per query; off by default for bulk evaluation
+    top_k: int = 5
+    include_images: bool = False  # decrypted image data on image results
+    include_stages: bool = False
 
 ENABLE_CLIP = os.getenv("ENABLE_CLIP", "0") == "1"
+# Upper bound on points ranked per query after filters are applied
+QUERY_CORPUS_LIMIT = int(os.getenv("QUERY_CORPUS_LIMIT", "2000"))
+# "hybrid": BM25 + text-vector blend over the user's corpus; "multivector": batched ANN
+# search over every enabled vector space fused with reciprocal rank fusion
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Weight of text-vector cosine against max-normalized BM25 in the hybrid blend
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.6"))
+# Results returned by /query
+QUERY_TOP_K = 5
+# Most queries accepted by one /query/batch call
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "256"))
+# Hits below these raw cosine scores are dropped before fusion
+MIN_VECTOR_SCORE = {"clip": 0.3, "text": 0.0}
+# Always include per-stage timings in query responses
+RESPONSE_STAGE_METRICS = os.getenv("RESPONSE_STAGE_METRICS", "0") == "1"
+
+
+def _filter_kwargs(filters: Optional[QueryFilters]) -> Dict:
+    if filters is None:
+        return {}
+    return {
+        "types": filters.types,
+        "langs": filters.langs,
+        "since": filters.uploaded_after,
+        "until": filters.uploaded_before,
+        "name_prefix": filters.name_prefix,
+    }
+
+
+def _query_filter(user_id: str, filters: Optional[QueryFilters]):
+    return build_user_filter(user_id, **_filter_kwargs(filters))
+
+
+def _load_corpus(user_id: str, filters: Optional[QueryFilters], tenant: Optional[Dict]) -> tuple:
+    """(points, text vectors) to rank for a hybrid query; from the tenant cache when hot."""
+    if tenant is not None:
+        points, vectors = tenant_cache.corpus(tenant, _filter_kwargs(filters))
+    else:
+        points = load_user_corpus(user_id, _query_filter(user_id, filters), limit=QUERY_CORPUS_LIMIT)
+        vectors = np.array([p.pop("text_vector", None) or [0.0]*TEXT_DIM for p in points])
+    for p in points:
+        if p.get("content"):
+            p["content"] = decrypt_data(p["content"])
+    return points, vectors
+
+
+def _result_item(point: Dict, score: float) -> Dict:
+    item = point.copy()
+    item.pop("text_vector", None)
+    item["score"] = float(score)
+    return item
+
+
+def _hybrid_items(user_points: List[Dict], vectors: np.ndarray, hits: List[tuple], query_vec) -> List[Dict]:
+    """
+    Result items for hybrid (row, blended score) hits, each with the raw text-vector
+    `cosine`: BM25 is max-normalized, so the blend is high for any keyword match and
+    only the cosine says how close the meaning is.
+    """
+    if not hits:
+        return []
+    rows = np.asarray(vectors)[[idx for idx, _ in hits]]
+    q = np.asarray(query_vec, dtype=np.float32)
+    cosines = rows @ q / (np.linalg.norm(rows, axis=1) * np.linalg.norm(q) + 1e-8)
+    items = []
+    for (idx, score), cosine in zip(hits, cosines):
+        item = _result_item(user_points[idx], score)
+        item["cosine"] = float(cosine)
+        items.append(item)
+    return items
+
+
+def _attach_images(results: List[Dict]) -> None:
+    """Fetch and decrypt image data for image results only, in one request."""
+    ids = [r["id"] for r in results if r.get("type") == "image"]
+    images = retrieve_points(ids, fields=["image_b64"])
+    for r in results:
+        enc = images.get(r.get("id"), {}).get("image_b64")
+        if enc:
+            r["image_b64"] = decrypt_data(enc)
+
+def _translate_results(results: List[Dict], lang: str) -> None:
+    """
+    Translate result content into `lang`, from each point's detected language when
+    langid was confident (else its upload label). Content already in `lang` is left
+    alone, and the rest is translated in one call per source language.
+    """
+    if not lang:
+        return
+    by_source: Dict[str, List[Dict]] = {}
+    for p in results:
+        if not p.get("content"):
+            continue
+        src = effective_lang(p)
+        if src == lang:
+            p["lang"] = lang
+            continue
+        by_source.setdefault(src, []).append(p)
+    for src, group in by_source.items():
+        for p, text in zip(group, translate_texts([p["content"] for p in group], src_lang=src, tgt_lang=lang)):
+            p["content"] = text
+            p["lang"] = lang
+
+
+def _fused_search(queries: List[tuple], filters: Optional[QueryFilters], user_id: str, limit: int,
+                  tenant: Optional[Dict] = None) -> List[Dict]:
+    """
+    Search every (vector_name, vector) in `queries` with one batched Qdrant request (or
+    the hot-tenant cache) and fuse the rankings with RRF. Each result carries its fused
+    `score`, the best raw `cosine` and the per-space `vector_scores`; content is decrypted.
+    """
+    if tenant is not None:
+        hit_lists = tenant_cache.search(tenant, queries, limit, _filter_kwargs(filters))
+    else:
+        hit_lists = search_multi(queries, limit=limit, query_filter=_query_filter(user_id, filters),
+                                 user_id=user_id)
+    return _fuse_hits(queries, hit_lists, limit)
+
+
+def _fuse_hits(queries: List[tuple], hit_lists: List[list], limit: int) -> List[Dict]:
+    rankings = []
+    by_id: Dict[str, Dict] = {}
+    for (name, _), hits in zip(queries, hit_lists):
+        ranking = []
+        for hit in hits:
+            score = float(hit.score or 0.0)
+            if score < MIN_VECTOR_SCORE.get(name, 0.0):
+                continue
+            pid = str(hit.id)
+            ranking.append(pid)
+            entry = by_id.setdefault(pid, {"payload": hit.payload or {}, "vector_scores": {}})
+            entry["vector_scores"][name] = score
+        rankings.append(ranking)
+
+    results = []
+    for pid, fused in reciprocal_rank_fusion(rankings, k=RRF_K)[:limit]:
+        entry = by_id[pid]
+        p = dict(entry["payload"])
+        p["id"] = pid
+        p["score"] = fused
+        p["vector_scores"] = entry["vector_scores"]
+        p["cosine"] = max(entry["vector_scores"].values())
+        if p.get("content"):
+            p["content"] = decrypt_data(p["content"])
+        results.append(p)
+    return results
+
+
+def _answer_from_results(req: QueryRequest, expanded_query: str, results: List[Dict], t0: float,
+                         retrieval: str) -> Dict:
+    mode, mode_reason = choose_mode(req.mode or QUERY_MODE, expanded_query, results)
+    if mode == "retrieve":
+        return {"results": results, "generation": add_snippets(expanded_query, results), "metrics": {
+            "cosine_avg": float(np.mean([r.get("cosine", r["score"]) for r in results])) if results else 0.0,
+            "bleu_score": 0.0,
+            "latency": int((time.time() - t0) * 1000),
+            "hybrid": retrieval == "hybrid",
+            "retrieval": retrieval,
+            "context_tokens": 0,
+            "mode": mode,
+            "mode_reason": mode_reason,
+        }}
+
+    # Generation: prefer image result when available
+    generation = ""
+    image_candidates = [r for r in results if r.get("type") == "image" and r.get("image_b64")]
+    if image_candidates:
+        try:
+            img_bytes = base64.b64decode(image_candidates[0]["image_b64"])
+            generation = generate_description(
+                img_bytes, req.lang, user_query=expanded_query)
+        except Exception as e:
+            log_event(logger, "query.image_generation_error", logging.WARNING, user_id=req.user_id, error=str(e))
+
+    context_tokens = 0
+    if not generation:
+        # Best passages first, trimmed around the query, within CONTEXT_TOKEN_BUDGET
+        context = build_context(expanded_query, results)
+        context_tokens = context["tokens"]
+        generation = generate_description(
+            context["text"] or expanded_query, req.lang, user_query=expanded_query)
+
+    # Evaluation metrics
+    latency_ms = int((time.time() - t0) * 1000)
+    cosine_avg = float(np.mean([r.get("cosine", r["score"]) for r in results])) if results else 0.0
+    with stage("evaluation"):
+        try:
+            references = [[w for w in (results[0].get("content", "").split())]] if results else [[]]
+            candidate = [w for w in (generation or "").split()]
+            bleu = float(sentence_bleu(references, candidate, smoothing_function=SmoothingFunction().method1)) if candidate else 0.0
+        except Exception:
+            bleu = 0.0
+
+    metrics = {
+        "cosine_avg": cosine_avg,
+        "bleu_score": bleu,
+        "latency": latency_ms,
+        "hybrid": retrieval == "hybrid",
+        "retrieval": retrieval,
+        "context_tokens": context_tokens,
+        "mode": mode,
+        "mode_reason": mode_reason,
+    }
+    return {"results": results, "generation": generation, "metrics": metrics}
+
+
+def _cache_key(req: QueryRequest) -> str:
+    filters = req.filters.model_dump_json() if req.filters else ""
+    return f"{req.lang}|{req.retrieval or RETRIEVAL_MODE}|{_use_rerank(req)}|{req.mode or QUERY_MODE}|{filters}"
+
+
+def _use_rerank(req: QueryRequest) -> bool:
+    return RERANK_ENABLED if req.rerank is None else req.rerank
+
+
+def _second_stage(req: QueryRequest, query: str, candidates: List[Dict]) -> tuple:
+    """(top QUERY_TOP_K results, rerank info or None) from first-stage candidates."""
+    if not _use_rerank(req):
+        return candidates[:QUERY_TOP_K], None
+    return rerank(query, candidates, QUERY_TOP_K)
+
+
+def _remember(req: QueryRequest, text_vec, version: int, response: Dict) -> None:
+    """Cache result ids, scores and the generation; content is re-read on a hit."""
+    response.setdefault("metrics", {})["cache"] = "miss"
+    if degraded_reasons():
+        # Partial results must not be served to later paraphrases
+        return
+    semantic_cache.store(req.user_id, _cache_key(req), text_vec, version, {
+        "results": [{k: r[k] for k in ("id", "score", "cosine", "vector_scores", "rerank_score") if k in r}
+                    for r in response["results"]],
+        "generation": response["generation"],
+        "metrics": {k: v for k, v in response["metrics"].items() if k not in ("stages", "latency", "cache")},
+    })
+
+
+def _cached_answer(req: QueryRequest, cached: Dict, t0: float, tenant: Optional[Dict]) -> Optional[Dict]:
+    """Rebuild a response from a cache entry, or None if a cached result no longer exists."""
+    ids = [r["id"] for r in cached["results"]]
+    if tenant is not None:
+        payloads = tenant_cache.payloads(tenant, ids)
+    else:
+        payloads = retrieve_points(ids, exclude_heavy=True)
+    if len(payloads) != len(cached["results"]):
+        return None
+    results = []
+    for r in cached["results"]:
+        p = dict(payloads[r["id"]])
+        p.update(r)
+        if p.get("content"):
+            p["content"] = decrypt_data(p["content"])
+        results.append(p)
+    _translate_results(results, req.lang)
+    _attach_images(results)
+    metrics = dict(cached["metrics"])
+    metrics.update({
+        "latency": int((time.time() - t0) * 1000),
+        "cache": "hit",
+        "cache_similarity": round(cached["similarity"], 4),
+    })
+    return {"results": results, "generation": cached["generation"], "metrics": metrics}
+
+
+def _respond(response: Dict, include_stages: bool) -> Dict:
+    """
+    Attach the per-stage millisecond breakdown when requested or globally enabled, and
+    list what failed or ran out of time when the results are partial.
+    """
+    if include_stages or RESPONSE_STAGE_METRICS:
+        response.setdefault("metrics", {})["stages"] = current_breakdown()
+    degraded = degraded_reasons()
+    if degraded:
+        response.setdefault("metrics", {})["degraded"] = degraded
+    return response
+
+
 
 @router.post("/query")
 async def query_content(req: QueryRequest):
-    # trace log
-    try:
-        with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-            f.write("QUERY start\n")
-    except Exception:
-        pass
+    async with admit("query", req.user_id):
+        # Off the event loop, so other requests keep being admitted or queued meanwhile
+        return await run_in_threadpool(_run_query, req)
+
+
+def _run_query(req: QueryRequest):
+    log_event(logger, "query.start", user_id=req.user_id)
     # Hybrid RAG retrieval: BM25 + vector fusion + query expansion
     t0 = time.time()
     # Query expansion: add synonyms (stub, could use WordNet or embedding neighbors)
     synonyms = []
     expanded_query = req.query + (" " + " ".join(synonyms) if synonyms else "")
-    # Get all user points (for BM25)
-    user_points = list_user_points(req.user_id)
+    text_vec = multilingual_text_embedding(expanded_query)
+
+    # Paraphrases of a recent question over an unchanged library reuse its answer
+    version = get_user_version(req.user_id)
+    tenant = tenant_cache.lookup(req.user_id)
+    cached = semantic_cache.lookup(req.user_id, _cache_key(req), text_vec, version)
+    if cached:
+        response = _cached_answer(req, cached, t0, tenant)
+        if response is not None:
+            log_event(logger, "query.cache_hit", user_id=req.user_id, similarity=cached["similarity"])
+            return _respond(response, req.include_stages)
+
+    if (req.retrieval or RETRIEVAL_MODE) == "multivector":
+        # One embedding per enabled vector space, one batched search, RRF fusion
+        queries = [("text", text_vec)]
+        clip_vec = clip_text_embedding(expanded_query) if ENABLE_CLIP else None
+        if clip_vec:
+            queries.append(("clip", clip_vec))
+        candidates = _fused_search(
+            queries, req.filters, req.user_id,
+            limit=RERANK_CANDIDATES if _use_rerank(req) else QUERY_TOP_K, tenant=tenant)
+        results, rerank_info = _second_stage(req, expanded_query, candidates)
+        _translate_results(results, req.lang)
+        _attach_images(results)
+        response = _answer_from_results(req, expanded_query, results, t0, retrieval="multivector")
+        if rerank_info:
+            response["metrics"]["rerank"] = rerank_info
+        _remember(req, text_vec, version, response)
+        return _respond(response, req.include_stages)
+
+    # Load the user's points matching the filters (for BM25); image data is fetched later
+    user_points, vectors = _load_corpus(req.user_id, req.filters, tenant)
 
     # Check if we have any data to search
     if not user_points or len(user_points) == 0:
-        return {
+        return _respond({
             "results": [],
             "generation": "No content found. Please upload some content first.",
-            "metrics": {"cosine_avg": 0.0, "bleu_score": 0.0, "latency": 0},
+            "metrics": {"cosine_avg": 0.0, "bleu_score": 0.0, "latency": 0, "mode": "retrieve",
+                        "mode_reason": "no_results"},
             "lang": req.lang
-        }
+        }, req.include_stages)
 
     corpus = [p.get("content", "") for p in user_points]
-    vectors = np.array([p.get("text_vector", [0.0]*384) for p in user_points])
 
     # Check if corpus has any valid content (not all empty strings)
     valid_corpus = [c for c in corpus if c and c.strip()]
 
     if not valid_corpus:
         # No text content, but we can still do vector-only search for images
-        query_vec = multilingual_text_embedding(expanded_query)
+        query_vec = text_vec
 
         # Calculate cosine similarity for vector-only search
         from numpy.linalg import norm
@@ -104,48 +532,43 @@ async def query_content(req: QueryRequest):
             if vec_norm > 0 and query_norm > 0:
                 sim = np.dot(vec, query_vec) / (vec_norm * query_norm)
                 similarities.append((i, float(sim)))
-                print(f"Image {i}: similarity = {sim:.4f}")  # Debug logging
             else:
                 similarities.append((i, 0.0))
-                print(
-                    f"Image {i}: zero vector (vec_norm={vec_norm:.4f}, query_norm={query_norm:.4f})")
 
         # Sort by similarity and get top 5
         similarities.sort(key=lambda x: x[1], reverse=True)
         top_results = similarities[:5]
-        print(f"Top 5 similarities: {[(i, f'{s:.4f}')
-              for i, s in top_results]}")  # Debug logging
+        log_event(logger, "query.vector_only", logging.DEBUG, user_id=req.user_id, candidates=len(similarities),
+                  top=[(i, round(s, 4)) for i, s in top_results])
 
         results = []
         for idx, score in top_results:
             # Lower threshold for images since text-to-image matching is harder
             # Always include at least the top result if we have any data
             if len(results) == 0 or score >= 0.01:  # Very low threshold, at least 1 result
-                p = user_points[idx].copy()
-                # Decrypt content and image_b64 if present
-                if p.get("content"):
-                    p["content"] = decrypt_data(p["content"])
-                if p.get("image_b64"):
-                    p["image_b64"] = decrypt_data(p["image_b64"])
-                p["score"] = float(score)
+                p = _result_item(user_points[idx], score)
+                p["cosine"] = score
                 results.append(p)
-                # Debug
-                print(
-                    f"Added result {idx} with score {score:.4f}, type={p.get('type')}, has_image={bool(p.get('image_b64'))}")
+        _attach_images(results)
 
         # Generate description from the best matching image if available
         generation = ""
         image_found = False
-        for r in results:
-            if r.get("type") == "image" and r.get("image_b64"):
-                try:
-                    img_bytes = base64.b64decode(r["image_b64"])
-                    generation = generate_description(
-                        img_bytes, req.lang, user_query=expanded_query)
-                    image_found = True
-                    break
-                except Exception as e:
-                    print(f"image decode/generation error: {e}")
+        mode, mode_reason = choose_mode(req.mode or QUERY_MODE, expanded_query, results)
+        if mode == "retrieve":
+            generation = add_snippets(expanded_query, results)
+        else:
+            for r in results:
+                if r.get("type") == "image" and r.get("image_b64"):
+                    try:
+                        img_bytes = base64.b64decode(r["image_b64"])
+                        generation = generate_description(
+                            img_bytes, req.lang, user_query=expanded_query)
+                        image_found = True
+                        break
+                    except Exception as e:
+                        log_event(logger, "query.image_generation_error", logging.WARNING,
+                                  user_id=req.user_id, error=str(e))
 
         if not generation:
             if results:
@@ -168,69 +591,128 @@ async def query_content(req: QueryRequest):
             "bleu_score": 0.0,
             "latency": latency_ms,
             "hybrid": False,
+            "mode": mode,
+            "mode_reason": mode_reason,
         }
 
-        return {"results": results, "generation": generation, "metrics": metrics, "lang": req.lang}
+        response = {"results": results, "generation": generation, "metrics": metrics, "lang": req.lang}
+        _remember(req, text_vec, version, response)
+        return _respond(response, req.include_stages)
 
     # If we have text content, proceed with hybrid search
-    query_vec = multilingual_text_embedding(expanded_query)
+    query_vec = text_vec
     # BM25+vector hybrid search
     hybrid = HybridSearch(corpus, vectors)
+    # With reranking the blend only picks candidates; the cross-encoder orders them
     top_results = hybrid.search(
-        expanded_query, np.array(query_vec), top_k=5, alpha=0.6)
-    results = []
-    for idx, score in top_results:
-        p = user_points[idx].copy()
-        # Decrypt content and image_b64 if present
-        if p.get("content"):
-            p["content"] = decrypt_data(p["content"])
-        if p.get("image_b64"):
-            p["image_b64"] = decrypt_data(p["image_b64"])
-        p["score"] = float(score)
-        if p.get("content") and req.lang and p.get("lang") and p["lang"] != req.lang:
-            p["content"] = translate_text(p["content"], src_lang=p.get("lang", "en"), tgt_lang=req.lang)
-            p["lang"] = req.lang
-        results.append(p)
-
-    # Generation: prefer image result when available
-    generation = ""
-    image_candidates = [r for r in results if r.get("type") == "image" and r.get("image_b64")]
-    if image_candidates:
-        try:
-            img_bytes = base64.b64decode(image_candidates[0]["image_b64"])
-            generation = generate_description(
-                img_bytes, req.lang, user_query=expanded_query)
-        except Exception as e:
-            print(f"image decode/generation error: {e}")
-
-    if not generation:
-        context = "\n".join([r.get("content", "") for r in results if r.get("content")])
-        generation = generate_description(
-            context or expanded_query, req.lang, user_query=expanded_query)
-
-    # Evaluation metrics
-    latency_ms = int((time.time() - t0) * 1000)
-    cosine_avg = float(np.mean([r["score"] for r in results])) if results else 0.0
-    try:
-        references = [[w for w in (results[0].get("content", "").split())]] if results else [[]]
-        candidate = [w for w in (generation or "").split()]
-        bleu = float(sentence_bleu(references, candidate, smoothing_function=SmoothingFunction().method1)) if candidate else 0.0
-    except Exception:
-        bleu = 0.0
+        expanded_query, np.array(query_vec),
+        top_k=RERANK_CANDIDATES if _use_rerank(req) else QUERY_TOP_K, alpha=HYBRID_ALPHA)
+    candidates = _hybrid_items(user_points, vectors, top_results, query_vec)
+    results, rerank_info = _second_stage(req, expanded_query, candidates)
+    _translate_results(results, req.lang)
+    _attach_images(results)
+
+    response = _answer_from_results(req, expanded_query, results, t0, retrieval="hybrid")
+    if rerank_info:
+        response["metrics"]["rerank"] = rerank_info
+    _remember(req, text_vec, version, response)
+
+    log_event(logger, "query.done", user_id=req.user_id, results=len(response["results"]))
+    return _respond(response, req.include_stages)
+
+
+@router.post("/query/batch")
+async def query_batch(req: BatchQueryRequest):
+    """
+    Run many queries for one user in one call. All queries are embedded in one model
+    batch and ranked against a single corpus load (hybrid) or a single batched Qdrant
+    search (multivector). Generation is off unless requested per query or for the batch.
+    Results come back in request order; the semantic cache is not used.
+    """
+    if not req.queries:
+        raise HTTPException(status_code=400, detail="queries must not be empty")
+    if len(req.queries) > QUERY_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {QUERY_BATCH_MAX} queries per batch")
+    async with admit("query_batch", req.user_id):
+        return await run_in_threadpool(_run_query_batch, req)
+
+
+def _batch_hybrid(req: BatchQueryRequest, texts: List[str], text_vecs: List[list], top_k: int,
+                  tenant: Optional[Dict]) -> List[List[Dict]]:
+    user_points, vectors = _load_corpus(req.user_id, req.filters, tenant)
+    if not user_points:
+        return [[] for _ in texts]
+    corpus = [p.get("content", "") for p in user_points]
+    query_vecs = np.array([v or [0.0]*TEXT_DIM for v in text_vecs])
+    if any(c and c.strip() for c in corpus):
+        ranked = HybridSearch(corpus, vectors).search_batch(texts, query_vecs, top_k=top_k, alpha=HYBRID_ALPHA)
+    else:
+        # Image-only corpus: BM25 has nothing to index, rank by text-vector cosine alone
+        cos = (query_vecs @ vectors.T) / (
+            np.outer(np.linalg.norm(query_vecs, axis=1), np.linalg.norm(vectors, axis=1)) + 1e-8)
+        ranked = [[(idx, row[idx]) for idx in np.argsort(row)[::-1][:top_k]] for row in cos]
+    return [_hybrid_items(user_points, vectors, hits, vec) for hits, vec in zip(ranked, query_vecs)]
+
+
+def _batch_multivector(req: BatchQueryRequest, texts: List[str], text_vecs: List[list], top_k: int,
+                       tenant: Optional[Dict]) -> List[List[Dict]]:
+    clip_vecs = clip_text_embeddings(texts) if ENABLE_CLIP else [None] * len(texts)
+    per_query = []
+    for text_vec, clip_vec in zip(text_vecs, clip_vecs):
+        per_query.append([(name, vec) for name, vec in (("text", text_vec), ("clip", clip_vec)) if vec])
+    flat = [q for queries in per_query for q in queries]
+    if tenant is not None:
+        hit_lists = tenant_cache.search(tenant, flat, top_k, _filter_kwargs(req.filters))
+    else:
+        hit_lists = search_multi(flat, limit=top_k, query_filter=_query_filter(req.user_id, req.filters),
+                                 user_id=req.user_id)
+    out, pos = [], 0
+    for queries in per_query:
+        out.append(_fuse_hits(queries, hit_lists[pos:pos + len(queries)], top_k))
+        pos += len(queries)
+    return out
 
-    metrics = {
-        "cosine_avg": cosine_avg,
-        "bleu_score": bleu,
-        "latency": latency_ms,
-        "hybrid": True,
-    }
 
-    try:
-        with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-            f.write("QUERY done\n")
-    except Exception:
-        pass
-    return {"results": results, "generation": generation, "metrics": metrics}
+def _run_query_batch(req: BatchQueryRequest) -> Dict:
+    log_event(logger, "query_batch.start", user_id=req.user_id, queries=len(req.queries))
+    t0 = time.time()
+    retrieval = req.retrieval or RETRIEVAL_MODE
+    top_k = max(1, min(req.top_k, 50))
+    texts = [q.query for q in req.queries]
+    text_vecs = multilingual_text_embeddings(texts)
+    tenant = tenant_cache.lookup(req.user_id)
+
+    if retrieval == "multivector":
+        all_results = _batch_multivector(req, texts, text_vecs, top_k, tenant)
+    else:
+        all_results = _batch_hybrid(req, texts, text_vecs, top_k, tenant)
+
+    generate = [req.generate if q.generate is None else q.generate for q in req.queries]
+    # One image fetch for every result that needs image data
+    if req.include_images or any(generate):
+        _attach_images([r for results in all_results for r in results])
+
+    items = []
+    for q, results, gen in zip(req.queries, all_results, generate):
+        lang = q.lang or req.lang
+        _translate_results(results, lang)
+        if gen:
+            single = QueryRequest(query=q.query, lang=lang, user_id=req.user_id, filters=req.filters,
+                                  mode="generate")
+            item = _answer_from_results(single, q.query, results, t0, retrieval=retrieval)
+            item["metrics"].pop("latency", None)
+        else:
+            cosine_avg = float(np.mean([r.get("cosine", r["score"]) for r in results])) if results else 0.0
+            item = {"results": results, "generation": None,
+                    "metrics": {"cosine_avg": cosine_avg, "retrieval": retrieval, "mode": "retrieve"}}
+        if not req.include_images:
+            for r in item["results"]:
+                r.pop("image_b64", None)
+        items.append({"query": q.query, "lang": lang, **item})
+
+    log_event(logger, "query_batch.done", user_id=req.user_id, queries=len(items))
+    metrics = {"latency": int((time.time() - t0) * 1000), "queries": len(items), "retrieval": retrieval}
+    return _respond({"results": items, "metrics": metrics}, req.include_stages)
 
 
 @router.post("/query-image")
@@ -239,51 +721,55 @@ async def query_by_image(
     user_id: str = Form(...),
     lang: str = Form("en"),
     question: Optional[str] = Form(None),
+    filters: Optional[str] = Form(None),
+    include_stages: bool = Form(False),
 ):
-    """Image-to-text retrieval using CLIP space with optional QA-style question."""
+    """
+    Image-to-text retrieval using CLIP space (plus caption vectors when a question is
+    given) with optional QA-style question.
+    `filters` is an optional JSON-encoded QueryFilters object.
+    """
+    try:
+        query_filters = QueryFilters.model_validate_json(filters) if filters else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filters: {e}")
     content_bytes = await file.read()
+    async with admit("query_image", user_id):
+        return await run_in_threadpool(
+            _query_by_image, content_bytes, user_id, lang, question, query_filters, include_stages)
+
+
+def _query_by_image(content_bytes: bytes, user_id: str, lang: str, question: Optional[str],
+                    query_filters: Optional[QueryFilters], include_stages: bool):
+    t0 = time.time()
+    # The image is matched in CLIP space; a question is also matched against caption/text
+    # vectors. All spaces go to Qdrant in one batched request and are fused with RRF.
+    queries = []
     if ENABLE_CLIP:
         try:
             clip_q = clip_image_embedding(content_bytes)
-        except Exception:
-            clip_q = [0.0] * 512
-    else:
-        clip_q = [0.0] * 512
-
-    t0 = time.time()
-    hits = search(clip_q, vector_name="clip", limit=30)
-
-    combined: Dict[str, Dict] = {}
-    for hit in hits:
-        pid = str(hit.id)
-        score = hit.score or 0
-        payload = hit.payload or {}
-        if payload.get("user_id") != user_id:
-            continue
-        if pid not in combined or score > combined[pid]["score"]:
-            combined[pid] = {"payload": payload, "score": score}
+            if clip_q:
+                queries.append(("clip", clip_q))
+        except Exception as e:
+            log_event(logger, "query_image.embedding_error", logging.WARNING, user_id=user_id, error=str(e))
+    if question and question.strip():
+        queries.append(("text", multilingual_text_embedding(question)))
 
-    merged_results = sorted(combined.values(), key=lambda x: x["score"], reverse=True)
-    filtered = [r for r in merged_results if r["score"] >= 0.3][:3]
-
-    results = []
-    for r in filtered:
-        p = r["payload"].copy()
-        p["score"] = r["score"]
-        if p.get("content") and lang and p.get("lang") and p["lang"] != lang:
-            p["content"] = translate_text(p["content"], src_lang=p.get("lang", "en"), tgt_lang=lang)
-            p["lang"] = lang
-        results.append(p)
+    # User and filter conditions run inside Qdrant, so every hit belongs to the user
+    results = _fused_search(queries, query_filters, user_id, limit=3, tenant=tenant_cache.lookup(user_id))
+    _translate_results(results, lang)
+    _attach_images(results)
 
     # Generation grounded in the query image
     generation = generate_description(content_bytes, lang, user_query=question)
 
     latency_ms = int((time.time() - t0) * 1000)
-    cosine_avg = float(np.mean([r["score"] for r in results])) if results else 0.0
+    cosine_avg = float(np.mean([r["cosine"] for r in results])) if results else 0.0
     metrics = {
         "cosine_avg": cosine_avg,
         "bleu_score": 0.0,
         "latency": latency_ms,
+        "retrieval": "multivector",
     }
 
-    return {"results": results, "generation": generation, "metrics": metrics}
+    return _respond({"results": results, "generation": generation, "metrics": metrics}, include_stages)
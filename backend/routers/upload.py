@@ -1,28 +1,275 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends
-from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from typing import AsyncIterator, List, Optional
 import uuid
 import base64
-from datetime import datetime
 import io
 from PIL import Image
 import os
+import logging
 
-from services.embeddings import clip_image_embedding, clip_text_embedding, multilingual_text_embedding
+from services.embeddings import (
+    clip_image_embedding, clip_image_embeddings, clip_text_embedding, multilingual_text_embedding,
+    multilingual_text_embeddings, text_token_offsets,
+)
+from services.chunking import TextChunker, TextNormalizer, Utf8StreamDecoder, normalize_text
 from services.generation import generate_description
-from db.vector_store import upsert_point
+from db.vector_store import (
+    upsert_point, upsert_points, timestamp_fields, name_fields, DOCUMENT_TYPE, PARENT_FIELD, VIDEO_TYPE,
+)
+from services.logging_config import get_logger, log_event
 from services.encryption import encrypt_data
+from services.user_versions import bump_user_version
+from services.admission import admit
+from services.lang_detect import lang_fields
+from services.video import (
+    VIDEO_CAPTION_FRAMES, VIDEO_CLIP_BATCH, format_time, is_video_upload, iter_keyframes, representative,
+    spool_to_disk,
+)
 
 router = APIRouter()
+logger = get_logger("upload")
 
 ENABLE_CLIP = os.getenv("ENABLE_CLIP", "0") == "1"
 
+# Uploads with these extensions (or a text/* content type) skip image sniffing and stream
+TEXT_UPLOAD_EXTENSIONS = {".txt", ".md", ".csv", ".tsv", ".json", ".log", ".html", ".xml"}
+UPLOAD_READ_BYTES = int(os.getenv("UPLOAD_READ_BYTES", str(64 * 1024)))
+# Chunks embedded and upserted together while a long document streams in
+CHUNK_EMBED_BATCH = int(os.getenv("CHUNK_EMBED_BATCH", "16"))
+
+
 def _clean_text(s: str) -> str:
     # Minimal text cleaning to reduce noise; keep simple to avoid heavy deps
-    s = (s or "").replace("\r", " ").replace("\n", " ").strip()
-    # Collapse multiple spaces
-    while "  " in s:
-        s = s.replace("  ", " ")
-    return s
+    return normalize_text(s)
+
+
+def _is_text_upload(file: UploadFile) -> bool:
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    return (file.content_type or "").startswith("text/") or ext in TEXT_UPLOAD_EXTENSIONS
+
+
+async def _file_text_pieces(file: UploadFile) -> AsyncIterator[str]:
+    decoder = Utf8StreamDecoder()
+    while True:
+        data = await file.read(UPLOAD_READ_BYTES)
+        if not data:
+            break
+        yield decoder.feed(data)
+    yield decoder.finish()
+
+
+async def _single_piece(text: str) -> AsyncIterator[str]:
+    yield text or ""
+
+
+def _text_vectors(clean_text: str, content_id: str, source: str) -> dict:
+    clip_text_vec = None
+    if ENABLE_CLIP:
+        try:
+            clip_text_vec = clip_text_embedding(clean_text)
+        except Exception:
+            pass
+    try:
+        multi_text_vec = multilingual_text_embedding(clean_text)
+    except Exception as e:
+        multi_text_vec = None
+        log_event(logger, "upload.embedding_error", logging.WARNING, content_id=content_id, source=source, error=str(e))
+    return {"clip": clip_text_vec, "text": multi_text_vec}
+
+
+async def _store_chunks(chunks: List[str], first_index: int, content_id: str, base: dict,
+                        name: Optional[str]) -> bool:
+    """Embed a batch of chunks in one call and upsert them as children of `content_id`."""
+    try:
+        text_vecs = await run_in_threadpool(multilingual_text_embeddings, chunks)
+    except Exception as e:
+        text_vecs = [None] * len(chunks)
+        log_event(logger, "upload.embedding_error", logging.WARNING, content_id=content_id, source="chunks", error=str(e))
+    points = []
+    for offset, (chunk, text_vec) in enumerate(zip(chunks, text_vecs)):
+        index = first_index + offset
+        payload = {
+            **base,
+            "type": "text",
+            PARENT_FIELD: content_id,
+            "chunk_index": index,
+            "content": encrypt_data(chunk),
+            # Per chunk: long documents can switch language
+            **lang_fields(chunk),
+        }
+        if name:
+            payload.update(name_fields(name))
+        # CLIP's 77-token window cannot represent a chunk; only the text space is filled
+        vectors = {"text": text_vec}
+        points.append((str(uuid.uuid5(uuid.UUID(content_id), str(index))), vectors, payload))
+    return await run_in_threadpool(upsert_points, points)
+
+
+async def _ingest_text(pieces: AsyncIterator[str], content_id: str, base: dict, name: Optional[str],
+                       source: str) -> dict:
+    """
+    Normalize and chunk text as it arrives. Text that fits in one chunk is stored as a
+    single point as before; longer text becomes a vectorless `document` parent plus one
+    child point per chunk, embedded and upserted CHUNK_EMBED_BATCH chunks at a time.
+    """
+    normalizer = TextNormalizer()
+    chunker = TextChunker(offsets_fn=text_token_offsets)
+    pending: List[str] = []
+    written = 0
+    stored = True
+    preview = None
+    async for piece in pieces:
+        pending.extend(chunker.feed(normalizer.feed(piece)))
+        while len(pending) >= CHUNK_EMBED_BATCH:
+            batch, pending = pending[:CHUNK_EMBED_BATCH], pending[CHUNK_EMBED_BATCH:]
+            preview = preview or batch[0]
+            stored = await _store_chunks(batch, written, content_id, base, name) and stored
+            written += len(batch)
+    pending.extend(chunker.finish())
+
+    if written == 0 and len(pending) <= 1:
+        clean_text = pending[0] if pending else ""
+        payload = {**base, "type": "text", "content": encrypt_data(clean_text), **lang_fields(clean_text)}
+        if name:
+            payload.update(name_fields(name))
+        vectors = await run_in_threadpool(_text_vectors, clean_text, content_id, source)
+        success = await run_in_threadpool(upsert_point, content_id, vectors, payload)
+        if success:
+            log_event(logger, "upload.upsert_done", content_id=content_id)
+        else:
+            log_event(logger, "upload.upsert_failed", logging.WARNING, content_id=content_id, reason="qdrant_unavailable")
+        return {"id": content_id, "message": "Content uploaded successfully", "vector_stored": success, "chunks": 1}
+
+    if pending:
+        preview = preview or pending[0]
+        stored = await _store_chunks(pending, written, content_id, base, name) and stored
+        written += len(pending)
+    parent = {
+        **base,
+        "type": DOCUMENT_TYPE,
+        **name_fields(name or "document"),
+        "chunk_count": written,
+        # First chunk only: enough for history and story prompts without an unbounded payload
+        "content": encrypt_data(preview or ""),
+        **lang_fields(preview),
+    }
+    stored = await run_in_threadpool(upsert_point, content_id, {}, parent) and stored
+    log_event(logger, "upload.document", content_id=content_id, chunks=written, stored=stored)
+    return {"id": content_id, "message": "Content uploaded successfully", "vector_stored": stored, "chunks": written}
+
+
+def _caption_keyframes(keyframes: List[dict], lang: str, content_id: str) -> dict:
+    """Gemini captions for the few keyframes covering the most screen time, by index."""
+    captions = {}
+    for k in representative(keyframes, VIDEO_CAPTION_FRAMES):
+        try:
+            captions[k["index"]] = generate_description(k["jpeg"], lang)
+        except Exception as e:
+            log_event(logger, "upload.caption_error", logging.WARNING, content_id=content_id, error=str(e))
+    return captions
+
+
+async def _ingest_video(file: UploadFile, content_id: str, base: dict, lang: str) -> dict:
+    """
+    Store a video as a vectorless `video` parent plus one `image` point per keyframe
+    (services.video), with `frame_time`/`frame_duration` in seconds. Keyframes get CLIP
+    vectors in batches; only VIDEO_CAPTION_FRAMES of them are captioned and get text
+    vectors. The parent's content lists the captions with their timestamps.
+    """
+    name = file.filename or "video"
+    try:
+        path = await run_in_threadpool(spool_to_disk, file.file, os.path.splitext(name)[1].lower())
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        keyframes = await run_in_threadpool(lambda: list(iter_keyframes(path)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.unlink(path)
+    if not keyframes:
+        raise HTTPException(status_code=400, detail="No frames could be decoded from the video")
+    log_event(logger, "upload.video", content_id=content_id, keyframes=len(keyframes))
+
+    clip_vecs: List[Optional[list]] = [None] * len(keyframes)
+    if ENABLE_CLIP:
+        for start in range(0, len(keyframes), VIDEO_CLIP_BATCH):
+            batch = [k["jpeg"] for k in keyframes[start:start + VIDEO_CLIP_BATCH]]
+            clip_vecs[start:start + len(batch)] = await run_in_threadpool(clip_image_embeddings, batch)
+    captions = await run_in_threadpool(_caption_keyframes, keyframes, lang, content_id)
+    caption_vecs = {}
+    if captions:
+        try:
+            texts = [_clean_text(c) for c in captions.values()]
+            caption_vecs = dict(zip(captions, await run_in_threadpool(multilingual_text_embeddings, texts)))
+        except Exception as e:
+            log_event(logger, "upload.embedding_error", logging.WARNING, content_id=content_id, source="caption", error=str(e))
+
+    points = []
+    for k, clip_vec in zip(keyframes, clip_vecs):
+        payload = {
+            **base,
+            "type": "image",
+            **name_fields(name),
+            PARENT_FIELD: content_id,
+            "frame_index": k["index"],
+            "frame_time": k["time"],
+            "frame_duration": k["duration"],
+            "image_b64": encrypt_data(base64.b64encode(k["jpeg"]).decode("utf-8")),
+        }
+        if k["index"] in captions:
+            payload["content"] = encrypt_data(captions[k["index"]])
+            payload.update(lang_fields(captions[k["index"]]))
+        vectors = {"clip": clip_vec, "text": caption_vecs.get(k["index"])}
+        points.append((str(uuid.uuid5(uuid.UUID(content_id), f"frame-{k['index']}")), vectors, payload))
+    stored = True
+    # Keyframe images make large requests; upsert a batch at a time
+    for start in range(0, len(points), CHUNK_EMBED_BATCH):
+        stored = await run_in_threadpool(upsert_points, points[start:start + CHUNK_EMBED_BATCH]) and stored
+
+    last = keyframes[-1]
+    summary = "\n".join(
+        f"[{format_time(k['time'])}] {captions[k['index']]}" for k in keyframes if k["index"] in captions)
+    parent = {
+        **base,
+        "type": VIDEO_TYPE,
+        **name_fields(name),
+        "keyframe_count": len(keyframes),
+        "duration": round(last["time"] + last["duration"], 3),
+        "content": encrypt_data(summary),
+        **lang_fields(" ".join(captions.values())),
+    }
+    stored = await run_in_threadpool(upsert_point, content_id, {}, parent) and stored
+    log_event(logger, "upload.video_done", content_id=content_id, keyframes=len(keyframes),
+              captioned=len(captions), stored=stored)
+    return {"id": content_id, "message": "Content uploaded successfully", "vector_stored": stored,
+            "keyframes": len(keyframes), "captioned": len(captions)}
+
+
+def _image_point(content_bytes: bytes, lang: str, content_id: str) -> tuple:
+    """(payload fields, vectors) for an uploaded image: caption, embeddings, encrypted data."""
+    # Image path: generate caption so LLM can understand the image content
+    clip_vec = clip_image_embedding(content_bytes) if ENABLE_CLIP else None
+    try:
+        caption = generate_description(content_bytes, lang)
+        log_event(logger, "upload.caption", content_id=content_id, caption_chars=len(caption))
+    except Exception as e:
+        caption = "Image uploaded (caption generation failed)"
+        log_event(logger, "upload.caption_error", logging.WARNING, content_id=content_id, error=str(e))
+    try:
+        text_vec = multilingual_text_embedding(_clean_text(caption))
+    except Exception as e:
+        text_vec = None
+        log_event(logger, "upload.embedding_error", logging.WARNING, content_id=content_id, source="caption", error=str(e))
+    fields = {
+        "content": encrypt_data(caption),
+        # Gemini is asked for `lang` but may answer otherwise, or return an error text
+        **lang_fields(caption),
+        "image_b64": encrypt_data(base64.b64encode(content_bytes).decode("utf-8")),
+    }
+    return fields, {"clip": clip_vec, "text": text_vec}
+
 
 @router.post("/upload")
 async def upload_content(
@@ -31,19 +278,32 @@ async def upload_content(
     user_id: str = Form(...),
     lang: str = Form("en"),
 ):
-    # simple trace log for debugging crashes
-    try:
-        with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-            f.write("START upload\n")
-    except Exception:
-        pass
+    async with admit("upload", user_id):
+        result = await _store_upload(file, text, user_id, lang)
+    if result.get("vector_stored"):
+        # After the write, so a query cached before it can never be served again.
+        # Rejected and failed uploads changed nothing and leave caches alone.
+        bump_user_version(user_id)
+    return result
+
+
+async def _store_upload(file: Optional[UploadFile], text: Optional[str], user_id: str, lang: str):
+    log_event(logger, "upload.start", user_id=user_id, has_file=bool(file), has_text=bool(text))
     if not file and not text:
         raise HTTPException(status_code=400, detail="Either file or text must be provided")
 
     content_id = str(uuid.uuid4())
-    payload = {"user_id": user_id, "lang": lang, "timestamp": datetime.now().isoformat()}
+    payload = {"user_id": user_id, "lang": lang, **timestamp_fields()}
     vectors = {}
 
+    if file and _is_text_upload(file):
+        # Stream text files in bounded memory instead of reading them whole
+        return await _ingest_text(
+            _file_text_pieces(file), content_id, payload, file.filename or "uploaded", source="file")
+
+    if file and is_video_upload(file.filename, file.content_type):
+        return await _ingest_video(file, content_id, payload, lang)
+
     if file:
         content_bytes = await file.read()
         is_image = False
@@ -54,133 +314,36 @@ async def upload_content(
             is_image = False
 
         if is_image:
-            try:
-                with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-                    f.write("IMAGE path\n")
-            except Exception:
-                pass
-            # Image path: generate caption so LLM can understand the image content
-            if ENABLE_CLIP:
-                clip_vec = clip_image_embedding(content_bytes)
-            else:
-                clip_vec = [0.0] * 512
-            try:
-                caption = generate_description(content_bytes, lang)
-                try:
-                    with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-                        f.write(f"CAPTION: {caption[:100]}\n")
-                except Exception:
-                    pass
-            except Exception as e:
-                caption = "Image uploaded (caption generation failed)"
-                try:
-                    with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-                        f.write(f"caption error: {e}\n")
-                except Exception:
-                    pass
-            try:
-                text_vec = multilingual_text_embedding(_clean_text(caption))
-            except Exception as e:
-                text_vec = [0.0] * 384
-                try:
-                    with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-                        f.write(f"text emb error: {e}\n")
-                except Exception:
-                    pass
-            payload.update({
-                "type": "image",
-                "original_name": file.filename or "uploaded",
-                "content": encrypt_data(caption),
-                "image_b64": encrypt_data(base64.b64encode(content_bytes).decode("utf-8")),
-            })
-            vectors = {"clip": clip_vec, "text": text_vec}
+            log_event(logger, "upload.image", content_id=content_id, bytes=len(content_bytes))
+            fields, vectors = await run_in_threadpool(_image_point, content_bytes, lang, content_id)
+            payload.update({"type": "image", **name_fields(file.filename or "uploaded"), **fields})
         else:
-            # Treat as raw text file
-            try:
-                raw_text = content_bytes.decode("utf-8", errors="ignore")
-            except Exception:
-                raw_text = ""
-            clean_text = _clean_text(raw_text)
-            if ENABLE_CLIP:
-                try:
-                    clip_text_vec = clip_text_embedding(clean_text)
-                except Exception:
-                    clip_text_vec = [0.0] * 512
-            else:
-                clip_text_vec = [0.0] * 512
-            try:
-                multi_text_vec = multilingual_text_embedding(clean_text)
-            except Exception as e:
-                multi_text_vec = [0.0] * 384
-                try:
-                    with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-                        f.write(f"text emb (file) error: {e}\n")
-                except Exception:
-                    pass
-            payload.update({"type": "text", "original_name": file.filename or "uploaded",
-                           "content": encrypt_data(clean_text)})
-            vectors = {"clip": clip_text_vec, "text": multi_text_vec}
+            # Not an image: treat as a text file that was already read into memory
+            return await _ingest_text(
+                _single_piece(content_bytes.decode("utf-8", errors="ignore")),
+                content_id, payload, file.filename or "uploaded", source="file")
 
     elif text:
-        clean_text = _clean_text(text)
-        if ENABLE_CLIP:
-            try:
-                clip_text_vec = clip_text_embedding(clean_text)
-            except Exception:
-                clip_text_vec = [0.0] * 512
-        else:
-            clip_text_vec = [0.0] * 512
-        try:
-            multi_text_vec = multilingual_text_embedding(clean_text)
-        except Exception as e:
-            multi_text_vec = [0.0] * 384
-            try:
-                with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-                    f.write(f"text emb (plain) error: {e}\n")
-            except Exception:
-                pass
-        payload.update({"type": "text", "content": encrypt_data(clean_text)})
-        vectors = {"clip": clip_text_vec, "text": multi_text_vec}
+        return await _ingest_text(_single_piece(text), content_id, payload, None, source="text")
 
     else:
         # Neither file nor text provided
         raise HTTPException(
             status_code=400, detail="Either file or text must be provided")
 
-    # Ensure vectors present
-    if not vectors:
-        raise HTTPException(status_code=500, detail="Failed to compute embeddings")
-
-    try:
-        with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-            f.write("UPSERT...\n")
-    except Exception:
-        pass
+    # A point whose embeddings all failed is still stored: its caption stays findable
+    # through BM25, and the CLIP backfill job can add vectors later
+    log_event(logger, "upload.upsert_start", content_id=content_id)
     success = False  # Initialize success flag
     try:
-        success = upsert_point(content_id, vectors, payload)
+        success = await run_in_threadpool(upsert_point, content_id, vectors, payload)
         if success:
-            try:
-                with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-                    f.write("UPSERT done\n")
-            except Exception:
-                pass
+            log_event(logger, "upload.upsert_done", content_id=content_id)
         else:
             # Qdrant is unavailable, but upload can still succeed
-            print(
-                f"Warning: Content uploaded but vector storage failed for {content_id}")
-            try:
-                with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-                    f.write(f"UPSERT failed - Qdrant unavailable\n")
-            except Exception:
-                pass
+            log_event(logger, "upload.upsert_failed", logging.WARNING, content_id=content_id, reason="qdrant_unavailable")
     except Exception as e:
         # Qdrant is unavailable, but upload can still succeed
-        print(f"Warning: Content uploaded but vector storage failed: {e}")
-        try:
-            with open(r"e:\\VisioLingua\\upload_trace.txt", "a", encoding="utf-8") as f:
-                f.write(f"UPSERT error: {e}\n")
-        except Exception:
-            pass
+        log_event(logger, "upload.upsert_failed", logging.WARNING, content_id=content_id, error=str(e))
 
     return {"id": content_id, "message": "Content uploaded successfully", "vector_stored": success}
@@ -0,0 +1,206 @@
+"""
+Admission control for expensive endpoints.
+
+Each endpoint gets a controller with a concurrency limit and a bounded wait queue.
+Waiting requests are admitted round-robin across users rather than first come first
+served, and while others wait a user holds at most ADMISSION_USER_SHARE of an
+endpoint's slots. A bulk uploader can use idle capacity, but once someone else queues
+its own requests wait behind theirs.
+Requests are rejected immediately instead of piling up:
+
+- 429 when the user already has ADMISSION_USER_QUEUE requests waiting
+- 503 when the endpoint queue is full, or a request waited ADMISSION_MAX_WAIT seconds
+  (or until its deadline, see services/deadline.py)
+
+Both carry `Retry-After`, estimated from recent service times. Limits are set per
+endpoint with ADMISSION_<ENDPOINT>_CONCURRENCY / ADMISSION_<ENDPOINT>_QUEUE, e.g.
+ADMISSION_QUERY_CONCURRENCY=8.
+"""
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+import asyncio
+import math
+import os
+import time
+
+from fastapi import HTTPException
+
+from services.deadline import remaining
+from services.metrics import counter, gauge, histogram
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+# Share of an endpoint's concurrency one user may hold
+ADMISSION_USER_SHARE = float(os.getenv("ADMISSION_USER_SHARE", "0.5"))
+# Requests one user may have waiting per endpoint
+ADMISSION_USER_QUEUE = int(os.getenv("ADMISSION_USER_QUEUE", "4"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "10"))
+
+# endpoint -> (concurrency, queue) defaults
+DEFAULT_LIMITS = {
+    "upload": (4, 16),
+    "query": (8, 32),
+    "query_batch": (2, 8),
+    "query_image": (4, 16),
+    "generate_story": (4, 16),
+}
+
+IN_FLIGHT = gauge("visiolingua_admission_in_flight", "Requests admitted and running", ("endpoint",))
+QUEUE_DEPTH = gauge("visiolingua_admission_queue_depth", "Requests waiting for admission", ("endpoint",))
+REJECTED = counter("visiolingua_admission_rejected_total", "Requests rejected by admission control",
+                   ("endpoint", "reason"))
+WAIT_SECONDS = histogram("visiolingua_admission_wait_seconds", "Time admitted requests waited", ("endpoint",))
+
+
+class AdmissionController:
+    """Bounded concurrency plus a bounded, per-user fair wait queue for one endpoint."""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int,
+                 user_share: float = ADMISSION_USER_SHARE, user_queue: int = ADMISSION_USER_QUEUE,
+                 max_wait: float = ADMISSION_MAX_WAIT):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.user_limit = max(1, math.ceil(self.concurrency * user_share))
+        self.user_queue = user_queue
+        self.max_wait = max_wait
+        self._active = 0
+        self._active_by_user: Dict[str, int] = {}
+        # user -> waiting futures; iteration order is the round-robin order
+        self._waiting: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._queued = 0
+        # Exponentially weighted mean service time, for Retry-After
+        self._service_seconds = 1.0
+
+    def _reject(self, status: int, reason: str, detail: str):
+        REJECTED.inc(endpoint=self.name, reason=reason)
+        # Time for the requests ahead to drain through the available slots
+        retry_after = max(1, math.ceil(self._service_seconds * (self._queued + 1) / self.concurrency))
+        raise HTTPException(status_code=status, detail=detail, headers={"Retry-After": str(retry_after)})
+
+    def _can_run(self, user: str, strict: bool = True) -> bool:
+        if self._active >= self.concurrency:
+            return False
+        # Past its share a user only gets slots nobody else is waiting for
+        return not strict or self._active_by_user.get(user, 0) < self.user_limit
+
+    def _start(self, user: str):
+        self._active += 1
+        self._active_by_user[user] = self._active_by_user.get(user, 0) + 1
+        IN_FLIGHT.set(self._active, endpoint=self.name)
+
+    def _dispatch(self):
+        """
+        Admit waiting requests round-robin over users while slots are free: first users
+        below their share, then (only if slots are still free) anyone waiting.
+        """
+        self._dispatch_pass(strict=True)
+        self._dispatch_pass(strict=False)
+        QUEUE_DEPTH.set(self._queued, endpoint=self.name)
+
+    def _dispatch_pass(self, strict: bool):
+        progressed = True
+        while progressed and self._active < self.concurrency and self._waiting:
+            progressed = False
+            for user in list(self._waiting):
+                waiters = self._waiting[user]
+                while waiters and waiters[0].done():
+                    waiters.popleft()  # timed out or cancelled
+                if not waiters:
+                    del self._waiting[user]
+                    continue
+                if not self._can_run(user, strict):
+                    continue
+                fut = waiters.popleft()
+                self._queued -= 1
+                # Move the user to the back so the next slot goes to someone else
+                self._waiting.move_to_end(user)
+                if not waiters:
+                    del self._waiting[user]
+                self._start(user)
+                fut.set_result(None)
+                progressed = True
+                if self._active >= self.concurrency:
+                    break
+
+    async def acquire(self, user: str):
+        waiting = len(self._waiting.get(user, ()))
+        if not self._queued and self._can_run(user, strict=False):
+            self._start(user)
+            WAIT_SECONDS.observe(0.0, endpoint=self.name)
+            return
+        if waiting >= self.user_queue:
+            self._reject(429, "user_quota", "Too many requests in progress for this user")
+        if self._queued >= self.queue_size:
+            self._reject(503, "queue_full", "Server is busy, retry later")
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user, deque()).append(fut)
+        self._queued += 1
+        QUEUE_DEPTH.set(self._queued, endpoint=self.name)
+        start = time.perf_counter()
+        # A slot may already be free for this user (others were only blocked by their share)
+        self._dispatch()
+        # Waiting past the request deadline would only produce a late response
+        left = remaining()
+        max_wait = self.max_wait if left is None else max(0.0, min(self.max_wait, left))
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # Admitted just as the wait ended; give the slot back
+                self.release(user)
+            else:
+                fut.cancel()
+                waiters = self._waiting.get(user)
+                if waiters is not None:
+                    waiters.remove(fut)
+                    if not waiters:
+                        del self._waiting[user]
+                self._queued -= 1
+                QUEUE_DEPTH.set(self._queued, endpoint=self.name)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject(503, "timeout", "Server is busy, retry later")
+        WAIT_SECONDS.observe(time.perf_counter() - start, endpoint=self.name)
+
+    def release(self, user: str, service_seconds: Optional[float] = None):
+        self._active -= 1
+        left = self._active_by_user.get(user, 1) - 1
+        if left > 0:
+            self._active_by_user[user] = left
+        else:
+            self._active_by_user.pop(user, None)
+        if service_seconds is not None:
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * service_seconds
+        IN_FLIGHT.set(self._active, endpoint=self.name)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user: str):
+        await self.acquire(user)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(user, time.perf_counter() - start)
+
+
+def _limit(endpoint: str, kind: str, default: int) -> int:
+    return int(os.getenv(f"ADMISSION_{endpoint.upper()}_{kind}", str(default)))
+
+
+_controllers: Dict[str, AdmissionController] = {
+    name: AdmissionController(name, _limit(name, "CONCURRENCY", c), _limit(name, "QUEUE", q))
+    for name, (c, q) in DEFAULT_LIMITS.items()
+}
+
+
+@asynccontextmanager
+async def admit(endpoint: str, user_id: str):
+    """Hold one of `endpoint`'s slots for `user_id`; raises HTTPException 429/503 when full."""
+    if not ADMISSION_ENABLED:
+        yield
+        return
+    async with _controllers[endpoint].slot(user_id or "anonymous"):
+        yield
@@ -0,0 +1,110 @@
+"""
+Response mode for /query: generate an answer with the LLM, or return the ranked
+results with extractive snippets and make no LLM call.
+
+"generate" and "retrieve" are used as requested. "auto" retrieves when the query reads
+like a lookup ("show me my beach photos", "fotos de la playa") or is a few keywords,
+and the best result scores at least QUERY_RETRIEVE_MIN_SCORE; questions ("why…",
+"how…", "…?") and low-confidence matches are still answered by the LLM. Confidence is
+the raw dense cosine of the best result, never a fused or BM25-blended score. A query
+with no results never reaches the LLM.
+
+In retrieve mode every result carries a `snippet`: the caption for images, the
+sentences around the best query matches for text. The top snippet is the generation.
+"""
+from typing import Dict, List, Tuple
+import os
+import re
+
+from services.context_builder import query_weights, trim_passage
+from services.hybrid_search import simple_tokenize
+from services.metrics import counter
+
+QUERY_MODES = ("auto", "generate", "retrieve")
+QUERY_MODE = os.getenv("QUERY_MODE", "generate")
+if QUERY_MODE not in QUERY_MODES:
+    print(f"⚠️ Unknown QUERY_MODE '{QUERY_MODE}'; using 'generate'")
+    QUERY_MODE = "generate"
+# Best result cosine (dense similarity) needed to skip generation in auto mode
+QUERY_RETRIEVE_MIN_SCORE = float(os.getenv("QUERY_RETRIEVE_MIN_SCORE", "0.8"))
+# Queries of at most this many words without question words count as keyword lookups
+QUERY_RETRIEVE_MAX_WORDS = int(os.getenv("QUERY_RETRIEVE_MAX_WORDS", "4"))
+SNIPPET_TOKENS = int(os.getenv("SNIPPET_TOKENS", "60"))
+
+NO_RESULTS = "No matching content found for your query. Try a different search term."
+
+QUERY_MODE_TOTAL = counter("visiolingua_query_mode_total", "Query responses by mode and the reason it was chosen",
+                           ("mode", "reason"))
+
+# Requests for items rather than an answer, in the languages the UI offers
+_LOOKUP_RE = re.compile(
+    r"^\s*(show|find|list|search|get|display|open|give me)\b"
+    r"|\b(photos?|pictures?|images?|pics|screenshots?|documents?|docs|files|notes|videos?)\s+(of|from|with|about)\b"
+    r"|\b(my|all)\s+(\w+\s+){0,2}(photos?|pictures?|images?|pics|screenshots?|documents?|docs|files|notes|videos?)\b"
+    r"|^\s*(montre|affiche|trouve|cherche|liste)"
+    r"|\b(photos?|images?|documents?|fichiers|vid[ée]os?)\s+(de|du|des|d')"
+    r"|^\s*(mu[ée]strame|muestra|busca|encuentra|lista)"
+    r"|\b(fotos?|im[áa]genes|documentos|archivos|v[íi]deos?)\s+(de|del)\b"
+    r"|^\s*(zeig|finde|such|liste)"
+    r"|\b(fotos?|bilder|dokumente|dateien|videos?)\s+(von|vom|mit)\b"
+    r"|^\s*(显示|找|查找|搜索|列出|给我看)|(照片|图片|文档|视频)",
+    re.IGNORECASE,
+)
+# Questions that want an explanation or synthesis
+_QUESTION_RE = re.compile(
+    r"^\s*(why|how|what|who|when|which|explain|describe|summari[sz]e|compare|tell me|is|are|does|do|can|should)\b"
+    r"|^\s*(pourquoi|comment|qu['e]|quel|quelle|explique|d[ée]cris|r[ée]sume|est-ce)"
+    r"|^\s*(por\s*qu[ée]|c[óo]mo|qu[ée]|qui[ée]n|cu[áa]l|explica|describe|resume)\b"
+    r"|^\s*(warum|wie|was|wer|wann|welche|erkl[äa]re|beschreibe|fasse)\b"
+    r"|(为什么|怎么|如何|什么|解释|总结|描述|吗)"
+    r"|[?？]\s*$",
+    re.IGNORECASE,
+)
+
+
+def query_intent(query: str) -> str:
+    """Classify a query as question, lookup, keywords (a short query, neither) or unknown."""
+    if _QUESTION_RE.search(query or ""):
+        return "question"
+    if _LOOKUP_RE.search(query or ""):
+        return "lookup"
+    if 0 < len(simple_tokenize(query or "")) <= QUERY_RETRIEVE_MAX_WORDS:
+        return "keywords"
+    return "unknown"
+
+
+def choose_mode(requested: str, query: str, results: List[Dict]) -> Tuple[str, str]:
+    """(mode, reason): "generate" or "retrieve", and why."""
+    if requested in ("generate", "retrieve"):
+        mode, reason = requested, "requested"
+    elif not results:
+        mode, reason = "retrieve", "no_results"
+    else:
+        intent = query_intent(query)
+        top = max(float(r.get("cosine") or 0.0) for r in results)
+        if intent in ("lookup", "keywords") and top >= QUERY_RETRIEVE_MIN_SCORE:
+            mode, reason = "retrieve", intent
+        elif intent in ("lookup", "keywords"):
+            mode, reason = "generate", "low_confidence"
+        else:
+            mode, reason = "generate", intent
+    QUERY_MODE_TOTAL.inc(mode=mode, reason=reason)
+    return mode, reason
+
+
+def add_snippets(query: str, results: List[Dict]) -> str:
+    """
+    Set `snippet` on each result (caption for images, best-matching sentences for
+    text) and return the text to use as the generation.
+    """
+    if not results:
+        return NO_RESULTS
+    weights = query_weights(query, [r.get("content") or "" for r in results])
+    for r in results:
+        content = r.get("content") or ""
+        if r.get("type") == "image" or not content:
+            r["snippet"] = content
+        else:
+            r["snippet"] = trim_passage(content, weights, SNIPPET_TOKENS)
+    top = results[0]["snippet"]
+    return top or f"Found {len(results)} item(s) matching your query."
@@ -0,0 +1,129 @@
+"""
+Streaming text normalization and token-aware chunking for long documents.
+
+`TextNormalizer` collapses whitespace in one linear pass over text that arrives in
+pieces, so words split across read boundaries stay intact. `TextChunker` cuts the
+normalized stream into chunks of at most CHUNK_TOKENS tokens that overlap by
+CHUNK_OVERLAP_TOKENS, cutting on word boundaries. Token positions come from an
+`offsets_fn(text) -> [(start, end), ...]`, normally the embedding model's tokenizer,
+so chunks fit the model's window instead of being silently truncated. Only a small
+window of text is buffered at any time.
+"""
+from typing import Callable, Iterator, List, Optional, Tuple
+import codecs
+import os
+import re
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+# Upper bound on characters per token used to size the tokenized window
+MAX_CHARS_PER_TOKEN = 16
+
+OffsetsFn = Callable[[str], List[Tuple[int, int]]]
+
+_WORD_RE = re.compile(r"\S+")
+
+
+def normalize_text(text: str) -> str:
+    """Collapse every whitespace run (newlines included) to one space and strip."""
+    return " ".join((text or "").split())
+
+
+def word_offsets(text: str) -> List[Tuple[int, int]]:
+    """Whitespace tokenization; the fallback when no model tokenizer is available."""
+    return [m.span() for m in _WORD_RE.finditer(text)]
+
+
+class TextNormalizer:
+    """Incremental normalize_text over decoded pieces of one document."""
+
+    def __init__(self):
+        self._emitted = False
+        self._pending_space = False
+
+    def feed(self, piece: str) -> str:
+        words = piece.split()
+        if not words:
+            self._pending_space = self._pending_space or bool(piece)
+            return ""
+        space = self._emitted and (self._pending_space or piece[0].isspace())
+        self._emitted = True
+        self._pending_space = piece[-1].isspace()
+        return (" " if space else "") + " ".join(words)
+
+
+class Utf8StreamDecoder:
+    """Decode byte pieces without breaking multi-byte characters at piece boundaries."""
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+
+    def feed(self, data: bytes) -> str:
+        return self._decoder.decode(data)
+
+    def finish(self) -> str:
+        return self._decoder.decode(b"", final=True)
+
+
+class TextChunker:
+    """Turn a stream of normalized text into overlapping token-bounded chunks."""
+
+    def __init__(self, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                 offsets_fn: Optional[OffsetsFn] = None):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.offsets_fn = offsets_fn or word_offsets
+        self._window = max_tokens * MAX_CHARS_PER_TOKEN
+        self._buf = ""
+
+    def feed(self, text: str) -> Iterator[str]:
+        self._buf += text
+        # Keep at least one full window buffered so every cut sees max_tokens tokens
+        while len(self._buf) >= 2 * self._window:
+            yield self._cut()
+
+    def finish(self) -> Iterator[str]:
+        while self._buf.strip():
+            offsets = self.offsets_fn(self._buf[: self._window])
+            if len(offsets) <= self.max_tokens and len(self._buf) <= self._window:
+                chunk, self._buf = self._buf.strip(), ""
+                yield chunk
+                return
+            yield self._cut()
+
+    def _cut(self) -> str:
+        buf = self._buf
+        window = buf[: self._window]
+        offsets = self.offsets_fn(window)
+        if len(offsets) > self.max_tokens:
+            end = offsets[self.max_tokens - 1][1]
+            next_start = offsets[self.max_tokens - self.overlap_tokens][0]
+        else:
+            # Fewer tokens than expected in a full window (very long tokens): cut by size
+            end = len(window)
+            next_start = max(1, end - (end * self.overlap_tokens) // self.max_tokens)
+
+        # Never split a word: end at the last space before the cut, resume at a word start
+        if end < len(buf) and not buf[end].isspace():
+            space = buf.rfind(" ", 0, end)
+            if space > 0:
+                end = space
+        space = buf.rfind(" ", 0, next_start)
+        if space >= 0:
+            next_start = space + 1
+        if next_start >= end or next_start <= 0:
+            next_start = end  # degenerate overlap; still make progress
+        chunk = buf[:end].strip()
+        self._buf = buf[next_start:].lstrip()
+        return chunk
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+               offsets_fn: Optional[OffsetsFn] = None) -> List[str]:
+    """Chunk an in-memory string."""
+    chunker = TextChunker(max_tokens, overlap_tokens, offsets_fn)
+    chunks = list(chunker.feed(normalize_text(text)))
+    chunks.extend(chunker.finish())
+    return chunks
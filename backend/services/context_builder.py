@@ -0,0 +1,152 @@
+"""
+Token-budgeted context assembly for RAG generation.
+
+`build_context` packs retrieved passages into at most CONTEXT_TOKEN_BUDGET tokens:
+highest score first, near-duplicates dropped, and every passage longer than
+CONTEXT_PASSAGE_MAX_TOKENS trimmed to the sentences around the ones that best match
+the query. Tokens are estimated from characters (Gemini's tokenizer is not available
+locally), which is conservative for Latin scripts, so prompt size stays bounded.
+"""
+from typing import Dict, List, Optional, Tuple
+import math
+import os
+import re
+
+from services.hybrid_search import simple_tokenize
+from services.metrics import histogram
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_PASSAGE_MAX_TOKENS = int(os.getenv("CONTEXT_PASSAGE_MAX_TOKENS", "400"))
+CHARS_PER_TOKEN = 4
+# Passages sharing this much of their vocabulary with an earlier one are dropped
+DUPLICATE_JACCARD = 0.9
+# Don't bother adding a passage trimmed below this many tokens
+MIN_PASSAGE_TOKENS = 24
+ELLIPSIS = "…"
+
+CONTEXT_TOKENS = histogram(
+    "visiolingua_llm_context_tokens", "Estimated tokens of retrieved context sent to the LLM",
+    buckets=(64, 128, 256, 512, 1024, 1536, 2048, 4096, 8192))
+
+_SENTENCE_RE = re.compile(r"[^.!?。！？\n]+(?:[.!?。！？]+|\n|$)")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_RE.findall(text or "") if s.strip()]
+
+
+def _idf(query_terms: set, passages: List[str]) -> Dict[str, float]:
+    docs = [set(simple_tokenize(p)) for p in passages]
+    n = len(docs) or 1
+    return {t: math.log(1 + n / (1 + sum(t in d for d in docs))) + 1.0 for t in query_terms}
+
+
+def query_weights(query: str, passages: List[str]) -> Dict[str, float]:
+    """IDF weight of each query term over `passages`, for trim_passage."""
+    return _idf(set(simple_tokenize(query)), passages)
+
+
+def _sentence_score(sentence: str, weights: Dict[str, float]) -> float:
+    tokens = simple_tokenize(sentence)
+    if not tokens:
+        return 0.0
+    matched = sum(weights.get(t, 0.0) for t in set(tokens))
+    # Favour dense matches over long sentences that mention a term once
+    return matched / math.sqrt(len(tokens))
+
+
+def trim_passage(text: str, weights: Dict[str, float], max_tokens: int) -> str:
+    """
+    Keep the best-matching sentence and grow the window around it (then around the next
+    best) until `max_tokens` is reached. Kept spans stay in document order; gaps are
+    marked with an ellipsis.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    sentences = split_sentences(text)
+    if not sentences:
+        return text[: max_tokens * CHARS_PER_TOKEN]
+    sizes = [estimate_tokens(s) + 1 for s in sentences]
+    ranked = sorted(range(len(sentences)), key=lambda i: _sentence_score(sentences[i], weights), reverse=True)
+
+    keep = set()
+    used = 0
+    for center in ranked:
+        if center in keep:
+            continue
+        # Grow outward from the sentence: center, next, previous, next+1, ...
+        for offset in (0, 1, -1, 2, -2):
+            i = center + offset
+            if 0 <= i < len(sentences) and i not in keep and used + sizes[i] <= max_tokens:
+                keep.add(i)
+                used += sizes[i]
+        if used >= max_tokens - MIN_PASSAGE_TOKENS:
+            break
+    if not keep:
+        # A single sentence longer than the budget: cut it
+        return sentences[ranked[0]][: max_tokens * CHARS_PER_TOKEN]
+
+    parts, prev = [], None
+    for i in sorted(keep):
+        if prev is not None and i != prev + 1:
+            parts.append(ELLIPSIS)
+        parts.append(sentences[i])
+        prev = i
+    out = " ".join(parts)
+    if min(keep) > 0:
+        out = ELLIPSIS + " " + out
+    if max(keep) < len(sentences) - 1:
+        out += " " + ELLIPSIS
+    # Gap markers can push a full window just over the limit
+    return out[: max_tokens * CHARS_PER_TOKEN]
+
+
+def _is_duplicate(tokens: set, seen: List[set]) -> bool:
+    for other in seen:
+        union = tokens | other
+        if union and len(tokens & other) / len(union) >= DUPLICATE_JACCARD:
+            return True
+    return False
+
+
+def build_context(query: str, passages: List[Dict], budget: Optional[int] = None,
+                  passage_max_tokens: Optional[int] = None) -> Dict:
+    """
+    Pack `passages` (dicts with `content` and optional `score`/`id`) for `query`.
+    Returns {"text", "tokens", "ids", "dropped"}; `dropped` counts duplicates and
+    passages that did not fit.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    passage_max_tokens = passage_max_tokens or CONTEXT_PASSAGE_MAX_TOKENS
+    candidates: List[Tuple[float, Dict]] = [
+        (float(p.get("score") or 0.0), p) for p in passages if (p.get("content") or "").strip()
+    ]
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    weights = query_weights(query, [p["content"] for _, p in candidates])
+
+    chosen, ids, seen = [], [], []
+    used, dropped = 0, 0
+    for _, p in candidates:
+        tokens = set(simple_tokenize(p["content"]))
+        if _is_duplicate(tokens, seen):
+            dropped += 1
+            continue
+        remaining = budget - used
+        if remaining < MIN_PASSAGE_TOKENS:
+            dropped += 1
+            continue
+        text = trim_passage(p["content"], weights, min(passage_max_tokens, remaining))
+        cost = estimate_tokens(text) + 1
+        if cost > remaining:
+            dropped += 1
+            continue
+        chosen.append(text)
+        ids.append(p.get("id"))
+        seen.append(tokens)
+        used += cost
+    CONTEXT_TOKENS.observe(used)
+    return {"text": "\n".join(chosen), "tokens": used, "ids": ids, "dropped": dropped}
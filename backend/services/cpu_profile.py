@@ -0,0 +1,308 @@
+"""
+CPU execution profile for model inference.
+
+Three settings decide how inference uses the host's cores:
+- intra-op threads: how many cores one operator (a matmul) is split across
+- inter-op threads: independent operators run side by side (little used by eager encoders)
+- inference workers: how many model calls this process runs at once; the rest wait
+
+Each comes from its environment variable, else from the file the calibration command
+writes (CPU_PROFILE_PATH), else from the cores available to this process: the CPU
+affinity mask and cgroup quota, split between the uvicorn workers on the host
+(WEB_CONCURRENCY). Whatever the source, workers and intra-op threads are capped so that
+threads x inference workers x processes fits the cores, so several workers sharing a host do not
+oversubscribe it. On Windows the default stays at one thread per call to keep memory
+use down.
+
+    python -m services.cpu_profile                        # show the resolved profile
+    python -m services.cpu_profile --calibrate latency    # benchmark CLIP and E5, write the best
+    python -m services.cpu_profile --calibrate throughput
+"""
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import threading
+import time
+
+from services.metrics import gauge, histogram
+
+CPU_PROFILE_PATH = os.getenv("CPU_PROFILE_PATH", "cpu_profile.json")
+# Uvicorn reads its worker count from WEB_CONCURRENCY; set it when running several
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1") or 1)
+CALIBRATION_TARGETS = ("latency", "throughput")
+CALIBRATION_MODELS = ("e5", "clip_text", "clip_image")
+# Texts embedded per call when calibrating for throughput (uploads embed in batches)
+CALIBRATION_BATCH = 16
+
+SETTINGS = {
+    "intra_op_threads": "TORCH_INTRA_OP_THREADS",
+    "inter_op_threads": "TORCH_INTER_OP_THREADS",
+    "inference_workers": "INFERENCE_WORKERS",
+}
+
+INFERENCE_THREADS = gauge("visiolingua_inference_threads", "CPU inference settings in effect", ("setting",))
+INFERENCE_WAIT = histogram("visiolingua_inference_wait_seconds", "Time model calls waited for an inference worker",
+                           buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+_slots = threading.BoundedSemaphore(1)
+
+
+def available_cores() -> int:
+    """Cores this process may use: the affinity mask, capped by a cgroup v2 CPU quota."""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            cores = min(cores, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cores)
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name, "").strip()
+    try:
+        return int(value) if value and int(value) > 0 else None
+    except ValueError:
+        print(f"⚠️ Ignoring {name}={value!r}: not a positive integer")
+        return None
+
+
+def _load_file(path: str) -> Dict[str, Any]:
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️ Could not read CPU profile {path}: {e}")
+        return {}
+
+
+def resolve_profile(path: str = CPU_PROFILE_PATH, processes: int = WEB_CONCURRENCY) -> Dict[str, Any]:
+    """The settings to run with and where each came from (env, file or auto)."""
+    cores = available_cores()
+    processes = max(1, processes)
+    per_process = max(1, cores // processes)
+    calibrated = _load_file(path)
+    windows = platform.system() == "Windows"
+    auto = {
+        "inference_workers": per_process if windows else min(2, per_process),
+        "inter_op_threads": 1,
+    }
+
+    profile: Dict[str, Any] = {"cores": cores, "processes": processes, "sources": {}}
+    for key in ("inference_workers", "inter_op_threads", "intra_op_threads"):
+        value, source = _env_int(SETTINGS[key]), "env"
+        if value is None and isinstance(calibrated.get(key), int) and calibrated[key] > 0:
+            value, source = calibrated[key], "file"
+        if value is None:
+            if key == "intra_op_threads":
+                value = 1 if windows else max(1, per_process // profile["inference_workers"])
+            else:
+                value = auto[key]
+            source = "auto"
+        profile[key] = value
+        profile["sources"][key] = source
+
+    # Oversubscription guard: every busy worker spins its own intra-op threads
+    if profile["inference_workers"] > per_process:
+        print(f"⚠️ {profile['inference_workers']} inference workers x {processes} processes exceeds "
+              f"{cores} cores; using {per_process} workers")
+        profile["inference_workers"] = per_process
+        profile["sources"]["inference_workers"] += "+capped"
+    fit = max(1, per_process // profile["inference_workers"])
+    if profile["intra_op_threads"] > fit:
+        print(f"⚠️ {profile['intra_op_threads']} intra-op threads x {profile['inference_workers']} inference "
+              f"workers x {processes} processes exceeds {cores} cores; using {fit} threads")
+        profile["intra_op_threads"] = fit
+        profile["sources"]["intra_op_threads"] += "+capped"
+    if profile["inter_op_threads"] > per_process:
+        profile["inter_op_threads"] = per_process
+        profile["sources"]["inter_op_threads"] += "+capped"
+    return profile
+
+
+def set_inference_workers(workers: int) -> None:
+    global _slots
+    _slots = threading.BoundedSemaphore(max(1, workers))
+    INFERENCE_THREADS.set(max(1, workers), setting="inference_workers")
+
+
+def apply_profile(profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Configure torch and the inference workers; call before the first model call."""
+    import torch
+
+    profile = profile or resolve_profile()
+    torch.set_num_threads(profile["intra_op_threads"])
+    try:
+        torch.set_num_interop_threads(profile["inter_op_threads"])
+    except RuntimeError:
+        # Only settable once per process, before any inter-op work has run
+        pass
+    set_inference_workers(profile["inference_workers"])
+    INFERENCE_THREADS.set(profile["intra_op_threads"], setting="intra_op_threads")
+    INFERENCE_THREADS.set(torch.get_num_interop_threads(), setting="inter_op_threads")
+    print(f"CPU inference profile: {profile['intra_op_threads']} intra-op / {profile['inter_op_threads']} "
+          f"inter-op threads, {profile['inference_workers']} workers ({profile['cores']} cores, "
+          f"{profile['processes']} processes)")
+    return profile
+
+
+@contextmanager
+def inference_slot():
+    """Hold one of the process's inference workers for a model call."""
+    slots = _slots
+    start = time.perf_counter()
+    slots.acquire()
+    INFERENCE_WAIT.observe(time.perf_counter() - start)
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+# Calibration
+
+def _workloads(batch: int) -> Dict[str, Callable[[], bool]]:
+    """One model call per workload; each returns False if the model failed."""
+    import numpy as np
+    from PIL import Image
+    from services.embeddings import clip_image_embeddings, clip_text_embeddings, multilingual_text_embeddings
+
+    rng = np.random.default_rng(0)
+    texts = [f"query: a photo of {n} cats sleeping on a sofa near the window, number {i}"
+             for i, n in zip(range(batch), rng.integers(1, 9, size=batch))]
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 255, size=(224, 224, 3), dtype=np.uint8)).save(buf, format="JPEG")
+    images = [buf.getvalue()] * batch
+    return {
+        "e5": lambda: bool(multilingual_text_embeddings(texts, batch_size=batch)),
+        "clip_text": lambda: all(v is not None for v in clip_text_embeddings(texts)),
+        "clip_image": lambda: all(v is not None for v in clip_image_embeddings(images)),
+    }
+
+
+def _candidates(per_process: int) -> List[Dict[str, int]]:
+    counts = sorted({2 ** i for i in range(per_process.bit_length())}
+                    | {d for d in range(1, per_process + 1) if per_process % d == 0})
+    return [{"inference_workers": w, "intra_op_threads": t}
+            for w in counts for t in counts if w * t <= per_process]
+
+
+def _run_config(call: Callable[[], bool], workers: int, threads: int, calls: int) -> Optional[Dict[str, float]]:
+    """Run `calls` calls on each of `workers` concurrent threads; per-call latencies in ms."""
+    import torch
+
+    torch.set_num_threads(threads)
+    set_inference_workers(workers)
+    if not call():
+        return None
+    samples: List[float] = []
+    lock = threading.Lock()
+
+    def worker():
+        torch.set_num_threads(threads)
+        for _ in range(calls):
+            start = time.perf_counter()
+            call()
+            with lock:
+                samples.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(ordered), 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))], 2),
+        "calls_per_s": round(len(ordered) / elapsed, 2),
+    }
+
+
+def calibrate(target: str, calls: int = 8, models=CALIBRATION_MODELS,
+              processes: int = WEB_CONCURRENCY, progress=print) -> Dict[str, Any]:
+    """
+    Benchmark every (inference workers, intra-op threads) split of this process's share
+    of the cores and return the best for `target`: "latency" picks the lowest p95 call
+    latency with one text or image per call, "throughput" the most items per second
+    with CALIBRATION_BATCH per call. Scores are summed over `models`.
+    """
+    import torch
+
+    if target not in CALIBRATION_TARGETS:
+        raise ValueError(f"Unknown target '{target}'; choose one of {CALIBRATION_TARGETS}")
+    cores = available_cores()
+    per_process = max(1, cores // max(1, processes))
+    batch = 1 if target == "latency" else CALIBRATION_BATCH
+    workloads = {name: fn for name, fn in _workloads(batch).items() if name in models}
+
+    results = []
+    for config in _candidates(per_process):
+        row: Dict[str, Any] = dict(config, models={})
+        for name, call in workloads.items():
+            measured = _run_config(call, config["inference_workers"], config["intra_op_threads"], calls)
+            if measured is None:
+                raise RuntimeError(f"{name} failed to run; check that the model can be loaded")
+            row["models"][name] = measured
+        if target == "latency":
+            row["score"] = round(sum(m["p95_ms"] for m in row["models"].values()), 2)
+        else:
+            # Milliseconds per item, summed over models: lower is better either way
+            row["score"] = round(sum(1000 / (m["calls_per_s"] * batch) for m in row["models"].values()), 3)
+        results.append(row)
+        progress(f"workers={config['inference_workers']:<3} threads={config['intra_op_threads']:<3} "
+                 f"score={row['score']}")
+
+    best = min(results, key=lambda r: r["score"])
+    return {
+        "target": target,
+        "intra_op_threads": best["intra_op_threads"],
+        "inter_op_threads": 1,
+        "inference_workers": best["inference_workers"],
+        "cores": cores,
+        "processes": processes,
+        "batch": batch,
+        "torch": torch.__version__,
+        "calibrated_at": datetime.now(timezone.utc).isoformat(),
+        "results": results,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--calibrate", choices=CALIBRATION_TARGETS, help="Benchmark and write the best profile")
+    ap.add_argument("--calls", type=int, default=8, help="Calls per worker thread and configuration")
+    ap.add_argument("--models", nargs="+", choices=CALIBRATION_MODELS, default=list(CALIBRATION_MODELS))
+    ap.add_argument("--processes", type=int, default=WEB_CONCURRENCY,
+                    help="Uvicorn workers that will share this host (default: WEB_CONCURRENCY)")
+    ap.add_argument("--output", default=CPU_PROFILE_PATH)
+    args = ap.parse_args(argv)
+
+    if not args.calibrate:
+        print(json.dumps(resolve_profile(args.output, args.processes), indent=2))
+        return
+    profile = calibrate(args.calibrate, args.calls, args.models, args.processes)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    print(f"Best for {args.calibrate}: {profile['inference_workers']} workers x "
+          f"{profile['intra_op_threads']} intra-op threads; written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Request deadlines, a circuit breaker and retry backoff for storage calls.
+
+The HTTP middleware gives every request a budget of REQUEST_SLO_SECONDS. Storage
+calls made while serving it (in any thread the request hands work to) take their
+timeout from the time left, retry transient failures with jittered backoff only while
+the budget allows, and fail fast through a circuit breaker once the backend keeps
+failing. Code that falls back to partial results calls `mark_degraded`, and the
+response says so instead of hanging until the client gives up.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, TypeVar
+import os
+import random
+import threading
+import time
+
+from services.metrics import counter, gauge
+
+REQUEST_SLO_SECONDS = float(os.getenv("REQUEST_SLO_SECONDS", "10"))
+# Calls with less time left than this are not started
+MIN_CALL_SECONDS = 0.05
+RETRY_BASE_SECONDS = float(os.getenv("RETRY_BASE_SECONDS", "0.1"))
+RETRY_MAX_SECONDS = float(os.getenv("RETRY_MAX_SECONDS", "2"))
+
+CIRCUIT_STATE = gauge("visiolingua_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+                      ("backend",))
+CIRCUIT_REJECTED = counter("visiolingua_circuit_rejected_total", "Calls failed fast by an open circuit",
+                           ("backend",))
+DEADLINE_EXCEEDED = counter("visiolingua_deadline_exceeded_total", "Calls not made or cut short by the deadline",
+                            ("backend",))
+DEGRADED_RESPONSES = counter("visiolingua_degraded_responses_total", "Responses served with partial results",
+                             ("reason",))
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's budget ran out before the call could be made."""
+
+
+class CircuitOpen(RuntimeError):
+    """The backend failed too often recently; calls fail fast until it recovers."""
+
+
+# Per-request state; a dict so threads the request hands work to share it
+_budget: ContextVar[Optional[Dict]] = ContextVar("request_budget", default=None)
+
+
+def start_request_budget(seconds: Optional[float] = REQUEST_SLO_SECONDS) -> Dict:
+    """Begin the current request's budget (None or <= 0 for no deadline)."""
+    budget = {
+        "deadline": time.monotonic() + seconds if seconds and seconds > 0 else None,
+        "degraded": [],
+    }
+    _budget.set(budget)
+    return budget
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current request's budget, or None without a deadline."""
+    budget = _budget.get()
+    if budget is None or budget["deadline"] is None:
+        return None
+    return budget["deadline"] - time.monotonic()
+
+
+def call_timeout(default: float) -> float:
+    """Timeout for one call: `default`, capped by the time left in the request."""
+    left = remaining()
+    if left is None:
+        return default
+    return max(MIN_CALL_SECONDS, min(default, left))
+
+
+@contextmanager
+def unbounded():
+    """
+    Run a block without the request's deadline. For writes: dropping an upload the
+    user already waited for is worse than finishing late. Degraded marks still count.
+    """
+    budget = _budget.get()
+    token = _budget.set({"deadline": None, "degraded": budget["degraded"] if budget else []})
+    try:
+        yield
+    finally:
+        _budget.reset(token)
+
+
+def mark_degraded(reason: str) -> None:
+    """Record that the current response is missing something because `reason` failed."""
+    budget = _budget.get()
+    if budget is not None and reason not in budget["degraded"]:
+        budget["degraded"].append(reason)
+        DEGRADED_RESPONSES.inc(reason=reason)
+
+
+def degraded_reasons() -> List[str]:
+    budget = _budget.get()
+    return list(budget["degraded"]) if budget else []
+
+
+def backoff_delay(attempt: int, base: float = RETRY_BASE_SECONDS, cap: float = RETRY_MAX_SECONDS) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Closed until `failures` consecutive failures, then open: calls fail fast with
+    CircuitOpen for `reset_seconds`. After that one probe call is let through
+    (half-open); its success closes the circuit, its failure opens it again.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name: str, failures: int = 5, reset_seconds: float = 10.0):
+        self.name = name
+        self.failures = max(1, failures)
+        self.reset_seconds = reset_seconds
+        self._state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(self._state, backend=name)
+
+    @property
+    def state(self) -> int:
+        return self._state
+
+    def _set(self, state: int):
+        self._state = state
+        CIRCUIT_STATE.set(state, backend=self.name)
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may go ahead now."""
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._set(self.HALF_OPEN)
+                self._probing = False
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            if self._state == self.CLOSED:
+                return
+        CIRCUIT_REJECTED.inc(backend=self.name)
+        raise CircuitOpen(f"{self.name} circuit open")
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._probing = False
+            if self._state != self.CLOSED:
+                print(f"{self.name} circuit closed")
+                self._set(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or (
+                    self._state == self.CLOSED and self._consecutive >= self.failures):
+                print(f"⚠️ {self.name} circuit open after {self._consecutive} consecutive failures")
+                self._set(self.OPEN)
+                self._opened_at = time.monotonic()
+
+
+def call_with_retries(fn: Callable[[], T], breaker: CircuitBreaker, retries: int,
+                      is_transient: Callable[[Exception], bool]) -> T:
+    """
+    Call `fn` through `breaker`, retrying transient errors with jittered backoff while
+    the request budget leaves time for another attempt. Other errors (the backend
+    answered, e.g. a bad request) are raised at once and do not count against it.
+    """
+    attempt = 0
+    while True:
+        left = remaining()
+        if left is not None and left < MIN_CALL_SECONDS:
+            DEADLINE_EXCEEDED.inc(backend=breaker.name)
+            raise DeadlineExceeded(f"{breaker.name} call skipped: request deadline passed")
+        breaker.allow()
+        try:
+            result = fn()
+        except Exception as e:
+            if not is_transient(e):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if attempt >= retries:
+                raise
+            delay = backoff_delay(attempt)
+            left = remaining()
+            if left is not None and left < delay + MIN_CALL_SECONDS:
+                DEADLINE_EXCEEDED.inc(backend=breaker.name)
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
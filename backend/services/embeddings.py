@@ -4,21 +4,25 @@ from sentence_transformers import SentenceTransformer
 from PIL import Image
 import io
 from functools import lru_cache
+from typing import List, Optional, Tuple
 
-CLIP_DIM = 512
+from services.cpu_profile import apply_profile, inference_slot
+from services.metrics import MODELS_LOADED, stage
+from services.model_config import CLIP_DIM, CLIP_MODEL, TEXT_MODEL
 
-# Reduce CPU thread usage to lower memory pressure on Windows
+# Torch threads and concurrent model calls per process, see services/cpu_profile.py
 try:
-    torch.set_num_threads(1)
-except Exception:
-    pass
+    apply_profile()
+except Exception as e:
+    print(f"⚠️ Could not apply CPU inference profile: {e}")
 
 @lru_cache(maxsize=1)
 def get_clip():
     try:
-        model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+        model = CLIPModel.from_pretrained(CLIP_MODEL)
+        processor = CLIPProcessor.from_pretrained(CLIP_MODEL)
         model.eval()
+        MODELS_LOADED.set(1, model="clip")
         return model, processor
     except Exception as e:
         # Defer failures to callers; they'll provide safe fallbacks
@@ -27,35 +31,92 @@ def get_clip():
 @lru_cache(maxsize=1)
 def get_multilingual_text_model():
     # Smaller multilingual encoder to avoid OOM/pagefile issues; 384-dim output
-    model = SentenceTransformer("intfloat/multilingual-e5-small", device="cpu")
+    model = SentenceTransformer(TEXT_MODEL, device="cpu")
+    MODELS_LOADED.set(1, model=TEXT_MODEL.rsplit("/", 1)[-1])
     return model
 
 @torch.no_grad()
 def clip_text_embedding(text: str):
     try:
         model, processor = get_clip()
-        inputs = processor(text=[text], images=None, return_tensors="pt", padding=True)  # type: ignore
-        outputs = model.get_text_features(**inputs)
-        emb = outputs[0].detach().cpu().numpy().tolist()
+        with inference_slot(), stage("embedding"):
+            inputs = processor(text=[text], images=None, return_tensors="pt", padding=True)  # type: ignore
+            outputs = model.get_text_features(**inputs)
+            emb = outputs[0].detach().cpu().numpy().tolist()
         return emb
     except Exception as e:
-        # Safe fallback to zeros; retrieval will rely on multilingual text vectors
-        return [0.0] * CLIP_DIM
+        # No vector rather than a zero placeholder; retrieval relies on multilingual text vectors
+        return None
+
+@torch.no_grad()
+def clip_text_embeddings(texts: List[str]) -> List[Optional[list]]:
+    """Batched clip_text_embedding; every entry is None if the batch fails."""
+    if not texts:
+        return []
+    try:
+        model, processor = get_clip()
+        with inference_slot(), stage("embedding"):
+            inputs = processor(text=list(texts), images=None, return_tensors="pt", padding=True, truncation=True)  # type: ignore
+            return model.get_text_features(**inputs).detach().cpu().numpy().tolist()
+    except Exception:
+        return [None] * len(texts)
 
 @torch.no_grad()
 def clip_image_embedding(image_bytes: bytes):
     try:
         model, processor = get_clip()
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        inputs = processor(text=None, images=image, return_tensors="pt", padding=True)  # type: ignore
-        outputs = model.get_image_features(**inputs)
-        emb = outputs[0].detach().cpu().numpy().tolist()
+        with inference_slot(), stage("embedding"):
+            image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+            inputs = processor(text=None, images=image, return_tensors="pt", padding=True)  # type: ignore
+            outputs = model.get_image_features(**inputs)
+            emb = outputs[0].detach().cpu().numpy().tolist()
         return emb
     except Exception as e:
-        # Safe fallback to zeros; retrieval will rely on caption + multilingual vectors
-        return [0.0] * CLIP_DIM
+        # No vector rather than a zero placeholder; retrieval relies on caption + multilingual vectors
+        return None
 
 def multilingual_text_embedding(text: str):
     model = get_multilingual_text_model()
-    emb = model.encode([text], normalize_embeddings=True)[0].tolist()
+    with inference_slot(), stage("embedding"):
+        emb = model.encode([text], normalize_embeddings=True)[0].tolist()
     return emb
+
+
+@torch.no_grad()
+def clip_image_embeddings(images: List[bytes]) -> List[Optional[list]]:
+    """Batched clip_image_embedding; undecodable images (or a failed batch) get None."""
+    out: List[Optional[list]] = [None] * len(images)
+    decoded, positions = [], []
+    for i, image_bytes in enumerate(images):
+        try:
+            decoded.append(Image.open(io.BytesIO(image_bytes)).convert("RGB"))
+            positions.append(i)
+        except Exception:
+            continue
+    if not decoded:
+        return out
+    try:
+        model, processor = get_clip()
+        with inference_slot(), stage("embedding"):
+            inputs = processor(text=None, images=decoded, return_tensors="pt", padding=True)  # type: ignore
+            outputs = model.get_image_features(**inputs).detach().cpu().numpy().tolist()
+        for i, emb in zip(positions, outputs):
+            out[i] = emb
+    except Exception:
+        pass
+    return out
+
+def multilingual_text_embeddings(texts: List[str], batch_size: int = 32) -> List[list]:
+    """Batched multilingual_text_embedding: one encode call for many texts."""
+    if not texts:
+        return []
+    model = get_multilingual_text_model()
+    with inference_slot(), stage("embedding"):
+        embs = model.encode(list(texts), batch_size=batch_size, normalize_embeddings=True)
+    return [e.tolist() for e in embs]
+
+def text_token_offsets(text: str) -> List[Tuple[int, int]]:
+    """Character spans of the multilingual model's tokens, used to size text chunks."""
+    tokenizer = get_multilingual_text_model().tokenizer
+    enc = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    return [tuple(span) for span in enc["offset_mapping"]]
@@ -0,0 +1,146 @@
+"""
+Streaming GDPR data export.
+
+The export scrolls a user's points one page at a time, decrypts each page on a
+worker pool and yields the serialized page before fetching the next one, so
+memory stays bounded by the page size rather than the size of the library.
+After every page a resume token is emitted; passing it back restarts the
+export right after that page.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Optional
+import base64
+import io
+import json
+import os
+import zipfile
+
+from db.vector_store import scroll_user_page, encode_cursor, decode_cursor
+from services.deadline import unbounded
+from services.encryption import decrypt_data
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "64"))
+EXPORT_DECRYPT_WORKERS = int(os.getenv("EXPORT_DECRYPT_WORKERS", "4"))
+
+_decrypt_pool = ThreadPoolExecutor(
+    max_workers=EXPORT_DECRYPT_WORKERS, thread_name_prefix="export-decrypt")
+
+
+def _decrypt_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    payload = dict(item["payload"])
+    if payload.get("content"):
+        payload["content"] = decrypt_data(payload["content"])
+    if payload.get("image_b64"):
+        payload["image_b64"] = decrypt_data(payload["image_b64"])
+    return {"id": item["id"], "payload": payload}
+
+
+def _pages(user_id: str, resume_token: Optional[str]) -> Iterator[tuple]:
+    """Yield (decrypted_items, resume_token) per page; the last token is None."""
+    offset = decode_cursor(resume_token)["offset"] if resume_token else None
+    while True:
+        # The stream outlives the request's deadline; each page is one bounded call
+        with unbounded():
+            items, next_offset = scroll_user_page(user_id, offset=offset, limit=EXPORT_PAGE_SIZE)
+        decrypted = list(_decrypt_pool.map(_decrypt_item, items))
+        token = encode_cursor({"offset": next_offset}) if next_offset is not None else None
+        yield decrypted, token
+        if next_offset is None:
+            return
+        offset = next_offset
+
+
+def validate_resume_token(resume_token: Optional[str]) -> None:
+    """Raise ValueError early so a bad token becomes a 400 instead of a broken stream."""
+    if resume_token:
+        state = decode_cursor(resume_token)
+        if "offset" not in state:
+            raise ValueError("Invalid cursor: missing offset")
+
+
+def _line(obj: Dict[str, Any]) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def stream_ndjson(user_id: str, resume_token: Optional[str] = None) -> Iterator[bytes]:
+    """
+    NDJSON export: one `point` record per line, a `cursor` record after every page
+    and a closing `end` record with the number of points written by this stream.
+    """
+    count = 0
+    yield _line({"type": "header", "user_id": user_id, "resumed": bool(resume_token)})
+    try:
+        for items, token in _pages(user_id, resume_token):
+            for item in items:
+                count += 1
+                yield _line({"type": "point", **item})
+            if token:
+                yield _line({"type": "cursor", "resume_token": token})
+    except Exception as e:
+        # Headers are already sent; report the failure in-band so clients can resume
+        print(f"Data export error for {user_id}: {e}")
+        yield _line({"type": "error", "detail": str(e)[:200]})
+        return
+    yield _line({"type": "end", "count": count})
+
+
+class _ZipSink(io.RawIOBase):
+    """Write-only buffer that zipfile writes into and the stream drains after each entry."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _image_name(point_id: str, payload: Dict[str, Any]) -> str:
+    ext = os.path.splitext(payload.get("original_name") or "")[1].lower()
+    return f"images/{point_id}{ext or '.bin'}"
+
+
+def stream_zip(user_id: str, resume_token: Optional[str] = None) -> Iterator[bytes]:
+    """
+    Zip export: `points/<id>.json` per point with images written as separate
+    `images/<id>.<ext>` entries, plus `cursors/<page>.token` after every page.
+    """
+    sink = _ZipSink()
+    count = 0
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        try:
+            for page, (items, token) in enumerate(_pages(user_id, resume_token)):
+                for item in items:
+                    payload = item["payload"]
+                    image_b64 = payload.pop("image_b64", None)
+                    if image_b64:
+                        name = _image_name(item["id"], payload)
+                        try:
+                            zf.writestr(name, base64.b64decode(image_b64), compress_type=zipfile.ZIP_STORED)
+                            payload["image_file"] = name
+                        except Exception:
+                            payload["image_b64"] = image_b64
+                    zf.writestr(f"points/{item['id']}.json", json.dumps(item, ensure_ascii=False))
+                    count += 1
+                    yield sink.drain()
+                if token:
+                    zf.writestr(f"cursors/{page:06d}.token", token)
+                    yield sink.drain()
+        except Exception as e:
+            print(f"Data export error for {user_id}: {e}")
+            zf.writestr("error.txt", str(e)[:200])
+        zf.writestr("export.json", json.dumps({"user_id": user_id, "count": count}))
+    yield sink.drain()
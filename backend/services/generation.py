@@ -4,6 +4,9 @@ from PIL import Image
 import google.generativeai as genai
 import time
 
+from services.deadline import mark_degraded, remaining
+from services.metrics import GEMINI_RATE_LIMITED, stage
+
 def configure_gemini(api_key: str):
     genai.configure(api_key=api_key)
 
@@ -15,22 +18,25 @@ def _call_with_retry(func, max_retries=3, initial_delay=1.0):
     last_error = None
     for attempt in range(max_retries):
         try:
-            return func()
+            with stage("llm"):
+                return func()
         except Exception as e:
             last_error = e
             error_str = str(e)
             # Check if it's a rate limit error (429)
             if "429" in error_str or "Resource exhausted" in error_str:
-                if attempt < max_retries - 1:
-                    # Exponential backoff
-                    delay = initial_delay * (2 ** attempt)
+                GEMINI_RATE_LIMITED.inc()
+                # Exponential backoff, unless the wait would outlast the request's deadline
+                delay = initial_delay * (2 ** attempt)
+                left = remaining()
+                if attempt < max_retries - 1 and (left is None or left > delay):
                     print(
                         f"Rate limit hit (429). Retrying in {delay:.1f}s... (attempt {attempt + 1}/{max_retries})")
                     time.sleep(delay)
                     continue
                 else:
                     print(
-                        f"Rate limit error after {max_retries} attempts: {e}")
+                        f"Rate limit error after {attempt + 1} attempts: {e}")
                     raise
             else:
                 # Not a rate limit error, raise immediately
@@ -68,6 +74,7 @@ def generate_description(content, lang: str, style: str = "descriptive", user_qu
 
     except Exception as e:
         print(f"Error generating description: {e}")
+        mark_degraded("llm")
         return (
             f"Description not available due to API limits. Please try again in a few moments."
             if "429" in str(e) or "Resource exhausted" in str(e)
@@ -98,6 +105,7 @@ def generate_story_from_image(image_bytes: bytes, lang: str, theme: Optional[str
 
     except Exception as e:
         print(f"Error generating story from image: {e}")
+        mark_degraded("llm")
         return (
             "Story generation temporarily unavailable due to API rate limits. Please try again in a few moments."
             if "429" in str(e) or "Resource exhausted" in str(e)
@@ -122,6 +130,7 @@ def generate_story_from_text(context: str, lang: str, theme: Optional[str] = Non
 
     except Exception as e:
         print(f"Error generating story from text: {e}")
+        mark_degraded("llm")
         return (
             "Story generation temporarily unavailable due to API rate limits. Please try again in a few moments."
             if "429" in str(e) or "Resource exhausted" in str(e)
@@ -2,6 +2,8 @@ from rank_bm25 import BM25Okapi
 from typing import List, Tuple
 import numpy as np
 
+from services.metrics import stage
+
 # Tokenizer for BM25
 import re
 def simple_tokenize(text: str) -> List[str]:
@@ -11,10 +13,15 @@ class HybridSearch:
     def __init__(self, corpus: List[str], vectors: np.ndarray):
         self.corpus = corpus
         self.vectors = vectors
-        self.tokenized_corpus = [simple_tokenize(doc) for doc in corpus]
-        self.bm25 = BM25Okapi(self.tokenized_corpus)
+        with stage("bm25_build"):
+            self.tokenized_corpus = [simple_tokenize(doc) for doc in corpus]
+            self.bm25 = BM25Okapi(self.tokenized_corpus)
 
     def search(self, query: str, query_vec: np.ndarray, top_k: int = 10, alpha: float = 0.5) -> List[Tuple[int, float]]:
+        with stage("hybrid_rank"):
+            return self._search(query, query_vec, top_k, alpha)
+
+    def _search(self, query: str, query_vec: np.ndarray, top_k: int, alpha: float) -> List[Tuple[int, float]]:
         # BM25 scores
         tokenized_query = simple_tokenize(query)
         bm25_scores = self.bm25.get_scores(tokenized_query)
@@ -28,9 +35,36 @@ class HybridSearch:
         top_indices = np.argsort(scores)[::-1][:top_k]
         return [(idx, scores[idx]) for idx in top_indices]
 
+    def search_batch(self, queries: List[str], query_vecs: np.ndarray, top_k: int = 10,
+                     alpha: float = 0.5) -> List[List[Tuple[int, float]]]:
+        """search() for many queries: cosine scores for all of them in one matrix product."""
+        with stage("hybrid_rank"):
+            doc_norms = np.linalg.norm(self.vectors, axis=1)
+            query_norms = np.linalg.norm(query_vecs, axis=1)
+            cos = (query_vecs @ self.vectors.T) / (np.outer(query_norms, doc_norms) + 1e-8)
+            out = []
+            for query, cos_scores in zip(queries, cos):
+                bm25_scores = self.bm25.get_scores(simple_tokenize(query))
+                scores = alpha * cos_scores + (1 - alpha) * (bm25_scores / (np.max(bm25_scores) + 1e-8))
+                top_indices = np.argsort(scores)[::-1][:top_k]
+                out.append([(idx, scores[idx]) for idx in top_indices])
+            return out
+
     from typing import Optional
     def expand_query(self, query: str, synonyms: Optional[List[str]] = None) -> str:
         # Simple query expansion: add synonyms if provided
         if synonyms:
             return query + " " + " ".join(synonyms)
         return query
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Fuse several ranked id lists with Reciprocal Rank Fusion: score(d) = sum 1 / (k + rank).
+    Only ranks are used, so scores from different vector spaces need no calibration.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
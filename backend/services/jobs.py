@@ -0,0 +1,89 @@
+"""
+In-process background jobs with progress reporting.
+
+Long-running maintenance work (GDPR deletes, backfills) runs on a small thread
+pool so the request that triggered it can return immediately. Job state lives in
+memory only, so a restart forgets finished and in-flight jobs.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+import os
+import threading
+import time
+import uuid
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+MAX_FINISHED_JOBS = 200
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="visiolingua-job")
+_jobs: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+
+ProgressFn = Callable[[int, Optional[int]], None]
+
+
+def _prune_finished():
+    finished = [j for j in _jobs.values() if j["finished_at"] is not None]
+    if len(finished) <= MAX_FINISHED_JOBS:
+        return
+    finished.sort(key=lambda j: j["finished_at"])
+    for job in finished[: len(finished) - MAX_FINISHED_JOBS]:
+        _jobs.pop(job["id"], None)
+
+
+def submit_job(kind: str, fn: Callable[[ProgressFn], Any], **meta) -> str:
+    """
+    Run `fn(progress)` in the background and return its job id.
+    `fn` reports progress by calling `progress(done, total)`; its return value
+    becomes the job result.
+    """
+    job_id = str(uuid.uuid4())
+    job = {
+        "id": job_id,
+        "kind": kind,
+        "status": "pending",
+        "progress": {"done": 0, "total": None},
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "finished_at": None,
+        **meta,
+    }
+    with _lock:
+        _prune_finished()
+        _jobs[job_id] = job
+
+    def progress(done: int, total: Optional[int] = None):
+        with _lock:
+            job["progress"] = {"done": done, "total": total}
+
+    def _run():
+        with _lock:
+            job["status"] = "running"
+        try:
+            result = fn(progress)
+            with _lock:
+                job["result"] = result
+                job["status"] = "completed"
+        except Exception as e:
+            print(f"Job {kind} {job_id} failed: {e}")
+            with _lock:
+                job["error"] = str(e)
+                job["status"] = "failed"
+        finally:
+            with _lock:
+                job["finished_at"] = time.time()
+
+    _executor.submit(_run)
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Return a snapshot of a job's state, or None if it is unknown."""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        snapshot = dict(job)
+        snapshot["progress"] = dict(job["progress"])
+        return snapshot
@@ -0,0 +1,80 @@
+"""
+Language identification for stored text.
+
+Uploads carry a client-supplied `lang` (default "en") that is often wrong. At ingest
+the text, or the generated caption, is classified with langid and the result is
+stored next to it as `detected_lang` / `lang_confidence`. The query path translates
+from `effective_lang(payload)`: the detected language when langid is confident,
+otherwise the client label. Text too short to classify is stored as "und".
+
+    python -m services.lang_detect   # classify points uploaded before detection existed
+"""
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+import os
+
+from db.vector_store import DETECTED_LANG_FIELD, LANG_CONFIDENCE_FIELD, backfill_detected_languages
+from services.encryption import decrypt_data
+from services.metrics import stage
+
+# Below this normalized probability the client-supplied lang is trusted instead
+LANGID_MIN_CONFIDENCE = float(os.getenv("LANGID_MIN_CONFIDENCE", "0.8"))
+# Optional comma-separated list restricting langid's candidate languages, e.g. "en,fr,es,de,zh"
+LANGID_LANGS = [l.strip() for l in os.getenv("LANGID_LANGS", "").split(",") if l.strip()]
+MIN_CHARS = 12
+# Enough text to classify reliably; longer inputs are cut to keep detection cheap
+SAMPLE_CHARS = 2000
+UNDETERMINED = "und"
+
+
+@lru_cache(maxsize=1)
+def _identifier():
+    from langid.langid import LanguageIdentifier, model
+    identifier = LanguageIdentifier.from_modelstring(model, norm_probs=True)
+    if LANGID_LANGS:
+        identifier.set_languages(LANGID_LANGS)
+    return identifier
+
+
+def detect_language(text: Optional[str]) -> Tuple[str, float]:
+    """(ISO 639-1 code, probability); ("und", 0.0) for short or unclassifiable text."""
+    text = (text or "").strip()
+    if len(text) < MIN_CHARS:
+        return UNDETERMINED, 0.0
+    try:
+        with stage("lang_detect"):
+            lang, prob = _identifier().classify(text[:SAMPLE_CHARS])
+        return lang, round(float(prob), 4)
+    except Exception as e:
+        print(f"Language detection failed: {e}")
+        return UNDETERMINED, 0.0
+
+
+def lang_fields(text: Optional[str]) -> Dict[str, Any]:
+    """Payload fields recording the detected language of `text`."""
+    lang, confidence = detect_language(text)
+    return {DETECTED_LANG_FIELD: lang, LANG_CONFIDENCE_FIELD: confidence}
+
+
+def effective_lang(payload: Dict[str, Any], default: str = "en") -> str:
+    """The language a point's content is actually in, as far as we can tell."""
+    detected = payload.get(DETECTED_LANG_FIELD)
+    if detected and detected != UNDETERMINED and (payload.get(LANG_CONFIDENCE_FIELD) or 0.0) >= LANGID_MIN_CONFIDENCE:
+        return detected
+    return payload.get("lang") or default
+
+
+def run_lang_backfill(progress=None) -> int:
+    """Detect and store the language of points uploaded before detection existed."""
+    def derive(payload: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return lang_fields(decrypt_data(payload["content"]))
+        except Exception as e:
+            print(f"Language backfill could not read a point: {e}")
+            return lang_fields(None)
+
+    return backfill_detected_languages(derive, progress)
+
+
+if __name__ == "__main__":
+    print(run_lang_backfill(lambda done, total: print(f"{done}/{total}", flush=True)))
@@ -0,0 +1,18 @@
+"""
+Embedding model names and vector sizes, importable without loading torch.
+
+Every point records EMBED_MODEL in its `embed_model` payload field. Changing a model
+(or its size) means re-embedding the collection; see db/migration.py.
+"""
+import os
+
+CLIP_MODEL = os.getenv("CLIP_MODEL", "openai/clip-vit-base-patch32")
+CLIP_DIM = int(os.getenv("CLIP_DIM", "512"))
+TEXT_MODEL = os.getenv("TEXT_EMBED_MODEL", "intfloat/multilingual-e5-small")
+TEXT_DIM = int(os.getenv("TEXT_EMBED_DIM", "384"))
+
+VECTOR_SIZES = {"clip": CLIP_DIM, "text": TEXT_DIM}
+
+EMBED_MODEL = f"{TEXT_MODEL}+{CLIP_MODEL}"
+# What points written before `embed_model` existed were embedded with
+LEGACY_EMBED_MODEL = "intfloat/multilingual-e5-small+openai/clip-vit-base-patch32"
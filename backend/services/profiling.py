@@ -0,0 +1,279 @@
+"""
+On-demand profiling of single requests.
+
+A request is profiled when it carries the admin token (`X-Profile-Token` header or
+`profile` query parameter equal to PROFILE_ADMIN_TOKEN) or is picked by
+PROFILE_SAMPLE_RATE. While it runs, a background thread samples Python stacks every
+PROFILE_INTERVAL_MS and tracemalloc records allocations. Three artifacts are written
+to PROFILE_DIR under the profile id:
+
+- `<id>.speedscope.json`: sampled CPU profile, open at https://www.speedscope.app
+- `<id>.collapsed.txt`: folded stacks for flamegraph.pl / inferno
+- `<id>.alloc.json`: top allocation sites grown during the request
+
+Stacks and allocations are process-wide, so requests running concurrently with the
+profiled one show up too; only one request is profiled at a time.
+"""
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_ALLOC_TOP = 50
+
+ARTIFACT_SUFFIXES = {
+    "speedscope": ".speedscope.json",
+    "collapsed": ".collapsed.txt",
+    "alloc": ".alloc.json",
+}
+
+# Threads parked in these functions are waiting, not working; their samples are noise
+_IDLE_FUNCTIONS = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+_busy = threading.Lock()
+_PROFILE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+Frame = Tuple[str, str, int]
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(PROFILE_ADMIN_TOKEN) and token == PROFILE_ADMIN_TOKEN
+
+
+def should_profile(token: Optional[str]) -> bool:
+    """Admin-requested, or sampled at PROFILE_SAMPLE_RATE."""
+    if is_admin(token):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _is_idle(stack: List[Frame]) -> bool:
+    if not stack:
+        return True
+    name, filename, _ = stack[-1]
+    return (os.path.basename(filename), name) in _IDLE_FUNCTIONS
+
+
+def _stack(frame) -> List[Frame]:
+    """Root-first list of (function, file, line)."""
+    out = []
+    while frame is not None:
+        code = frame.f_code
+        out.append((code.co_name, code.co_filename, frame.f_lineno))
+        frame = frame.f_back
+    out.reverse()
+    return out
+
+
+class RequestProfiler:
+    """Sample stacks and allocations between start() and stop()."""
+
+    def __init__(self, label: str, reason: str):
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.reason = reason
+        self.interval = PROFILE_INTERVAL_MS / 1000.0
+        # thread name -> list of sampled stacks
+        self._samples: Dict[str, List[List[Frame]]] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._started_tracemalloc = False
+        self._baseline = None
+        self._snapshot = None
+        self.started_at = 0.0
+        self._t0 = 0.0
+        self.duration_ms = 0.0
+
+    @classmethod
+    def try_start(cls, label: str, reason: str) -> Optional["RequestProfiler"]:
+        """Start a profiler unless another request is already being profiled."""
+        if not _busy.acquire(blocking=False):
+            return None
+        profiler = None
+        try:
+            profiler = cls(label, reason)
+            profiler.start()
+        except BaseException:
+            # Otherwise profiling stays off for the life of the process
+            if profiler is not None and profiler._started_tracemalloc:
+                tracemalloc.stop()
+            _busy.release()
+            raise
+        return profiler
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            self._started_tracemalloc = True
+        self._baseline = tracemalloc.take_snapshot()
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = _stack(frame)
+                if _is_idle(stack):
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                name = names.get(ident, f"thread-{ident}")
+                self._samples.setdefault(name, []).append(stack)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration_ms = (time.perf_counter() - self._t0) * 1000
+        try:
+            self._snapshot = tracemalloc.take_snapshot()
+        finally:
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            _busy.release()
+
+    # Artifacts
+
+    def _speedscope(self) -> Dict[str, Any]:
+        frames: List[Dict[str, Any]] = []
+        index: Dict[Frame, int] = {}
+        profiles = []
+        step = self.interval * 1000
+        for thread_name, stacks in self._samples.items():
+            samples = []
+            for stack in stacks:
+                ids = []
+                for fr in stack:
+                    if fr not in index:
+                        index[fr] = len(frames)
+                        frames.append({"name": fr[0], "file": fr[1], "line": fr[2]})
+                    ids.append(index[fr])
+                samples.append(ids)
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": len(samples) * step,
+                "samples": samples,
+                "weights": [step] * len(samples),
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.label} ({self.id})",
+            "exporter": "visiolingua",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def _collapsed(self) -> str:
+        folded = Counter()
+        for thread_name, stacks in self._samples.items():
+            for stack in stacks:
+                parts = [thread_name] + [f"{name} ({os.path.basename(f)}:{line})" for name, f, line in stack]
+                folded[";".join(p.replace(";", ":") for p in parts)] += 1
+        return "".join(f"{k} {v}\n" for k, v in folded.most_common())
+
+    def _allocations(self) -> Dict[str, Any]:
+        stats = []
+        if self._snapshot is not None and self._baseline is not None:
+            # Leave out tracemalloc itself and the sampler's own stack copies
+            filters = [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__, all_frames=True),
+            ]
+            diff = self._snapshot.filter_traces(filters).compare_to(
+                self._baseline.filter_traces(filters), "traceback")
+            for stat in diff[:PROFILE_ALLOC_TOP]:
+                if stat.size_diff <= 0:
+                    continue
+                stats.append({
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "count_diff": stat.count_diff,
+                    "traceback": [f"{f.filename}:{f.lineno}" for f in stat.traceback],
+                })
+        return {"id": self.id, "label": self.label, "top": stats}
+
+    def save(self) -> Dict[str, Any]:
+        """Write artifacts to PROFILE_DIR and return the profile's metadata."""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.id)
+        with open(base + ARTIFACT_SUFFIXES["speedscope"], "w", encoding="utf-8") as f:
+            json.dump(self._speedscope(), f)
+        with open(base + ARTIFACT_SUFFIXES["collapsed"], "w", encoding="utf-8") as f:
+            f.write(self._collapsed())
+        with open(base + ARTIFACT_SUFFIXES["alloc"], "w", encoding="utf-8") as f:
+            json.dump(self._allocations(), f, indent=2)
+        meta = {
+            "id": self.id,
+            "label": self.label,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 1),
+            "samples": sum(len(s) for s in self._samples.values()),
+        }
+        with open(base + ".meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        _prune()
+        return meta
+
+
+def _prune():
+    metas = sorted(
+        (p for p in os.listdir(PROFILE_DIR) if p.endswith(".meta.json")),
+        key=lambda p: os.path.getmtime(os.path.join(PROFILE_DIR, p)),
+    )
+    for meta in metas[: max(0, len(metas) - PROFILE_KEEP)]:
+        profile_id = meta[: -len(".meta.json")]
+        for suffix in list(ARTIFACT_SUFFIXES.values()) + [".meta.json"]:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Saved profiles, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    out = []
+    for name in os.listdir(PROFILE_DIR):
+        if name.endswith(".meta.json"):
+            try:
+                with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    out.sort(key=lambda m: m.get("started_at", 0), reverse=True)
+    return out
+
+
+def artifact_path(profile_id: str, kind: str) -> Optional[str]:
+    """Path of a saved artifact, or None for unknown ids/kinds."""
+    if kind not in ARTIFACT_SUFFIXES or not _PROFILE_ID_RE.match(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id + ARTIFACT_SUFFIXES[kind])
+    return path if os.path.exists(path) else None
@@ -0,0 +1,145 @@
+"""
+Second-stage reranking of retrieval candidates with a multilingual cross-encoder.
+
+The first stage (hybrid BM25 + vector blend, or multivector ANN search) returns up to
+RERANK_CANDIDATES results. `rerank` scores (query, passage) pairs for as many of them,
+best first-stage first, as fit in RERANK_BUDGET_MS at the model's measured speed, so
+cost depends on the budget and not on the corpus. Scored candidates are reordered by
+cross-encoder score and placed ahead of the unscored rest. Scores are cached per
+(query, point id), so repeated and paginated queries score only new candidates.
+"""
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import os
+import threading
+import time
+
+from services.cpu_profile import inference_slot
+from services.deadline import remaining
+from services.metrics import MODELS_LOADED, histogram, record_cache, stage
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+# First-stage results handed to the reranker
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+# Scored even when the speed estimate says the budget is too small
+RERANK_MIN_PAIRS = int(os.getenv("RERANK_MIN_PAIRS", "5"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+RERANK_MAX_LENGTH = 256
+# Passages are cut before tokenization; the model only sees RERANK_MAX_LENGTH tokens anyway
+PASSAGE_CHARS = 1200
+# Speed assumed until the first batch is measured
+INITIAL_MS_PER_PAIR = 8.0
+
+RERANK_PAIRS = histogram("visiolingua_rerank_pairs", "Candidates scored by the cross-encoder per query",
+                         buckets=(0, 5, 10, 20, 30, 50, 75, 100, 200))
+RERANK_MS_PER_PAIR = histogram("visiolingua_rerank_ms_per_pair", "Measured cross-encoder milliseconds per pair",
+                               buckets=(0.5, 1, 2, 4, 8, 16, 32, 64))
+
+_lock = threading.Lock()
+_scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+_speed = {"ms_per_pair": INITIAL_MS_PER_PAIR}
+
+
+@lru_cache(maxsize=1)
+def get_cross_encoder():
+    # Imported here so importing the router does not load torch when reranking is off
+    from sentence_transformers import CrossEncoder
+    model = CrossEncoder(RERANK_MODEL, device="cpu", max_length=RERANK_MAX_LENGTH)
+    MODELS_LOADED.set(1, model=RERANK_MODEL.rsplit("/", 1)[-1])
+    return model
+
+
+def query_key(query: str) -> str:
+    return hashlib.sha1(f"{RERANK_MODEL}\n{query.strip()}".encode("utf-8")).hexdigest()
+
+
+def _cached(qkey: str, doc_id: str) -> Optional[float]:
+    with _lock:
+        score = _scores.get((qkey, doc_id))
+        if score is not None:
+            _scores.move_to_end((qkey, doc_id))
+        return score
+
+
+def _store(qkey: str, scored: Dict[str, float]):
+    with _lock:
+        for doc_id, score in scored.items():
+            _scores[(qkey, doc_id)] = score
+            _scores.move_to_end((qkey, doc_id))
+        while len(_scores) > RERANK_CACHE_SIZE:
+            _scores.popitem(last=False)
+
+
+def pair_capacity(budget_ms: float) -> int:
+    """How many uncached pairs fit in `budget_ms` at the measured speed."""
+    return max(RERANK_MIN_PAIRS, int(budget_ms / max(_speed["ms_per_pair"], 1e-3)))
+
+
+def _budget_ms() -> float:
+    budget = RERANK_BUDGET_MS
+    left = remaining()
+    if left is not None:
+        # Leave at least half of what is left of the request for generation
+        budget = min(budget, left * 1000 / 2)
+    return budget
+
+
+def rerank(query: str, candidates: List[Dict], top_k: int) -> Tuple[List[Dict], Dict]:
+    """
+    Reorder first-stage `candidates` (dicts with `id` and `content`, best first) and
+    return (top_k results, info). Results carry `rerank_score` when scored; the
+    first-stage `score` is kept. Falls back to first-stage order if the model fails.
+    """
+    info = {"candidates": len(candidates), "scored": 0, "cached": 0}
+    if not candidates:
+        return [], info
+    qkey = query_key(query)
+    capacity = pair_capacity(_budget_ms())
+
+    scores: Dict[str, float] = {}
+    to_score: List[Dict] = []
+    prefix = 0
+    # Longest first-stage prefix whose uncached pairs fit the budget
+    for c in candidates:
+        cached = _cached(qkey, str(c["id"]))
+        if cached is not None:
+            scores[str(c["id"])] = cached
+        elif len(to_score) < capacity:
+            to_score.append(c)
+        else:
+            break
+        prefix += 1
+    info["cached"] = len(scores)
+    for c in candidates[:prefix]:
+        record_cache("rerank", str(c["id"]) in scores)
+
+    if to_score:
+        try:
+            model = get_cross_encoder()
+            pairs = [(query, (c.get("content") or "")[:PASSAGE_CHARS]) for c in to_score]
+            start = time.perf_counter()
+            with inference_slot(), stage("rerank"):
+                predicted = model.predict(pairs, batch_size=32, show_progress_bar=False)
+            ms_per_pair = (time.perf_counter() - start) * 1000 / len(pairs)
+            RERANK_MS_PER_PAIR.observe(ms_per_pair)
+            with _lock:
+                _speed["ms_per_pair"] = 0.7 * _speed["ms_per_pair"] + 0.3 * ms_per_pair
+            fresh = {str(c["id"]): float(s) for c, s in zip(to_score, predicted)}
+            _store(qkey, fresh)
+            scores.update(fresh)
+            info["scored"] = len(fresh)
+        except Exception as e:
+            print(f"Reranking failed, keeping first-stage order: {e}")
+            return candidates[:top_k], info
+    RERANK_PAIRS.observe(info["scored"])
+
+    head = []
+    for c in candidates[:prefix]:
+        c["rerank_score"] = scores[str(c["id"])]
+        head.append(c)
+    head.sort(key=lambda c: c["rerank_score"], reverse=True)
+    return (head + candidates[prefix:])[:top_k], info
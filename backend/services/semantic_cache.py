@@ -0,0 +1,113 @@
+"""
+Per-user semantic cache for /query responses.
+
+Entries hold the normalized query embedding, the ids and scores of the results, the
+generation and the response metrics, tagged with the user's content version
+(services.user_versions). A query is answered from the cache when an entry with the
+same parameters (lang, retrieval mode, filters) has cosine similarity of at least
+SEMANTIC_CACHE_THRESHOLD with it. Entries expire after SEMANTIC_CACHE_TTL seconds and
+are dropped as soon as the user's version changes. At most SEMANTIC_CACHE_MAX_ENTRIES
+entries are kept per user and SEMANTIC_CACHE_MAX_USERS users, least recently used first.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import os
+import threading
+import time
+
+import numpy as np
+
+from services.metrics import gauge, record_cache
+from services.user_versions import get_user_version
+
+# Off by default: E5 query embeddings of different questions often score above an
+# uncalibrated threshold. Calibrate SEMANTIC_CACHE_THRESHOLD on real queries first.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "64"))
+SEMANTIC_CACHE_MAX_USERS = int(os.getenv("SEMANTIC_CACHE_MAX_USERS", "1000"))
+
+CACHE_NAME = "semantic"
+ENTRIES = gauge("visiolingua_semantic_cache_entries", "Entries held by the semantic response cache")
+
+# user_id -> {"version": int, "entries": [entry, ...]} in LRU order
+_users: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_lock = threading.Lock()
+_size = 0
+
+
+def _normalize(vec) -> Optional[np.ndarray]:
+    arr = np.asarray(vec, dtype=np.float32)
+    norm = float(np.linalg.norm(arr))
+    return arr / norm if norm > 0 else None
+
+
+def _set_size(delta: int):
+    global _size
+    _size += delta
+    ENTRIES.set(_size)
+
+
+def _drop_user(user_id: str):
+    state = _users.pop(user_id, None)
+    if state:
+        _set_size(-len(state["entries"]))
+
+
+def lookup(user_id: str, key: str, vec, version: int) -> Optional[Dict[str, Any]]:
+    """Return the cached value of the closest fresh entry above the threshold, if any."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    query = _normalize(vec)
+    hit = None
+    if query is not None:
+        now = time.time()
+        with _lock:
+            state = _users.get(user_id)
+            if state is not None and state["version"] != version:
+                _drop_user(user_id)
+                state = None
+            if state is not None:
+                _users.move_to_end(user_id)
+                fresh = [e for e in state["entries"] if now - e["created_at"] < SEMANTIC_CACHE_TTL]
+                _set_size(len(fresh) - len(state["entries"]))
+                state["entries"] = fresh
+                candidates = [e for e in fresh if e["key"] == key]
+                if candidates:
+                    sims = np.stack([e["vec"] for e in candidates]) @ query
+                    best = int(np.argmax(sims))
+                    if sims[best] >= SEMANTIC_CACHE_THRESHOLD:
+                        hit = dict(candidates[best]["value"], similarity=float(sims[best]))
+    record_cache(CACHE_NAME, hit is not None)
+    return hit
+
+
+def store(user_id: str, key: str, vec, version: int, value: Dict[str, Any]) -> None:
+    """Cache `value` for this query; ignored if the user's content changed meanwhile."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return
+    query = _normalize(vec)
+    if query is None:
+        return
+    with _lock:
+        if get_user_version(user_id) != version:
+            return
+        state = _users.get(user_id)
+        if state is None or state["version"] != version:
+            _drop_user(user_id)
+            state = _users[user_id] = {"version": version, "entries": []}
+        _users.move_to_end(user_id)
+        entries: List[Dict[str, Any]] = state["entries"]
+        entries.append({"key": key, "vec": query, "value": value, "created_at": time.time()})
+        _set_size(1)
+        if len(entries) > SEMANTIC_CACHE_MAX_ENTRIES:
+            del entries[0]
+            _set_size(-1)
+        while len(_users) > SEMANTIC_CACHE_MAX_USERS:
+            _drop_user(next(iter(_users)))
+
+
+def invalidate_user(user_id: str) -> None:
+    with _lock:
+        _drop_user(user_id)
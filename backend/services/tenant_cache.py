@@ -0,0 +1,256 @@
+"""
+In-process vector cache for hot tenants.
+
+A user who sends TENANT_CACHE_MIN_QUERIES queries within TENANT_CACHE_WINDOW seconds
+is "hot": their whole library (up to TENANT_CACHE_MAX_POINTS points) is loaded once
+into contiguous float32 matrices, one per vector space, with L2-normalized rows, next
+to the point ids and the light payloads (content stays encrypted, as stored), and
+one array per filterable payload field. Searches are then one matrix-vector product,
+masked by the query's filters through numpy comparisons on those arrays, and an
+`argpartition` for the top rows; hybrid queries take their corpus from the entry
+instead of scrolling Qdrant.
+
+Entries are tagged with the user's content version (services.user_versions), which
+upload and delete bump, and also expire after TENANT_CACHE_TTL seconds for writes made
+by other processes. Entries are evicted least recently used first once their total
+size passes TENANT_CACHE_MAX_BYTES.
+"""
+from collections import OrderedDict, deque
+from types import SimpleNamespace
+from typing import Any, Deque, Dict, List, Optional
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from db.vector_store import (
+    load_user_corpus, DETECTED_LANG_FIELD, NAME_PREFIX_MAX_LEN, PARENT_TYPES, TIMESTAMP_FIELD,
+)
+from services.deadline import degraded_reasons
+from services.metrics import counter, gauge, record_cache, stage
+from services.model_config import VECTOR_SIZES
+from services.user_versions import get_user_version
+
+TENANT_CACHE_ENABLED = os.getenv("TENANT_CACHE_ENABLED", "0") == "1"
+TENANT_CACHE_MAX_BYTES = int(os.getenv("TENANT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Users with more points than this are always served by Qdrant
+TENANT_CACHE_MAX_POINTS = int(os.getenv("TENANT_CACHE_MAX_POINTS", "20000"))
+# A user is hot after this many queries within TENANT_CACHE_WINDOW seconds
+TENANT_CACHE_MIN_QUERIES = int(os.getenv("TENANT_CACHE_MIN_QUERIES", "3"))
+TENANT_CACHE_WINDOW = float(os.getenv("TENANT_CACHE_WINDOW", "300"))
+TENANT_CACHE_TTL = float(os.getenv("TENANT_CACHE_TTL", "600"))
+# Users whose recent query times are tracked for hotness
+MAX_TRACKED_USERS = 10000
+
+VECTOR_NAMES = ("text", "clip")
+CACHE_NAME = "tenant"
+
+CACHE_BYTES = gauge("visiolingua_tenant_cache_bytes", "Estimated bytes held by the hot-tenant vector cache")
+CACHE_USERS = gauge("visiolingua_tenant_cache_users", "Users held by the hot-tenant vector cache")
+CACHE_LOADS = counter("visiolingua_tenant_cache_loads_total", "Tenant libraries loaded into the vector cache",
+                      ("outcome",))
+
+# user_id -> entry, in LRU order
+_entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+# user_id -> recent query times, for hotness
+_recent: "OrderedDict[str, Deque[float]]" = OrderedDict()
+_lock = threading.Lock()
+_bytes = 0
+
+
+def _update_gauges():
+    CACHE_BYTES.set(_bytes)
+    CACHE_USERS.set(len(_entries))
+
+
+def _drop(user_id: str):
+    global _bytes
+    entry = _entries.pop(user_id, None)
+    if entry is not None:
+        _bytes -= entry["bytes"]
+        _update_gauges()
+
+
+def _is_hot(user_id: str, now: float) -> bool:
+    """Record a query by `user_id` and say whether they are hot. Caller holds _lock."""
+    times = _recent.get(user_id)
+    if times is None:
+        times = _recent[user_id] = deque(maxlen=max(1, TENANT_CACHE_MIN_QUERIES))
+        while len(_recent) > MAX_TRACKED_USERS:
+            _recent.popitem(last=False)
+    _recent.move_to_end(user_id)
+    times.append(now)
+    return len(times) >= TENANT_CACHE_MIN_QUERIES and now - times[0] <= TENANT_CACHE_WINDOW
+
+
+def _normalized(rows: List[Optional[list]], dim: int) -> Dict[str, np.ndarray]:
+    """Stack `rows` into a contiguous float32 matrix of unit rows; zero rows where missing."""
+    mat = np.zeros((len(rows), dim), dtype=np.float32)
+    has = np.zeros(len(rows), dtype=bool)
+    for i, r in enumerate(rows):
+        if r and len(r) == dim:
+            mat[i] = r
+            has[i] = True
+    norms = np.linalg.norm(mat, axis=1)
+    has &= norms > 0
+    mat[has] /= norms[has, None]
+    return {"matrix": np.ascontiguousarray(mat), "has": has}
+
+
+def _fields(points: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Per-point arrays of the payload fields filters test; "" or NaN where missing."""
+    def strings(key):
+        return np.array([p.get(key) or "" for p in points], dtype=str)
+
+    return {
+        "type": strings("type"),
+        "lang": strings("lang"),
+        "detected_lang": strings(DETECTED_LANG_FIELD),
+        "epoch": np.array([p.get(TIMESTAMP_FIELD) if p.get(TIMESTAMP_FIELD) is not None else np.nan
+                           for p in points], dtype=np.float64),
+        "name": np.char.lower(strings("original_name")),
+    }
+
+
+def _load(user_id: str, version: int) -> Optional[Dict[str, Any]]:
+    degraded_before = len(degraded_reasons())
+    with stage("tenant_cache_load"):
+        points = load_user_corpus(user_id, limit=TENANT_CACHE_MAX_POINTS + 1, vector_names=VECTOR_NAMES)
+    if len(degraded_reasons()) > degraded_before:
+        # A partial library would silently hide results until the entry expires
+        CACHE_LOADS.inc(outcome="failed")
+        return None
+    if len(points) > TENANT_CACHE_MAX_POINTS:
+        CACHE_LOADS.inc(outcome="too_large")
+        return None
+    spaces = {name: _normalized([p.pop(f"{name}_vector", None) for p in points], VECTOR_SIZES[name])
+              for name in VECTOR_NAMES}
+    fields = _fields(points)
+    size = sum(s["matrix"].nbytes + s["has"].nbytes for s in spaces.values())
+    size += sum(a.nbytes for a in fields.values())
+    size += sum(len(json.dumps(p, default=str)) for p in points)
+    if size > TENANT_CACHE_MAX_BYTES:
+        CACHE_LOADS.inc(outcome="too_large")
+        return None
+    CACHE_LOADS.inc(outcome="loaded")
+    return {
+        "version": version,
+        "loaded_at": time.time(),
+        "ids": [p["id"] for p in points],
+        "index": {p["id"]: i for i, p in enumerate(points)},
+        "payloads": points,
+        "spaces": spaces,
+        "fields": fields,
+        "bytes": size,
+    }
+
+
+def lookup(user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    The user's cache entry if they are hot, loading it when missing or stale; None
+    otherwise (the caller queries Qdrant). Call once per request: calls count towards
+    hotness.
+    """
+    global _bytes
+    if not TENANT_CACHE_ENABLED:
+        return None
+    now = time.time()
+    version = get_user_version(user_id)
+    with _lock:
+        hot = _is_hot(user_id, now)
+        entry = _entries.get(user_id)
+        if entry is not None and (entry["version"] != version or now - entry["loaded_at"] >= TENANT_CACHE_TTL):
+            _drop(user_id)
+            entry = None
+        if entry is not None:
+            _entries.move_to_end(user_id)
+    if entry is not None or hot:
+        record_cache(CACHE_NAME, entry is not None)
+    if entry is not None or not hot:
+        return entry
+
+    entry = _load(user_id, version)
+    if entry is None:
+        return None
+    with _lock:
+        # An upload or delete during the load makes what was read stale already
+        if get_user_version(user_id) != version:
+            return entry
+        _drop(user_id)
+        _entries[user_id] = entry
+        _bytes += entry["bytes"]
+        while _bytes > TENANT_CACHE_MAX_BYTES and len(_entries) > 1:
+            _drop(next(iter(_entries)))
+        _update_gauges()
+    return entry
+
+
+def invalidate_user(user_id: str) -> None:
+    with _lock:
+        _drop(user_id)
+
+
+def _mask(entry: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> np.ndarray:
+    """payload_matches over every cached point, as one boolean array."""
+    filters = filters or {}
+    fields = entry["fields"]
+    mask = ~np.isin(fields["type"], PARENT_TYPES)
+    if filters.get("types"):
+        mask &= np.isin(fields["type"], filters["types"])
+    if filters.get("langs"):
+        mask &= np.isin(fields["lang"], filters["langs"]) | np.isin(fields["detected_lang"], filters["langs"])
+    # NaN (no timestamp) fails both comparisons, as in payload_matches
+    if filters.get("since"):
+        mask &= fields["epoch"] >= filters["since"].timestamp()
+    if filters.get("until"):
+        mask &= fields["epoch"] <= filters["until"].timestamp()
+    if filters.get("name_prefix"):
+        mask &= np.char.startswith(fields["name"], filters["name_prefix"].lower()[:NAME_PREFIX_MAX_LEN])
+    return mask
+
+
+def corpus(entry: Dict[str, Any], filters: Optional[Dict[str, Any]] = None) -> tuple:
+    """
+    (points, text vectors) matching `filters`, like load_user_corpus: points are
+    copies of the cached payloads with `id`, vectors a matrix with one unit row each.
+    """
+    rows = np.flatnonzero(_mask(entry, filters))
+    points = [dict(entry["payloads"][i]) for i in rows]
+    return points, entry["spaces"]["text"]["matrix"][rows]
+
+
+def payloads(entry: Dict[str, Any], point_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Cached payloads of `point_ids` that exist, keyed by id, like retrieve_points."""
+    index = entry["index"]
+    return {pid: dict(entry["payloads"][index[pid]]) for pid in point_ids if pid in index}
+
+
+def search(entry: Dict[str, Any], queries: List[tuple], limit: int,
+           filters: Optional[Dict[str, Any]] = None) -> List[list]:
+    """
+    Like search_multi: one hit list (objects with `id`, `score`, `payload`) per
+    (vector_name, vector) in `queries`, by cosine similarity, best first.
+    """
+    mask = _mask(entry, filters)
+    out = []
+    with stage("tenant_cache_search"):
+        for name, vector in queries:
+            space = entry["spaces"].get(name)
+            q = np.asarray(vector, dtype=np.float32)
+            q_norm = float(np.linalg.norm(q))
+            if space is None or q_norm == 0 or space["matrix"].shape[1] != q.shape[0]:
+                out.append([])
+                continue
+            scores = space["matrix"] @ (q / q_norm)
+            scores[~(mask & space["has"])] = -np.inf
+            k = min(limit, int(np.count_nonzero(np.isfinite(scores))))
+            if k <= 0:
+                out.append([])
+                continue
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            out.append([SimpleNamespace(id=entry["ids"][i], score=float(scores[i]),
+                                        payload=dict(entry["payloads"][i])) for i in top])
+    return out
@@ -1,7 +1,9 @@
 from functools import lru_cache
-from typing import Tuple
+from typing import List, Tuple
 import os
 
+from services.metrics import MODELS_LOADED, record_cache, stage
+
 try:
     from transformers import pipeline
 except Exception:
@@ -49,9 +51,41 @@ def _get_translator(src_lang: str, tgt_lang: str):
 def translate_text(text: str, src_lang: str, tgt_lang: str) -> str:
     if not text or src_lang == tgt_lang:
         return text
+    hits_before = _get_translator.cache_info().hits
     tr = _get_translator(src_lang, tgt_lang)
+    record_cache("translator", _get_translator.cache_info().hits > hits_before)
+    MODELS_LOADED.set(_get_translator.cache_info().currsize, model="translator")
     if tr is None:
         return text
+    with stage("translate"):
+        return _run_translation(tr, text)
+
+
+def translate_texts(texts: List[str], src_lang: str, tgt_lang: str) -> List[str]:
+    """translate_text for many texts with the same language pair, in one pipeline call."""
+    if not texts or src_lang == tgt_lang:
+        return list(texts)
+    if len(texts) == 1:
+        return [translate_text(texts[0], src_lang, tgt_lang)]
+    hits_before = _get_translator.cache_info().hits
+    tr = _get_translator(src_lang, tgt_lang)
+    record_cache("translator", _get_translator.cache_info().hits > hits_before)
+    MODELS_LOADED.set(_get_translator.cache_info().currsize, model="translator")
+    if tr is None:
+        return list(texts)
+    with stage("translate"):
+        try:
+            if not isinstance(tr, tuple):
+                return [o["translation_text"] for o in tr(list(texts), max_length=512)]
+            p1, p2 = tr
+            mids = [o["translation_text"] for o in p1(list(texts), max_length=512)]
+            return [o["translation_text"] for o in p2(mids, max_length=512)]
+        except Exception:
+            # Fall back to one at a time so one bad input does not drop the batch
+            return [_run_translation(tr, t) for t in texts]
+
+
+def _run_translation(tr, text: str) -> str:
     try:
         # Direct pipeline
         if not isinstance(tr, tuple):
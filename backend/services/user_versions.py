@@ -0,0 +1,25 @@
+"""
+Per-user content version counters.
+
+Every change to a user's library (upload, delete) bumps that user's version, so caches
+can tag entries with the version they were computed at and treat any other version as
+stale. Counters are in-process: writes made by other processes (additional API
+workers, the dataset ingester) are not seen here, so caches must also expire by time.
+"""
+from typing import Dict
+import threading
+
+_versions: Dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def get_user_version(user_id: str) -> int:
+    with _lock:
+        return _versions.get(user_id, 0)
+
+
+def bump_user_version(user_id: str) -> int:
+    with _lock:
+        version = _versions.get(user_id, 0) + 1
+        _versions[user_id] = version
+        return version
@@ -0,0 +1,57 @@
+"""
+Backfill CLIP vectors for points stored without one.
+
+Points ingested while CLIP was disabled (or whose embedding failed) have no `clip`
+vector and `has_clip = False`. With ENABLE_CLIP=1 this job embeds their image, or their
+text for short text points, and adds the vector in place. Placeholder zero vectors left
+by older versions are removed either way.
+
+    python -m services.vector_backfill
+"""
+from typing import Any, Dict, Optional
+import base64
+import os
+
+from db.vector_store import PARENT_FIELD, backfill_clip_vectors
+from services.encryption import decrypt_data
+from services.jobs import ProgressFn
+
+ENABLE_CLIP = os.getenv("ENABLE_CLIP", "0") == "1"
+
+
+def clip_vectors_for(payloads: Dict[str, Dict[str, Any]]) -> Dict[str, list]:
+    """CLIP vectors for the given {id: payload}; points that cannot be embedded are left out."""
+    from services.embeddings import clip_image_embeddings, clip_text_embeddings
+
+    out: Dict[str, list] = {}
+    image_ids, images = [], []
+    text_ids, texts = [], []
+    for point_id, payload in payloads.items():
+        try:
+            if payload.get("type") == "image" and payload.get("image_b64"):
+                images.append(base64.b64decode(decrypt_data(payload["image_b64"])))
+                image_ids.append(point_id)
+            elif payload.get("type") == "text" and payload.get("content") and not payload.get(PARENT_FIELD):
+                texts.append(decrypt_data(payload["content"]))
+                text_ids.append(point_id)
+        except Exception as e:
+            print(f"CLIP backfill skipped {point_id}: {e}")
+    # One forward pass per kind for the whole page
+    if images:
+        for point_id, vec in zip(image_ids, clip_image_embeddings(images)):
+            if vec:
+                out[point_id] = vec
+    if texts:
+        for point_id, vec in zip(text_ids, clip_text_embeddings(texts)):
+            if vec:
+                out[point_id] = vec
+    return out
+
+
+def run_clip_backfill(progress: Optional[ProgressFn] = None) -> Dict[str, int]:
+    """Remove zero placeholders and, when CLIP is enabled, fill missing vectors."""
+    return backfill_clip_vectors(clip_vectors_for if ENABLE_CLIP else None, progress)
+
+
+if __name__ == "__main__":
+    print(run_clip_backfill(lambda done, total: print(f"{done}/{total}", flush=True)))
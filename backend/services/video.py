@@ -0,0 +1,150 @@
+"""
+Keyframe extraction for video uploads.
+
+Frames are decoded as a stream at VIDEO_SAMPLE_FPS; skipped frames are only grabbed,
+never converted. A sampled frame becomes a keyframe when its colour histogram differs
+from the previous keyframe's by more than VIDEO_SCENE_THRESHOLD (Bhattacharyya
+distance), so a static shot yields one keyframe however long it runs. Embedding,
+captioning and storage then scale with the number of scene changes, not the duration.
+
+OpenCV is imported by the functions that decode, so the API starts without it.
+"""
+from typing import Any, Dict, Iterator, List, Optional
+import os
+import tempfile
+
+import numpy as np
+
+from services.metrics import stage
+
+VIDEO_UPLOAD_EXTENSIONS = {".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v", ".mpg", ".mpeg"}
+VIDEO_MAX_BYTES = int(os.getenv("VIDEO_MAX_BYTES", str(500 * 1024 * 1024)))
+VIDEO_SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", "2"))
+VIDEO_SCENE_THRESHOLD = float(os.getenv("VIDEO_SCENE_THRESHOLD", "0.35"))
+# Keyframes closer together than this are merged into the earlier scene
+VIDEO_MIN_SCENE_SECONDS = float(os.getenv("VIDEO_MIN_SCENE_SECONDS", "1.0"))
+VIDEO_MAX_KEYFRAMES = int(os.getenv("VIDEO_MAX_KEYFRAMES", "64"))
+# Only this many keyframes (those covering the most screen time) are captioned by Gemini
+VIDEO_CAPTION_FRAMES = int(os.getenv("VIDEO_CAPTION_FRAMES", "3"))
+VIDEO_CLIP_BATCH = int(os.getenv("VIDEO_CLIP_BATCH", "16"))
+# Stored keyframe images are scaled down to this many pixels on the long side
+KEYFRAME_MAX_SIDE = 512
+KEYFRAME_JPEG_QUALITY = 85
+# Histograms are computed on a small copy of the frame
+HIST_WIDTH = 160
+
+
+def is_video_upload(filename: Optional[str], content_type: Optional[str]) -> bool:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return (content_type or "").startswith("video/") or ext in VIDEO_UPLOAD_EXTENSIONS
+
+
+def spool_to_disk(src, suffix: str, chunk_bytes: int = 1024 * 1024) -> str:
+    """
+    Copy a file object to a temporary file (OpenCV decodes from a path). Raises
+    ValueError past VIDEO_MAX_BYTES. The caller deletes the returned path.
+    """
+    fd, path = tempfile.mkstemp(suffix=suffix or ".mp4", prefix="visiolingua-video-")
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                data = src.read(chunk_bytes)
+                if not data:
+                    break
+                written += len(data)
+                if written > VIDEO_MAX_BYTES:
+                    raise ValueError(f"Video exceeds {VIDEO_MAX_BYTES} bytes")
+                out.write(data)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
+
+
+def _histogram(frame: np.ndarray) -> np.ndarray:
+    import cv2
+
+    h, w = frame.shape[:2]
+    small = cv2.resize(frame, (HIST_WIDTH, max(1, int(h * HIST_WIDTH / w))), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [32, 32], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+def _encode(frame: np.ndarray) -> bytes:
+    import cv2
+
+    h, w = frame.shape[:2]
+    scale = KEYFRAME_MAX_SIDE / max(h, w)
+    if scale < 1:
+        frame = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, KEYFRAME_JPEG_QUALITY])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return buf.tobytes()
+
+
+def iter_keyframes(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield keyframes in order, at most VIDEO_MAX_KEYFRAMES, as dicts with `index`,
+    `time` (seconds from the start), `jpeg` and `duration` (seconds until the next
+    keyframe or the end: how much of the video it stands for). Each keyframe is
+    yielded once its duration is known. Raises ValueError if the file cannot be decoded.
+    """
+    import cv2
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError("Unsupported or corrupt video")
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        if fps <= 0 or fps > 1000:
+            fps = 25.0
+        step = max(1, int(round(fps / VIDEO_SAMPLE_FPS)))
+        last_hist = None
+        pending: Optional[Dict[str, Any]] = None
+        emitted = 0
+        frame_no = -1
+        end_time = 0.0
+        while True:
+            # grab() advances without the colour conversion retrieve() does
+            if not cap.grab():
+                break
+            frame_no += 1
+            end_time = frame_no / fps
+            if frame_no % step:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok or frame is None:
+                continue
+            with stage("video_scene_detect"):
+                hist = _histogram(frame)
+                changed = last_hist is None or cv2.compareHist(
+                    last_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > VIDEO_SCENE_THRESHOLD
+            if not changed or (pending is not None and end_time - pending["time"] < VIDEO_MIN_SCENE_SECONDS):
+                continue
+            last_hist = hist
+            if pending is not None:
+                pending["duration"] = round(end_time - pending["time"], 3)
+                yield pending
+                emitted += 1
+                if emitted >= VIDEO_MAX_KEYFRAMES:
+                    return
+            pending = {"index": emitted, "time": round(end_time, 3), "jpeg": _encode(frame), "duration": 0.0}
+        if pending is not None:
+            pending["duration"] = round(max(end_time - pending["time"], 1.0 / fps), 3)
+            yield pending
+    finally:
+        cap.release()
+
+
+def representative(keyframes: List[Dict[str, Any]], count: int) -> List[Dict[str, Any]]:
+    """The `count` keyframes covering the most screen time, in video order."""
+    longest = sorted(keyframes, key=lambda k: k["duration"], reverse=True)[:max(0, count)]
+    return sorted(longest, key=lambda k: k["index"])
+
+
+def format_time(seconds: float) -> str:
+    minutes, secs = divmod(int(seconds), 60)
+    return f"{minutes}:{secs:02d}"
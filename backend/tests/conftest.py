@@ -0,0 +1,15 @@
+"""
+Tests run against the fake model and Gemini backends from benchmarks/fakes.py and
+qdrant-client's in-memory mode, so they need neither model downloads nor a server.
+
+    cd backend && python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import install_fakes, use_local_qdrant  # noqa: E402
+
+install_fakes()
+use_local_qdrant()
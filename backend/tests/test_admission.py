@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from benchmarks.fakes import FakeLatency
+from routers.query import QueryRequest, query_content
+from services import admission
+
+
+@pytest.fixture
+def tight_query_limits(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+    monkeypatch.setitem(admission._controllers, "query",
+                        admission.AdmissionController("query", concurrency=2, queue_size=2, max_wait=5))
+    monkeypatch.setattr(FakeLatency, "embed", 0.3)
+
+
+def test_query_over_limit_is_rejected_while_loop_stays_responsive(tight_query_limits):
+    async def scenario():
+        lags = []
+        stop = asyncio.Event()
+
+        async def monitor():
+            while not stop.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - start - 0.01)
+
+        probe = asyncio.create_task(monitor())
+        # Distinct users, so only the endpoint limits apply
+        outcomes = await asyncio.gather(
+            *(query_content(QueryRequest(query="beach photos", user_id=f"admission-{i}")) for i in range(8)),
+            return_exceptions=True)
+        stop.set()
+        await probe
+        return outcomes, lags
+
+    outcomes, lags = asyncio.run(scenario())
+    served = [o for o in outcomes if isinstance(o, dict)]
+    rejected = [o for o in outcomes if isinstance(o, HTTPException)]
+    # 2 running + 2 queued are served, the rest find the queue full
+    assert len(served) == 4
+    assert len(rejected) == 4
+    assert all(e.status_code == 503 and "Retry-After" in e.headers for e in rejected)
+    # The blocking embedding ran in worker threads, not on the event loop
+    assert max(lags) < 0.15
@@ -0,0 +1,54 @@
+import asyncio
+import uuid
+
+import numpy as np
+import pytest
+
+from benchmarks.fakes import TEXT_DIM
+from db.vector_store import timestamp_fields, upsert_point
+from routers import query
+from routers.query import QueryRequest, query_content
+from services.encryption import encrypt_data
+
+QUERY = "show lighthouse photos"
+
+
+def _unit(v):
+    return v / np.linalg.norm(v)
+
+
+def _library(user_id: str, rng) -> np.ndarray:
+    """Three text points; only the first mentions the query keyword. Returns its vector."""
+    texts = ["The old lighthouse at dusk, seen from the pier.",
+             "Grocery list: eggs, flour, apples.",
+             "Notes from the quarterly budget meeting."]
+    vectors = [_unit(rng.normal(size=TEXT_DIM)) for _ in texts]
+    for text, vec in zip(texts, vectors):
+        assert upsert_point(str(uuid.uuid4()), {"text": vec.tolist()}, {
+            "user_id": user_id, "type": "text", "lang": "en", **timestamp_fields(), "content": encrypt_data(text)})
+    return vectors[0]
+
+
+def _query_at_cosine(target: np.ndarray, cosine: float, rng) -> list:
+    orth = rng.normal(size=TEXT_DIM)
+    orth = _unit(orth - orth.dot(target) * target)
+    return (cosine * target + np.sqrt(1 - cosine ** 2) * orth).tolist()
+
+
+@pytest.mark.parametrize("cosine, mode, reason", [
+    # Keyword hit, weak meaning: the blend (0.6 x 0.7 + 0.4 x 1.0) would clear 0.8
+    (0.7, "generate", "low_confidence"),
+    (0.95, "retrieve", "lookup"),
+])
+def test_auto_mode_on_hybrid_path_thresholds_dense_cosine(monkeypatch, cosine, mode, reason):
+    rng = np.random.default_rng(1)
+    user_id = f"answer-mode-{cosine}"
+    target = _library(user_id, rng)
+    query_vec = _query_at_cosine(target, cosine, rng)
+    monkeypatch.setattr(query, "multilingual_text_embedding", lambda text: query_vec)
+
+    response = asyncio.run(query_content(QueryRequest(query=QUERY, user_id=user_id, retrieval="hybrid", mode="auto")))
+
+    assert response["metrics"]["retrieval"] == "hybrid"
+    assert response["results"][0]["cosine"] == pytest.approx(cosine, abs=1e-3)
+    assert (response["metrics"]["mode"], response["metrics"]["mode_reason"]) == (mode, reason)
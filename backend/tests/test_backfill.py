@@ -0,0 +1,32 @@
+import uuid
+
+from qdrant_client import models
+
+import db.vector_store as vector_store
+from db.vector_store import NAME_PREFIX_FIELD, TIMESTAMP_FIELD, backfill_payload_fields
+
+
+def _legacy_points(n: int, id_prefix: str, **payload) -> list:
+    """Points as written before the derived fields existed; ids sort by `id_prefix`."""
+    ids = [id_prefix + str(uuid.uuid4())[len(id_prefix):] for _ in range(n)]
+    vector_store.qdrant.upsert(collection_name=vector_store.COLLECTION, points=[
+        models.PointStruct(id=pid, vector={}, payload={"user_id": "backfill", "type": "text", **payload})
+        for pid in ids
+    ])
+    return ids
+
+
+def test_backfill_sets_derived_fields_and_stops_on_fields_it_cannot_clear(monkeypatch):
+    monkeypatch.setattr(vector_store, "DELETE_BATCH_SIZE", 4)
+    # An empty name derives no prefixes, so these points stay in the backfill filter.
+    # They come first in id order: re-reading them must not starve the points after.
+    unnamed = _legacy_points(5, "00000000", timestamp_epoch=1.0, original_name="")
+    dated = _legacy_points(6, "ffffffff", timestamp="2025-03-01T10:00:00+00:00", original_name="Harbour.jpg")
+
+    backfill_payload_fields()
+
+    points = {str(p.id): p.payload for p in vector_store.qdrant.retrieve(
+        collection_name=vector_store.COLLECTION, ids=dated + unnamed)}
+    assert all(points[pid][TIMESTAMP_FIELD] > 0 for pid in dated)
+    assert all("harbour" in points[pid][NAME_PREFIX_FIELD] for pid in dated)
+    assert all(points[pid][NAME_PREFIX_FIELD] == [] for pid in unnamed)
@@ -0,0 +1,30 @@
+import contextvars
+import json
+import time
+
+from benchmarks.corpus import seed_user_corpus
+from services import export
+from services.deadline import start_request_budget
+
+
+def _read_slowly(user_id: str) -> list:
+    start_request_budget(0.5)
+    lines = []
+    for chunk in export.stream_ndjson(user_id):
+        lines.append(json.loads(chunk))
+        if len(lines) == 2:
+            # A slow client: the stream is still being read after the budget ran out
+            time.sleep(0.6)
+    return lines
+
+
+def test_ndjson_export_is_not_cut_off_by_request_deadline(monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_PAGE_SIZE", 4)
+    ids = seed_user_corpus("export-long", 200, image_ratio=0.0)
+
+    # In a copy, so the budget does not outlive the test
+    lines = contextvars.copy_context().run(_read_slowly, "export-long")
+
+    assert not [r for r in lines if r["type"] == "error"]
+    assert lines[-1] == {"type": "end", "count": len(ids)}
+    assert {r["id"] for r in lines if r["type"] == "point"} == set(ids)
@@ -0,0 +1,22 @@
+import tracemalloc
+
+import pytest
+
+from services import profiling
+from services.profiling import RequestProfiler
+
+
+def test_failed_start_releases_the_profiler_slot(monkeypatch):
+    def no_memory():
+        raise MemoryError
+
+    monkeypatch.setattr(tracemalloc, "take_snapshot", no_memory)
+    with pytest.raises(MemoryError):
+        RequestProfiler.try_start("GET /query", "test")
+    monkeypatch.undo()
+
+    assert not tracemalloc.is_tracing()
+    profiler = RequestProfiler.try_start("GET /query", "test")
+    assert profiler is not None
+    profiler.stop()
+    assert not profiling._busy.locked()
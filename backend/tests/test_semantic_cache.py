@@ -0,0 +1,32 @@
+import asyncio
+
+import numpy as np
+
+from benchmarks.corpus import seed_user_corpus
+from benchmarks.fakes import TEXT_DIM
+from routers import query
+from routers.query import QueryRequest, query_content
+
+QUESTIONS = ("where was the beach photo taken", "who is in the birthday picture")
+
+
+def _narrow_band_embeddings():
+    """Distinct questions at cosine ~0.97, as E5 query embeddings often are."""
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=TEXT_DIM)
+    vecs = {q: base + 0.2 * rng.normal(size=TEXT_DIM) for q in QUESTIONS}
+    vecs = {q: (v / np.linalg.norm(v)).tolist() for q, v in vecs.items()}
+    assert float(np.dot(*vecs.values())) > 0.95
+    return vecs
+
+
+def test_distinct_queries_miss_with_default_settings(monkeypatch):
+    vecs = _narrow_band_embeddings()
+    monkeypatch.setattr(query, "multilingual_text_embedding", lambda text: vecs[text])
+    seed_user_corpus("semantic-cache", 20)
+
+    first, second = (asyncio.run(query_content(QueryRequest(query=q, user_id="semantic-cache")))
+                     for q in QUESTIONS)
+
+    assert first["metrics"]["cache"] == "miss"
+    assert second["metrics"]["cache"] == "miss"
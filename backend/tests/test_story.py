@@ -0,0 +1,38 @@
+import base64
+import uuid
+
+import main
+from db.vector_store import timestamp_fields, upsert_point
+from services.encryption import encrypt_data
+
+
+def _store(user_id: str, **payload) -> str:
+    point_id = str(uuid.uuid4())
+    assert upsert_point(point_id, {}, {"user_id": user_id, "lang": "en", **timestamp_fields(), **payload})
+    return point_id
+
+
+def test_story_from_text_is_grounded_in_plaintext(monkeypatch):
+    seen = {}
+    monkeypatch.setattr(main, "generate_story_from_text",
+                        lambda context, lang, theme=None: seen.setdefault("context", context))
+    point_id = _store("story-text", type="text", content=encrypt_data("The lighthouse keeper fed the gulls."))
+
+    result = main._generate_story(main.StoryRequest(query="the sea", user_id="story-text", content_id=point_id))
+
+    assert result["grounded"] is True
+    assert "lighthouse keeper" in seen["context"]
+
+
+def test_story_from_image_gets_decoded_image_bytes(monkeypatch):
+    seen = {}
+    monkeypatch.setattr(main, "generate_story_from_image",
+                        lambda image_bytes, lang, theme=None: seen.setdefault("image", image_bytes))
+    png = b"\x89PNG\r\n\x1a\nfake"
+    point_id = _store("story-image", type="image", content=encrypt_data("a caption"),
+                      image_b64=encrypt_data(base64.b64encode(png).decode("utf-8")))
+
+    result = main._generate_story(main.StoryRequest(query="the sea", user_id="story-image", content_id=point_id))
+
+    assert result["grounded"] is True
+    assert seen["image"] == png
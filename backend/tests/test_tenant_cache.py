@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from db.vector_store import payload_matches
+from services import tenant_cache
+
+NOW = datetime(2026, 6, 1, tzinfo=timezone.utc)
+
+PAYLOADS = [
+    {"type": "image", "lang": "en", "timestamp_epoch": NOW.timestamp(), "original_name": "Beach.png"},
+    {"type": "text", "lang": "fr", "detected_lang": "en", "timestamp_epoch": (NOW - timedelta(days=3)).timestamp()},
+    {"type": "text", "lang": "es", "original_name": "notes.txt"},
+    {"type": "chunk", "lang": "de", "detected_lang": "de", "timestamp_epoch": (NOW + timedelta(days=1)).timestamp()},
+    {"type": "document", "lang": "en", "timestamp_epoch": NOW.timestamp(), "original_name": "report.pdf"},
+    {"lang": "en", "original_name": "beach-2.jpg", "timestamp_epoch": NOW.timestamp()},
+]
+
+
+@pytest.mark.parametrize("filters", [
+    None,
+    {"types": ["text"]},
+    {"types": ["image", "chunk"], "langs": ["de"]},
+    {"langs": ["en"]},
+    {"since": NOW - timedelta(days=1)},
+    {"until": NOW, "langs": ["en", "es"]},
+    {"since": (NOW - timedelta(days=5)).replace(tzinfo=None), "until": NOW + timedelta(days=2)},
+    {"name_prefix": "BEACH"},
+    {"name_prefix": "x" * 40},
+])
+def test_mask_matches_payload_matches(filters):
+    entry = {"payloads": PAYLOADS, "fields": tenant_cache._fields(PAYLOADS)}
+    expected = [payload_matches(p, **(filters or {})) for p in PAYLOADS]
+    assert tenant_cache._mask(entry, filters).tolist() == expected
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from routers import upload
+from routers.upload import upload_content
+from services.user_versions import get_user_version
+
+
+def _upload(**form):
+    return asyncio.run(upload_content(file=None, text=form.get("text"), user_id=form["user_id"], lang="en"))
+
+
+def test_stored_upload_bumps_user_version():
+    before = get_user_version("upload-ok")
+    result = _upload(user_id="upload-ok", text="A quiet morning at the harbour.")
+    assert result["vector_stored"] is True
+    assert get_user_version("upload-ok") == before + 1
+
+
+def test_rejected_upload_keeps_user_version():
+    before = get_user_version("upload-rejected")
+    with pytest.raises(HTTPException) as exc:
+        _upload(user_id="upload-rejected")
+    assert exc.value.status_code == 400
+    assert get_user_version("upload-rejected") == before
+
+
+def test_failed_upsert_keeps_user_version(monkeypatch):
+    monkeypatch.setattr(upload, "upsert_point", lambda *args: False)
+    before = get_user_version("upload-failed")
+    result = _upload(user_id="upload-failed", text="Nothing reaches storage.")
+    assert result["vector_stored"] is False
+    assert get_user_version("upload-failed") == before
@@ -0,0 +1,24 @@
+import base64
+
+from benchmarks.corpus import tiny_png
+from services import embeddings
+from services.encryption import encrypt_data
+from services.vector_backfill import clip_vectors_for
+
+
+def test_clip_vectors_are_computed_in_one_batch_per_kind(monkeypatch):
+    calls = []
+    for name in ("clip_text_embeddings", "clip_image_embeddings"):
+        batched = getattr(embeddings, name)
+        monkeypatch.setattr(embeddings, name,
+                            lambda items, _name=name, _fn=batched: calls.append((_name, len(items))) or _fn(items))
+    monkeypatch.setattr(embeddings, "clip_text_embedding",
+                        lambda text: calls.append(("clip_text_embedding", 1)))
+    payloads = {f"text-{i}": {"type": "text", "content": encrypt_data(f"note number {i}")} for i in range(5)}
+    payloads.update({f"image-{i}": {"type": "image", "image_b64": encrypt_data(
+        base64.b64encode(tiny_png(i)).decode("utf-8"))} for i in range(3)})
+
+    vectors = clip_vectors_for(payloads)
+
+    assert set(vectors) == set(payloads)
+    assert sorted(calls) == [("clip_image_embeddings", 3), ("clip_text_embeddings", 5)]
@@ -0,0 +1,16 @@
+import os
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_app_imports_without_opencv():
+    # cv2 set to None in sys.modules makes any `import cv2` raise ImportError
+    code = (
+        "import sys; sys.modules['cv2'] = None\n"
+        "from benchmarks.fakes import install_fakes; install_fakes()\n"
+        "import main\n"
+    )
+    proc = subprocess.run([sys.executable, "-c", code], cwd=BACKEND, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
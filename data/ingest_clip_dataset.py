@@ -8,17 +8,44 @@ Expected structure options:
 Usage (example):
   python -m data.ingest_clip_dataset --root "C:\\path\\to\\dataset" --user demo_user --lang en
 
-Notes: Uses the same embedding and DB utilities as the API, running on CPU.
+Pipeline: files are split into batches and each batch moves through
+  decode + CLIP + image encryption (process pool) -> captioning of images without a
+  caption (thread pool, bounded) -> batched text embedding (process pool) -> one
+  batched upsert.
+Several batches are in flight at once, so the process pool stays busy while other
+batches wait on Gemini or Qdrant. Point ids are UUIDv5 of "<user>:<filename>", so a
+rerun overwrites instead of duplicating, and a checkpoint manifest next to the dataset
+lets a rerun skip files that are already ingested.
+
+Notes: Uses the same embedding and DB utilities as the API, running on CPU. Each worker
+process loads its own CLIP and E5 models (about 1.5 GB with the default models), so
+the worker count is bounded by memory before cores; the cores are split between the
+workers through the CPU inference profile (services/cpu_profile.py).
 """
-import argparse
-import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
 import base64
-from datetime import datetime
+import io
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+
+# Backend modules import each other as top-level packages (`services.*`, `db.*`)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
 
-from backend.db.vector_store import ensure_collection, upsert_point
-from backend.services.embeddings import clip_image_embedding, multilingual_text_embedding
-from backend.services.generation import configure_gemini, generate_description
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+# Stable namespace so the same user/file always maps to the same point id
+POINT_NAMESPACE = uuid.UUID("5b0f8a52-3f0e-4c1b-9a4e-6f7c2d1e8b90")
+UPSERT_RETRIES = 3
+# Worker processes by default: each holds its own copy of the models, so memory runs
+# out long before a large host's cores are used up
+DEFAULT_WORKERS = 4
 
 
 def load_captions(captions_file: Path) -> dict:
@@ -32,13 +59,256 @@ def load_captions(captions_file: Path) -> dict:
     return caps
 
 
+def point_id_for(user_id: str, name: str) -> str:
+    return str(uuid.uuid5(POINT_NAMESPACE, f"{user_id}:{name}"))
+
+
+class Manifest:
+    """Append-only JSONL checkpoint of ingested files, keyed by name, size and mtime."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._done: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        if path.exists():
+            for line in path.read_text(encoding="utf-8").splitlines():
+                try:
+                    rec = json.loads(line)
+                    self._done[rec["name"]] = (rec["size"], rec["mtime"])
+                except (ValueError, KeyError):
+                    continue  # torn last line after a crash
+
+    def is_done(self, name: str, stat: os.stat_result) -> bool:
+        return self._done.get(name) == (stat.st_size, int(stat.st_mtime))
+
+    def record(self, entries: List[dict]):
+        with self._lock, self.path.open("a", encoding="utf-8") as f:
+            for e in entries:
+                f.write(json.dumps(e) + "\n")
+                self._done[e["name"]] = (e["size"], e["mtime"])
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class Progress:
+    def __init__(self, total: int, every: float = 5.0):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.every = every
+        self._start = time.perf_counter()
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, done: int, failed: int = 0):
+        with self._lock:
+            self.done += done
+            self.failed += failed
+            now = time.perf_counter()
+            if now - self._last >= self.every or self.done + self.failed >= self.total:
+                self._last = now
+                self._report(now)
+
+    def _report(self, now: float):
+        elapsed = now - self._start
+        rate = self.done / elapsed if elapsed else 0.0
+        remaining = self.total - self.done - self.failed
+        eta = f"{remaining / rate:.0f}s" if rate else "-"
+        print(f"[{self.done + self.failed}/{self.total}] ingested={self.done} failed={self.failed} "
+              f"{rate:.1f} img/s eta={eta}", flush=True)
+
+
+# Process pool workers. Model and DB modules are imported lazily so the parent process
+# never loads torch and workers never open a Qdrant connection.
+
+def _init_worker(processes: int):
+    from services.cpu_profile import SETTINGS, apply_profile, resolve_profile
+
+    # One model call at a time per process, the cores split between `processes`. The
+    # resolved settings go to the environment too: importing services.embeddings
+    # applies the profile again and must not take every core back.
+    os.environ[SETTINGS["inference_workers"]] = "1"
+    profile = resolve_profile(processes=processes)
+    for key, name in SETTINGS.items():
+        os.environ[name] = str(profile[key])
+    try:
+        apply_profile(profile)
+    except Exception as e:
+        print(f"⚠️ Could not apply CPU inference profile: {e}")
+
+
+def _prepare_batch(items: List[dict], enable_clip: bool) -> List[dict]:
+    """Read and validate images, compute CLIP vectors and encrypt the image data."""
+    from PIL import Image
+    from services.encryption import encrypt_data
+
+    out, valid = [], []
+    for item in items:
+        try:
+            data = Path(item["path"]).read_bytes()
+            Image.open(io.BytesIO(data)).verify()
+            valid.append({**item, "bytes": data})
+        except Exception as e:
+            out.append({**item, "error": f"unreadable image: {e}"})
+    if not valid:
+        return out
+
+    if enable_clip:
+        from services.embeddings import clip_image_embeddings
+        clip_vecs = clip_image_embeddings([v["bytes"] for v in valid])
+    else:
+        # No placeholder vectors; `python -m services.vector_backfill` adds CLIP later
+        clip_vecs = [None] * len(valid)
+
+    for v, clip_vec in zip(valid, clip_vecs):
+        data = v.pop("bytes")
+        v["clip"] = clip_vec
+        v["image_enc"] = encrypt_data(base64.b64encode(data).decode("utf-8"))
+        if not v.get("caption"):
+            # Only images that still need Gemini captioning carry raw bytes back
+            v["bytes"] = data
+        out.append(v)
+    return out
+
+
+def _embed_texts(texts: List[str]) -> List[list]:
+    from services.embeddings import multilingual_text_embeddings
+    return multilingual_text_embeddings(texts)
+
+
+class Pipeline:
+    def __init__(self, args, manifest: Manifest, progress: Progress, enable_clip: bool):
+        self.args = args
+        self.manifest = manifest
+        self.progress = progress
+        self.enable_clip = enable_clip
+        ctx = multiprocessing.get_context("spawn")
+        self.procs = ProcessPoolExecutor(max_workers=args.workers, mp_context=ctx,
+                                         initializer=_init_worker, initargs=(args.workers,))
+        self.captioners = ThreadPoolExecutor(max_workers=args.caption_concurrency, thread_name_prefix="caption")
+        # Batches in flight; each coordinator thread mostly waits on the pools above
+        self.coordinators = ThreadPoolExecutor(max_workers=args.inflight, thread_name_prefix="batch")
+        self._slots = threading.BoundedSemaphore(args.inflight)
+
+    def _caption(self, image_bytes: bytes) -> str:
+        from services.generation import generate_description
+        try:
+            return generate_description(image_bytes, self.args.lang)
+        except Exception as e:
+            print(f"Caption failed: {e}")
+            return "Image uploaded (caption generation failed)"
+
+    def _upsert(self, points: List[tuple]) -> bool:
+        from db.vector_store import upsert_points
+        for attempt in range(UPSERT_RETRIES):
+            if upsert_points(points):
+                return True
+            time.sleep(2 ** attempt)
+        return False
+
+    def _run_batch(self, items: List[dict]):
+        from db.vector_store import name_fields, timestamp_fields
+        from services.encryption import encrypt_data
+
+        try:
+            prepared = self.procs.submit(_prepare_batch, items, self.enable_clip).result()
+            failed = [p for p in prepared if "error" in p]
+            ready = [p for p in prepared if "error" not in p]
+            for p in failed:
+                print(f"Skip {p['name']}: {p['error']}")
+
+            pending = {i: self.captioners.submit(self._caption, p.pop("bytes"))
+                       for i, p in enumerate(ready) if "bytes" in p}
+            for i, fut in pending.items():
+                ready[i]["caption"] = fut.result()
+
+            text_vecs = self.procs.submit(_embed_texts, [p["caption"] for p in ready]).result() if ready else []
+            points = []
+            for p, text_vec in zip(ready, text_vecs):
+                payload = {
+                    "user_id": self.args.user,
+                    "lang": self.args.lang,
+                    **timestamp_fields(),
+                    "type": "image",
+                    **name_fields(p["name"]),
+                    "content": encrypt_data(p["caption"]),
+                    "image_b64": p["image_enc"],
+                }
+                points.append((p["id"], {"clip": p["clip"], "text": text_vec}, payload))
+
+            if points and not self._upsert(points):
+                print(f"Upsert failed for a batch of {len(points)}; rerun to retry")
+                self.progress.add(0, len(failed) + len(points))
+                return
+            self.manifest.record([
+                {"name": p["name"], "id": p["id"], "size": p["size"], "mtime": p["mtime"]} for p in ready])
+            self.progress.add(len(ready), len(failed))
+        except Exception as e:
+            print(f"Batch failed ({len(items)} files): {e}")
+            self.progress.add(0, len(items))
+        finally:
+            self._slots.release()
+
+    def run(self, items: List[dict]):
+        size = self.args.batch_size
+        try:
+            futures = []
+            for start in range(0, len(items), size):
+                # Backpressure: never hold more than `inflight` batches of image data
+                self._slots.acquire()
+                futures.append(self.coordinators.submit(self._run_batch, items[start:start + size]))
+            for f in futures:
+                f.result()
+        finally:
+            self.coordinators.shutdown()
+            self.captioners.shutdown()
+            self.procs.shutdown()
+
+
+def _scan(images_dir: Path, user_id: str, captions: dict, manifest: Optional[Manifest],
+          limit: Optional[int]) -> tuple:
+    items, skipped = [], 0
+    for p in sorted(images_dir.iterdir()):
+        if p.suffix.lower() not in IMAGE_SUFFIXES or not p.is_file():
+            continue
+        st = p.stat()
+        if manifest is not None and manifest.is_done(p.name, st):
+            skipped += 1
+            continue
+        items.append({
+            "name": p.name,
+            "path": str(p),
+            "id": point_id_for(user_id, p.name),
+            "caption": captions.get(p.name),
+            "size": st.st_size,
+            "mtime": int(st.st_mtime),
+        })
+        if limit and len(items) >= limit:
+            break
+    return items, skipped
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--root", required=True, help="Dataset root folder")
     ap.add_argument("--user", default="demo_user", help="User ID to assign")
     ap.add_argument("--lang", default="en", help="Base language for captions")
     ap.add_argument("--enable_clip", action="store_true", help="Compute CLIP vectors (default true if ENV ENABLE_CLIP=1)")
+    ap.add_argument("--workers", type=int, default=min(DEFAULT_WORKERS, os.cpu_count() or 1),
+                    help=f"Processes for decoding and embedding (default: {DEFAULT_WORKERS} or the CPU count "
+                         "if lower). Each loads its own CLIP and E5 models, about 1.5 GB of memory.")
+    ap.add_argument("--batch-size", type=int, default=32, help="Images per embedding batch and upsert")
+    ap.add_argument("--caption-concurrency", type=int, default=4, help="Concurrent Gemini caption calls")
+    ap.add_argument("--inflight", type=int, default=None, help="Batches in flight (default: 2 x workers)")
+    ap.add_argument("--manifest", default=None, help="Checkpoint file (default: <root>/.ingest-<user>.jsonl)")
+    ap.add_argument("--no-resume", action="store_true", help="Ignore the checkpoint and ingest every file")
+    ap.add_argument("--limit", type=int, default=None, help="Only ingest the first N pending files")
     args = ap.parse_args()
+    args.inflight = args.inflight or 2 * args.workers
+
+    if not os.getenv("ENCRYPTION_KEY"):
+        # Each worker process would otherwise generate its own throwaway key
+        raise SystemExit("ENCRYPTION_KEY must be set so ingested content can be decrypted by the API")
 
     root = Path(args.root)
     images_dir = root / "images"
@@ -47,6 +317,10 @@ def main():
         images_dir = root
 
     ENABLE_CLIP = os.getenv("ENABLE_CLIP", "0") == "1" or args.enable_clip
+
+    from db.vector_store import ensure_collection
+    from services.generation import configure_gemini
+
     ensure_collection()
 
     # Optional Gemini captioning
@@ -55,34 +329,19 @@ def main():
         configure_gemini(gem_key)
 
     captions = load_captions(captions_file)
+    manifest = Manifest(Path(args.manifest) if args.manifest else root / f".ingest-{args.user}.jsonl")
+    items, skipped = _scan(images_dir, args.user, captions, None if args.no_resume else manifest, args.limit)
+    print(f"{len(items)} files to ingest, {skipped} already in {manifest.path.name}; "
+          f"{args.workers} workers, batch size {args.batch_size}")
+    if not items:
+        return
 
-    count = 0
-    for p in images_dir.iterdir():
-        if p.suffix.lower() not in {".jpg", ".jpeg", ".png"}:
-            continue
-        try:
-            content_bytes = p.read_bytes()
-            clip_vec = clip_image_embedding(content_bytes) if ENABLE_CLIP else [0.0] * 512
-            caption = captions.get(p.name)
-            if not caption:
-                caption = generate_description(content_bytes, args.lang)
-            text_vec = multilingual_text_embedding(caption)
-            payload = {
-                "user_id": args.user,
-                "lang": args.lang,
-                "timestamp": datetime.now().isoformat(),
-                "type": "image",
-                "original_name": p.name,
-                "content": caption,
-                "image_b64": base64.b64encode(content_bytes).decode("utf-8"),
-            }
-            vectors = {"clip": clip_vec, "text": text_vec}
-            upsert_point(f"{args.user}:{p.name}", vectors, payload)
-            count += 1
-        except Exception as e:
-            print(f"Skip {p.name}: {e}")
-
-    print(f"Ingested {count} items from {images_dir}")
+    progress = Progress(len(items))
+    start = time.perf_counter()
+    Pipeline(args, manifest, progress, ENABLE_CLIP).run(items)
+    elapsed = time.perf_counter() - start
+    print(f"Ingested {progress.done} items from {images_dir} in {elapsed:.1f}s "
+          f"({progress.done / elapsed if elapsed else 0:.1f} img/s), {progress.failed} failed")
 
 
 if __name__ == "__main__":